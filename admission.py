@@ -0,0 +1,484 @@
+import dataclasses
+import threading
+
+import torch
+
+from model_registry import resident_set_bytes
+
+
+class AdmissionError(RuntimeError):
+    """Raised when a request cannot be served within the memory budget."""
+
+
+def is_out_of_memory(error):
+    """
+    Returns True if an exception means that an allocation failed.
+
+    Parameters
+    ----------
+    error : BaseException
+        The exception raised by a forward pass.
+
+    Returns
+    -------
+    bool
+        Whether the device or host ran out of memory.
+    """
+    if isinstance(error, MemoryError) or type(error).__name__ == "OutOfMemoryError":
+        return True
+    message = str(error).lower()
+    return "out of memory" in message or "not enough memory" in message or "can't allocate memory" in message
+
+
+def kv_bytes_per_token(config, dtype):
+    """
+    Returns the key/value cache size of one token, summed over the layers.
+
+    Parameters
+    ----------
+    config : PretrainedConfig
+        Configuration of the model; Llama-, GPT- and MPT-style attribute names are understood.
+    dtype : torch.dtype
+        Data type of the cache tensors.
+
+    Returns
+    -------
+    int
+        Bytes of the keys and values of one token.
+    """
+    layers = _first(config, "num_hidden_layers", "n_layers", "n_layer", "num_layers")
+    hidden = _first(config, "hidden_size", "d_model", "n_embd")
+    heads = _first(config, "num_attention_heads", "n_heads", "n_head")
+    attn_config = getattr(config, "attn_config", None) or {}
+    kv_heads = getattr(config, "num_key_value_heads", None) or (attn_config.get("kv_n_heads") if isinstance(attn_config, dict) else None) or heads
+    return 2 * layers * kv_heads * (hidden // heads) * torch.empty((), dtype=dtype).element_size()
+
+
+class AdmissionController:
+    """
+    Admits requests into the decode batch only while their estimated memory fits a budget.
+
+    The engine left-pads every row of the batch to the longest sequence, so the key/value cache
+    of a batch grows to ``rows * longest * kv_bytes_per_token``. The controller reserves that
+    size for the final length (prompt plus ``max_new_tokens``) of every running request, and
+    adds the transient activations of a prefill (logits and attention scores of the prompt).
+    A waiting request is admitted when the batch with it still fits the budget; otherwise it
+    stays queued until running requests finish, so the order of arrival is kept.
+
+    Under pressure the controller degrades instead of waiting: when the head of the queue does not
+    fit but would with at least ``min_new_tokens`` new tokens, it is admitted with a smaller
+    ``max_new_tokens``. A request that cannot fit even into an empty batch is shortened at
+    submission, or rejected with an AdmissionError. After an out-of-memory error the engine
+    halves its batch size and the budget is lowered to what was in use; both recover step by step
+    after ``recovery_steps`` steps without another one.
+
+    With a draft model (SpeculativeEngine) every token also has a key/value entry in the draft
+    model's cache, which ``per_token`` includes. An engine that decodes on bucketed shapes
+    (CompiledEngine) pads the batch with filler rows and the cache to a length bucket; with
+    ``batch_buckets`` and ``length_buckets`` set, the estimates use the padded shape.
+
+    Attributes
+    ----------
+    per_token : int
+        Key/value cache bytes of one token, in the main and the draft model.
+    budget : int or None
+        Bytes the running requests may use; None admits everything and only tracks the usage.
+    configured_budget : int or None
+        The budget before it was lowered by out-of-memory errors.
+    min_new_tokens : int
+        Fewest new tokens a request is shortened to.
+    degrade : bool
+        Whether requests are shortened instead of queued or rejected.
+    max_waiting : int or None
+        Waiting requests beyond which new ones are rejected.
+    reserved : int
+        Bytes reserved by the running requests at the end of the last engine step.
+    batch_buckets, length_buckets : tuple of int or None
+        Batch sizes and cache lengths the engine pads the decode batch to; None when it decodes on
+        the exact shapes.
+
+    Methods
+    -------
+    check(prompt_tokens, params, waiting=0):
+        Returns the sampling settings a new request runs with, or raises AdmissionError.
+
+    admit(running, waiting, free):
+        Pops the waiting requests that fit into the batch.
+
+    fits(prompt_tokens):
+        Returns True if a forward pass over a prompt fits next to the running requests.
+
+    request_bytes(prompt_tokens, max_new_tokens):
+        Returns the key/value cache size of one request at its final length.
+
+    cache_bytes(rows, length):
+        Returns the key/value cache size of a batch, padded as the engine pads it.
+
+    prefill_bytes(rows, width):
+        Returns the transient memory of prefilling ``rows`` prompts of ``width`` tokens.
+
+    on_out_of_memory(engine):
+        Shrinks the batch size and the budget after an allocation failed.
+
+    after_step(engine):
+        Updates the reservation and recovers the batch size and budget.
+
+    stats():
+        Returns the budget, the reservations and the admission counters.
+    """
+
+    def __init__(self, config, dtype, device, budget=None, min_new_tokens=64, degrade=True, max_waiting=None, recovery_steps=500,
+                 draft_config=None, batch_buckets=None, length_buckets=None):
+        """
+        Initializes the AdmissionController.
+
+        Parameters
+        ----------
+        config : PretrainedConfig
+            Configuration of the model.
+        dtype : torch.dtype
+            Data type of the model's activations and cache.
+        device : str
+            Device the model runs on; its memory in use is reported by ``stats``.
+        budget : int, optional
+            Bytes the running requests may use (default is None, no limit).
+        min_new_tokens : int, optional
+            Fewest new tokens a request is shortened to (default is 64).
+        degrade : bool, optional
+            Shorten requests instead of queueing or rejecting them (default is True).
+        max_waiting : int, optional
+            Waiting requests beyond which new ones are rejected (default is None, no limit).
+        recovery_steps : int, optional
+            Steps without an out-of-memory error before the batch size and budget grow back
+            (default is 500).
+        draft_config : PretrainedConfig, optional
+            Configuration of the draft model of speculative decoding, whose cache is counted too
+            (default is None).
+        batch_buckets : tuple of int, optional
+            Batch sizes the engine pads the decode batch to (default is None, no padding).
+        length_buckets : tuple of int, optional
+            Cache lengths the engine pads the key/value cache to; longer caches are not padded
+            (default is None, no padding).
+        """
+        self.per_token = kv_bytes_per_token(config, dtype)
+        if draft_config is not None:
+            self.per_token += kv_bytes_per_token(draft_config, dtype)
+        self.batch_buckets = batch_buckets
+        self.length_buckets = length_buckets
+        self.element_size = torch.empty((), dtype=dtype).element_size()
+        self.vocab_size = _first(config, "vocab_size", "padded_vocab_size")
+        self.hidden_size = _first(config, "hidden_size", "d_model", "n_embd")
+        self.num_heads = _first(config, "num_attention_heads", "n_heads", "n_head")
+        self.device = device
+        self.budget = budget
+        self.configured_budget = budget
+        self.min_new_tokens = min_new_tokens
+        self.degrade = degrade
+        self.max_waiting = max_waiting
+        self.recovery_steps = recovery_steps
+        self.reserved = 0
+        self.admitted = 0
+        self.blocked = 0
+        self.rejected = 0
+        self.degraded = 0
+        self.oom_events = 0
+        self._max_batch_size = None
+        self._steps_since_oom = 0
+        self._lock = threading.Lock()
+
+    def request_bytes(self, prompt_tokens, max_new_tokens):
+        """
+        Returns the key/value cache size of one request at its final length.
+
+        Parameters
+        ----------
+        prompt_tokens : int
+            Length of the prompt.
+        max_new_tokens : int
+            Token budget of the answer.
+
+        Returns
+        -------
+        int
+            Bytes.
+        """
+        return self.cache_bytes(1, prompt_tokens + max_new_tokens)
+
+    def cache_bytes(self, rows, length):
+        """
+        Returns the key/value cache size of a batch, padded as the engine pads it.
+
+        Parameters
+        ----------
+        rows : int
+            Requests in the batch.
+        length : int
+            Length of the longest of them.
+
+        Returns
+        -------
+        int
+            Bytes.
+        """
+        return _padded(self.batch_buckets, rows) * _padded(self.length_buckets, length) * self.per_token
+
+    def _fitting_length(self, rows, available):
+        # The longest final length whose padded cache for ``rows`` requests fits ``available`` bytes.
+        if available <= 0:
+            return 0
+        longest = available // (_padded(self.batch_buckets, rows) * self.per_token)
+        if self.length_buckets and longest <= self.length_buckets[-1]:
+            # Lengths inside the bucket range take the whole bucket.
+            return max((bucket for bucket in self.length_buckets if bucket <= longest), default=0)
+        return longest
+
+    def prefill_bytes(self, rows, width):
+        """
+        Returns the transient memory of prefilling ``rows`` prompts of ``width`` tokens.
+
+        Counts the logits of every prompt position (in the model's data type and as float32), the
+        attention scores of one layer and a few hidden-state sized buffers.
+
+        Parameters
+        ----------
+        rows : int
+            Prompts prefilled together.
+        width : int
+            Length of the longest of them.
+
+        Returns
+        -------
+        int
+            Bytes.
+        """
+        logits = rows * width * self.vocab_size * (self.element_size + 4)
+        scores = rows * self.num_heads * width * width * 4
+        hidden = rows * width * self.hidden_size * self.element_size * 8
+        return logits + scores + hidden
+
+    def check(self, prompt_tokens, params, waiting=0):
+        """
+        Returns the sampling settings a new request runs with.
+
+        Parameters
+        ----------
+        prompt_tokens : int
+            Length of the prompt.
+        params : SamplingParams
+            Requested sampling settings.
+        waiting : int, optional
+            Requests already waiting in the engine (default is 0).
+
+        Returns
+        -------
+        SamplingParams
+            ``params``, with a smaller ``max_new_tokens`` when the request alone would not fit.
+
+        Raises
+        ------
+        AdmissionError
+            When the queue is full, or the prompt does not fit into the budget even with
+            ``min_new_tokens`` new tokens.
+        """
+        if self.max_waiting is not None and waiting >= self.max_waiting:
+            with self._lock:
+                self.rejected += 1
+            raise AdmissionError(f"too many requests are waiting for memory ({waiting}), retry later")
+        if self.budget is None:
+            return params
+        fixed = self.prefill_bytes(1, prompt_tokens)
+        if fixed + self.request_bytes(prompt_tokens, params.max_new_tokens) <= self.budget:
+            return params
+        fitting = self._fitting_length(1, self.budget - fixed) - prompt_tokens
+        if self.degrade and fitting >= min(self.min_new_tokens, params.max_new_tokens):
+            with self._lock:
+                self.degraded += 1
+            return dataclasses.replace(params, max_new_tokens=int(fitting))
+        with self._lock:
+            self.rejected += 1
+        needed = fixed + self.request_bytes(prompt_tokens, min(self.min_new_tokens, params.max_new_tokens))
+        raise AdmissionError(
+            f"a prompt of {prompt_tokens} tokens needs about {_format_bytes(needed)}, "
+            f"more than the memory budget of {_format_bytes(self.budget)}"
+        )
+
+    def fits(self, prompt_tokens):
+        """
+        Returns True if a forward pass over a prompt fits next to the running requests.
+
+        Used for passes that are not generations, such as embeddings of a question.
+
+        Parameters
+        ----------
+        prompt_tokens : int
+            Length of the prompt.
+
+        Returns
+        -------
+        bool
+            Whether the pass fits into the budget.
+        """
+        if self.budget is None:
+            return True
+        # The pass builds a cache of its own (with the exact shape) next to the batch's.
+        pass_bytes = self.prefill_bytes(1, prompt_tokens) + prompt_tokens * self.per_token
+        return self.reserved + pass_bytes <= self.budget
+
+    def admit(self, running, waiting, free):
+        """
+        Pops the waiting requests that fit into the batch, oldest first.
+
+        Must be called with the engine's queue lock held. A request whose ``max_new_tokens`` is
+        lowered to fit gets new ``params``.
+
+        Parameters
+        ----------
+        running : list of GenerationRequest
+            Requests in the decode batch.
+        waiting : collections.deque
+            The engine's waiting queue; admitted requests are removed from it.
+        free : int
+            Free batch slots.
+
+        Returns
+        -------
+        tuple
+            ``(admitted, rejected)`` lists; rejected requests can never fit and must be finished
+            with an error by the caller.
+        """
+        admitted, rejected = [], []
+        lengths = [_final_length(request) for request in running]
+        while waiting and len(admitted) < free:
+            request = waiting[0]
+            if self.budget is None:
+                admitted.append(waiting.popleft())
+                continue
+            prompts = [len(candidate.prompt_ids) for candidate in admitted] + [len(request.prompt_ids)]
+            fixed = self.prefill_bytes(len(prompts), max(prompts))
+            rows = len(lengths) + 1
+            longest = max(lengths + [_final_length(request)])
+            if self.cache_bytes(rows, longest) + fixed <= self.budget:
+                lengths.append(_final_length(request))
+                admitted.append(waiting.popleft())
+                continue
+            # The longest final length that fits with this request as an extra row.
+            fitting = self._fitting_length(rows, self.budget - fixed)
+            shortest = len(request.prompt_ids) + min(self.min_new_tokens, request.params.max_new_tokens)
+            if self.degrade and (lengths or admitted) and fitting >= max(lengths + [shortest]):
+                request.params = dataclasses.replace(request.params, max_new_tokens=int(fitting) - len(request.prompt_ids))
+                lengths.append(_final_length(request))
+                admitted.append(waiting.popleft())
+                with self._lock:
+                    self.degraded += 1
+                continue
+            if not running and not admitted:
+                rejected.append(waiting.popleft())
+                continue
+            with self._lock:
+                self.blocked += 1
+            break
+        with self._lock:
+            self.admitted += len(admitted)
+            self.rejected += len(rejected)
+        return admitted, rejected
+
+    def on_out_of_memory(self, engine):
+        """
+        Shrinks the batch size and the budget after an allocation failed.
+
+        Parameters
+        ----------
+        engine : InferenceEngine
+            The engine whose forward pass ran out of memory.
+        """
+        with self._lock:
+            self.oom_events += 1
+            self._steps_since_oom = 0
+            if self._max_batch_size is None:
+                self._max_batch_size = engine.max_batch_size
+            engine.max_batch_size = max(1, min(engine.max_batch_size, len(engine.running) or engine.max_batch_size) // 2)
+            if self.reserved:
+                self.budget = int(0.9 * self.reserved) if self.budget is None else min(self.budget, int(0.9 * self.reserved))
+        if str(self.device).startswith("cuda"):
+            torch.cuda.empty_cache()
+
+    def after_step(self, engine):
+        """
+        Updates the reservation and recovers the batch size and budget.
+
+        Parameters
+        ----------
+        engine : InferenceEngine
+            The engine that just ran a step.
+        """
+        lengths = [_final_length(request) for request in engine.running]
+        self.reserved = self.cache_bytes(len(lengths), max(lengths, default=0)) if lengths else 0
+        if self._max_batch_size is None:
+            return
+        self._steps_since_oom += 1
+        if self._steps_since_oom < self.recovery_steps:
+            return
+        with self._lock:
+            self._steps_since_oom = 0
+            engine.max_batch_size += 1
+            if self.configured_budget is None or self.budget is None:
+                self.budget = self.configured_budget
+            else:
+                self.budget = min(self.configured_budget, int(self.budget * 1.1))
+            if engine.max_batch_size >= self._max_batch_size:
+                engine.max_batch_size = self._max_batch_size
+                self.budget = self.configured_budget
+                self._max_batch_size = None
+
+    def stats(self):
+        """
+        Returns the budget, the reservations and the admission counters.
+
+        Returns
+        -------
+        dict
+            Budget and reserved bytes, memory in use on the device (or resident memory on the
+            CPU), and admitted, blocked, degraded, rejected and out-of-memory counts.
+        """
+        if str(self.device).startswith("cuda"):
+            used = torch.cuda.memory_allocated(self.device)
+        else:
+            used = resident_set_bytes()
+        with self._lock:
+            return {
+                "budget_bytes": self.budget,
+                "configured_budget_bytes": self.configured_budget,
+                "reserved_bytes": self.reserved,
+                "used_bytes": used,
+                "kv_bytes_per_token": self.per_token,
+                "admitted": self.admitted,
+                "blocked": self.blocked,
+                "degraded": self.degraded,
+                "rejected": self.rejected,
+                "oom_events": self.oom_events,
+                "reduced_batch_size": self._max_batch_size is not None,
+            }
+
+
+def _padded(buckets, size):
+    if buckets:
+        for bucket in buckets:
+            if bucket >= size:
+                return bucket
+    return size
+
+
+def _final_length(request):
+    return len(request.prompt_ids) + request.params.max_new_tokens
+
+
+def _format_bytes(size):
+    return f"{size / 2 ** 20:.1f} MiB" if size >= 2 ** 20 else f"{size / 1024:.1f} KiB"
+
+
+def _first(config, *names):
+    for name in names:
+        value = getattr(config, name, None)
+        if value is not None:
+            return value
+    raise ValueError(f"the model config has none of {', '.join(names)}")
@@ -1,43 +1,9 @@
+import os
 import streamlit as st
-import torch
-from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
 import streamlit.components.v1 as components
 
-class ChatBot:
-    def __init__(self, model_path, device="cuda:3", torch_dtype=torch.bfloat16):
-        self.model_path = model_path
-        self.device = device
-        self.config = AutoConfig.from_pretrained(model_path, trust_remote_code=True)
-        self.config.init_device = device
-
-        self.model = AutoModelForCausalLM.from_pretrained(model_path, config=self.config, torch_dtype=torch_dtype, trust_remote_code=True)
-        self.model.eval()
-
-        self.tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
-        self.prompt_template = "### Câu hỏi: {instruction}\n### Trả lời:"
-
-    def generate_response(self, instruction):
-        input_prompt = self.prompt_template.format(instruction=instruction)
-        input_ids = self.tokenizer(input_prompt, return_tensors="pt")
-
-        outputs = self.model.generate(
-            inputs=input_ids["input_ids"].to(self.device),
-            attention_mask=input_ids["attention_mask"].to(self.device),
-            do_sample=True,
-            temperature=1.0,
-            top_k=50,
-            top_p=0.9,
-            max_new_tokens=1024,
-            eos_token_id=self.tokenizer.eos_token_id,
-            pad_token_id=self.tokenizer.pad_token_id
-        )
-
-        response = self.tokenizer.batch_decode(outputs, skip_special_tokens=True)[0]
-        response = response.split("### Trả lời:")[1]
-        return response.strip()
-
-# Initialize ChatBot
-bot = ChatBot("vinai/PhoGPT-4B-Chat")
+# The chatbot is served by server.py; start it with `python server.py` before this app.
+SERVER_URL = os.environ.get("CHAT_SERVER_URL", "http://127.0.0.1:8000")
 
 # Streamlit setup
 st.set_page_config(page_title="DeepSeek Chat", layout="wide")
@@ -159,30 +125,73 @@ html_code = """
         const chatInput = document.getElementById('chat-input');
         const chatDisplay = document.getElementById('chat-display');
 
-        sendButton.addEventListener('click', () => {
+        const history = [];
+        const sessionId = crypto.randomUUID().replace(/-/g, '');
+
+        async function sendMessage() {
             const message = chatInput.value.trim();
-            if (message) {
-                const userMessage = document.createElement('p');
-                userMessage.textContent = `You: ${message}`;
-                chatDisplay.appendChild(userMessage);
+            if (!message) {
+                return;
+            }
+            const userMessage = document.createElement('p');
+            userMessage.textContent = `You: ${message}`;
+            chatDisplay.appendChild(userMessage);
 
-                // Clear the input box
-                chatInput.value = '';
+            // Clear the input box
+            chatInput.value = '';
 
-                // Send the message to Streamlit backend
-                const formData = new FormData();
-                formData.append('message', message);
+            const botMessage = document.createElement('p');
+            botMessage.textContent = 'Bot: ';
+            chatDisplay.appendChild(botMessage);
 
-                fetch('/send_message', {
+            // Stream the answer from the chat server as Server-Sent Events
+            let answer = '';
+            try {
+                const response = await fetch('__SERVER_URL__/chat/stream', {
                     method: 'POST',
-                    body: formData
-                })
-                .then(response => response.json())
-                .then(data => {
-                    const botMessage = document.createElement('p');
-                    botMessage.textContent = `Bot: ${data.response}`;
-                    chatDisplay.appendChild(botMessage);
+                    headers: {'Content-Type': 'application/json'},
+                    body: JSON.stringify({message: message, history: history, session_id: sessionId})
                 });
+                if (!response.ok) {
+                    const error = await response.json();
+                    botMessage.textContent = `Bot: ${error.error}`;
+                    return;
+                }
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                while (true) {
+                    const {value, done} = await reader.read();
+                    if (done) {
+                        break;
+                    }
+                    buffer += decoder.decode(value, {stream: true});
+                    const events = buffer.split('\\n\\n');
+                    buffer = events.pop();
+                    for (const event of events) {
+                        const type = (event.match(/^event: (.*)$/m) || [null, 'message'])[1];
+                        const data = JSON.parse(event.match(/^data: (.*)$/m)[1]);
+                        if (type === 'message') {
+                            answer += data.text;
+                            botMessage.textContent = `Bot: ${answer}`;
+                        } else if (type === 'error') {
+                            botMessage.textContent = `Bot: ${data.error}`;
+                        }
+                    }
+                    chatDisplay.scrollTop = chatDisplay.scrollHeight;
+                }
+            } catch (error) {
+                botMessage.textContent = 'Bot: the chat server is not reachable.';
+                return;
+            }
+            history.push({origin: 'human', message: message});
+            history.push({origin: 'ai', message: answer.trim()});
+        }
+
+        sendButton.addEventListener('click', sendMessage);
+        chatInput.addEventListener('keydown', (event) => {
+            if (event.key === 'Enter') {
+                sendMessage();
             }
         });
     </script>
@@ -191,17 +200,4 @@ html_code = """
 """
 
 # Display the HTML code in Streamlit
-components.html(html_code, height=700, scrolling=True)
-
-# Streamlit backend to handle chatbot responses
-if 'chatbot' not in st.session_state:
-    st.session_state['chatbot'] = ChatBot(model_path="path_to_your_model")
-
-# Endpoint to handle message sending
-def handle_message():
-    message = st.experimental_get_query_params().get('message', [''])[0]
-    if message:
-        response = st.session_state['chatbot'].generate_response(message)
-        st.write({'response': response})
-
-st.experimental_singleton(handle_message)
+components.html(html_code.replace("__SERVER_URL__", SERVER_URL), height=700, scrolling=True)
@@ -0,0 +1,93 @@
+import base64
+import functools
+import hashlib
+import mimetypes
+import os
+import re
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+# Files up to this size are inlined as data URIs instead of being fetched from the static route.
+INLINE_LIMIT = 4096
+
+_COMMENT = re.compile(r"/\*.*?\*/", re.S)
+_SPACE = re.compile(r"\s+")
+_PUNCTUATION = re.compile(r"\s*([{};:,>])\s*")
+_EMPTY_RULE = re.compile(r"[^{}]+\{\}")
+_STATIC_URL = re.compile(r"""url\(\s*['"]?app/static/([^'")\s]+)['"]?\s*\)""")
+
+
+def minify_css(css):
+    """
+    Removes comments, empty rules and unneeded whitespace from a stylesheet.
+
+    Parameters
+    ----------
+    css : str
+        The stylesheet.
+
+    Returns
+    -------
+    str
+        The minified stylesheet.
+    """
+    css = _COMMENT.sub("", css)
+    css = _SPACE.sub(" ", css)
+    css = _PUNCTUATION.sub(r"\1", css)
+    css = css.replace(";}", "}")
+    previous = None
+    while previous != css:
+        previous, css = css, _EMPTY_RULE.sub("", css)
+    return css.strip()
+
+
+@functools.lru_cache(maxsize=None)
+def static_url(name):
+    """
+    Returns the URL of a file of the static folder, for long-lived browser caching.
+
+    Files up to ``INLINE_LIMIT`` bytes are inlined as a data URI. Larger files are served by
+    Streamlit's static route (``server.enableStaticServing``) with a content hash in the query
+    string, so a changed file gets a new URL and an unchanged one is never downloaded twice.
+    The file is read once per process.
+
+    Parameters
+    ----------
+    name : str
+        Path of the file relative to the static folder.
+
+    Returns
+    -------
+    str
+        A data URI or an ``app/static/<name>?v=<hash>`` URL.
+    """
+    with open(os.path.join(STATIC_DIR, name), "rb") as f:
+        data = f.read()
+    if len(data) <= INLINE_LIMIT:
+        mime = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+    return f"app/static/{name}?v={hashlib.sha256(data).hexdigest()[:12]}"
+
+
+@functools.lru_cache(maxsize=None)
+def stylesheet(name="styles.css"):
+    """
+    Returns a stylesheet of the static folder as a ``<style>`` element.
+
+    The file is read and minified once per process, and its ``url('app/static/...')``
+    references are replaced by the inlined or fingerprinted URLs of ``static_url``, so every
+    rerun sends the same short string and no file is read.
+
+    Parameters
+    ----------
+    name : str, optional
+        Path of the stylesheet relative to the static folder (default is "styles.css").
+
+    Returns
+    -------
+    str
+        The HTML ``<style>`` element.
+    """
+    with open(os.path.join(STATIC_DIR, name), encoding="utf-8") as f:
+        css = f.read()
+    css = _STATIC_URL.sub(lambda match: f"url({static_url(match.group(1))})", css)
+    return f"<style>{minify_css(css)}</style>"
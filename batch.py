@@ -0,0 +1,221 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+from chatbot import ChatBot
+from engine import SamplingParams
+
+TEXT_FIELDS = ("message", "prompt", "instruction", "question", "body")
+ID_FIELDS = ("id", "request_id")
+
+
+def read_prompts(path, text_field=None, id_field=None):
+    """
+    Reads the questions of a JSONL file.
+
+    Parameters
+    ----------
+    path : str
+        File with one JSON object per line.
+    text_field : str, optional
+        Field holding the question (default is the first of ``TEXT_FIELDS`` present).
+    id_field : str, optional
+        Field holding a unique identifier (default is the first of ``ID_FIELDS`` present, or the
+        line number).
+
+    Returns
+    -------
+    list of tuple
+        ``(id, question)`` pairs in file order.
+    """
+    prompts = []
+    seen = set()
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            field = text_field or next((name for name in TEXT_FIELDS if name in record), None)
+            if field is None or not isinstance(record.get(field), str):
+                raise ValueError(f"{path}:{number}: no question field (tried {text_field or ', '.join(TEXT_FIELDS)})")
+            key = id_field or next((name for name in ID_FIELDS if name in record), None)
+            prompt_id = record[key] if key is not None else number
+            if prompt_id in seen:
+                raise ValueError(f"{path}:{number}: duplicate id {prompt_id!r}")
+            seen.add(prompt_id)
+            prompts.append((prompt_id, record[field]))
+    return prompts
+
+
+def read_done(path):
+    """
+    Returns the ids already answered in an output file, so an interrupted job can resume.
+
+    A last line cut short by a killed job is removed from the file. Only lines ending in a newline
+    count as complete: a line holding a whole JSON object but no newline was also cut short, and the
+    next run would append to it.
+
+    Parameters
+    ----------
+    path : str
+        The JSONL output of an earlier run; it may not exist.
+
+    Returns
+    -------
+    set
+        Ids of the answered questions.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    valid = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                done.add(json.loads(line)["id"])
+            except (ValueError, KeyError):
+                break
+            valid += len(line)
+    if valid < os.path.getsize(path):
+        with open(path, "r+b") as f:
+            f.truncate(valid)
+    return done
+
+
+def run_batch(bot, prompts, output_path, sampling_params=None, max_in_flight=None, fsync_every=32, progress_every=50,
+              log=sys.stderr):
+    """
+    Answers the questions that are not in the output file yet and appends the answers to it.
+
+    Every answer is written as one JSON line as soon as it finishes; the file is flushed to disk
+    every ``fsync_every`` answers, so a killed job loses at most that many answers and resumes
+    after the last complete line.
+
+    Parameters
+    ----------
+    bot : ChatBot
+        The chatbot answering the questions.
+    prompts : list of tuple
+        ``(id, question)`` pairs.
+    output_path : str
+        JSONL file receiving ``{"id", "response", "prompt_tokens", "output_tokens", "finish_reason"}`` lines.
+    sampling_params : SamplingParams, optional
+        Sampling settings (defaults to the chatbot's).
+    max_in_flight : int, optional
+        Requests queued on the engine at once (default is twice its maximum batch size).
+    fsync_every : int, optional
+        Answers between two flushes to disk (default is 32).
+    progress_every : int, optional
+        Answers between two progress lines (default is 50).
+    log : file, optional
+        Stream receiving progress lines (default is stderr).
+
+    Returns
+    -------
+    dict
+        Answered, skipped and failed questions, elapsed seconds and throughput.
+    """
+    done = read_done(output_path)
+    todo = [(prompt_id, text) for prompt_id, text in prompts if prompt_id not in done]
+    start = time.perf_counter()
+    answered = failed = output_tokens = 0
+    with open(output_path, "a", encoding="utf-8") as out:
+        results = bot.generate_many([text for _, text in todo], sampling_params, max_in_flight)
+        for result in results:
+            record = {
+                "id": todo[result.index][0],
+                "response": result.response,
+                "prompt_tokens": result.prompt_tokens,
+                "output_tokens": result.output_tokens,
+                "finish_reason": result.finish_reason,
+            }
+            if result.error is not None:
+                record["error"] = result.error
+                failed += 1
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            answered += 1
+            output_tokens += result.output_tokens
+            if answered % fsync_every == 0:
+                out.flush()
+                os.fsync(out.fileno())
+            if log is not None and answered % progress_every == 0:
+                elapsed = time.perf_counter() - start
+                print(f"{answered}/{len(todo)} answered, {answered / elapsed:.2f} prompts/s, "
+                      f"{output_tokens / elapsed:.1f} tokens/s", file=log, flush=True)
+        out.flush()
+        os.fsync(out.fileno())
+    elapsed = time.perf_counter() - start
+    return {
+        "answered": answered,
+        "skipped": len(prompts) - len(todo),
+        "failed": failed,
+        "seconds": elapsed,
+        "prompts_per_second": answered / elapsed if elapsed else 0.0,
+        "output_tokens_per_second": output_tokens / elapsed if elapsed else 0.0,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions offline, resuming an interrupted run.")
+    parser.add_argument("input", help="JSONL file with one question per line")
+    parser.add_argument("output", help="JSONL file the answers are appended to; answered ids are skipped")
+    parser.add_argument("--model", default="vinai/PhoGPT-4B-Chat", help='model path, or "tiny" for a random offline model')
+    parser.add_argument("--device", default="auto")
+    parser.add_argument("--field", default=None, help=f"question field (default: first of {', '.join(TEXT_FIELDS)})")
+    parser.add_argument("--id-field", default=None, help=f"id field (default: first of {', '.join(ID_FIELDS)}, or the line number)")
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--max-in-flight", type=int, default=None, help="requests queued at once (default: twice the batch size)")
+    parser.add_argument("--max-new-tokens", type=int, default=512)
+    parser.add_argument("--sample", action="store_true", help="sample instead of greedy decoding")
+    parser.add_argument("--temperature", type=float, default=1.0)
+    parser.add_argument("--top-p", type=float, default=0.9)
+    parser.add_argument("--seed", type=int, default=None)
+    return parser.parse_args(argv)
+
+
+def load_bot(model_path, device, max_batch_size):
+    """
+    Loads the chatbot of a batch job, without response caches.
+
+    Parameters
+    ----------
+    model_path : str
+        Model path, or "tiny" for a small random model that needs no download.
+    device : str
+        Device to run the model on.
+    max_batch_size : int
+        Maximum number of sequences decoded together.
+
+    Returns
+    -------
+    ChatBot
+        The loaded chatbot.
+    """
+    if model_path == "tiny":
+        from benchmark.tiny_model import build_tiny_model, build_tiny_tokenizer
+
+        tokenizer = build_tiny_tokenizer()
+        return ChatBot.from_model(build_tiny_model(tokenizer), tokenizer, max_batch_size=max_batch_size)
+    return ChatBot(model_path, device=device, max_batch_size=max_batch_size, response_cache_path=None,
+                   semantic_cache_dir=None)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    prompts = read_prompts(args.input, args.field, args.id_field)
+    bot = load_bot(args.model, args.device, args.max_batch_size)
+    params = SamplingParams(do_sample=args.sample, temperature=args.temperature, top_p=args.top_p,
+                            max_new_tokens=args.max_new_tokens, seed=args.seed)
+    try:
+        report = run_batch(bot, prompts, args.output, params, args.max_in_flight)
+    finally:
+        bot.engine.stop()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
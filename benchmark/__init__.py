@@ -0,0 +1,2 @@
+from benchmark.prompts import PROMPT_SETS, build_prompts
+from benchmark.runner import compare, environment, run_benchmark
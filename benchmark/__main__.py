@@ -0,0 +1,90 @@
+import argparse
+import json
+import sys
+import time
+
+from benchmark.prompts import PROMPT_SETS, build_prompts
+from benchmark.runner import compare, environment, run_benchmark
+from chatbot import ChatBot
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark",
+        description="Measure latency and throughput of the chatbot's inference engine.",
+    )
+    parser.add_argument("--model", default="tiny", help='model path, or "tiny" for a random offline model (default)')
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--prompt-set", default="faq", choices=sorted(PROMPT_SETS))
+    parser.add_argument("--prompt-tokens", type=int, default=None, help="pad or cut every prompt to this many tokens")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--concurrency", default="1,4", help="comma-separated client counts, one run each")
+    parser.add_argument("--num-requests", type=int, default=16)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--draft-model", default=None, help='draft model for speculative decoding, or "tiny" for a smaller random model')
+    parser.add_argument("--compile", action="store_true", help="decode with a torch.compile-d model on bucketed shapes")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--output", default=None, help="write the JSON report to this file")
+    parser.add_argument("--baseline", default=None, help="JSON report to compare against; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    return parser.parse_args(argv)
+
+
+def load_bot(args):
+    if args.model != "tiny":
+        return ChatBot(
+            args.model,
+            device=args.device,
+            max_batch_size=args.max_batch_size,
+            response_cache_path=None,
+            semantic_cache_dir=None,
+            draft_model_path=args.draft_model,
+            compile=args.compile,
+        )
+    from benchmark.tiny_model import build_tiny_model, build_tiny_tokenizer
+
+    tokenizer = build_tiny_tokenizer()
+    draft_model = None
+    if args.draft_model == "tiny":
+        draft_model = build_tiny_model(tokenizer, hidden_size=32, num_layers=1, num_heads=2, seed=1)
+    return ChatBot.from_model(build_tiny_model(tokenizer), tokenizer, device="cpu", max_batch_size=args.max_batch_size, draft_model=draft_model,
+                              compile=args.compile)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    bot = load_bot(args)
+    prompts = build_prompts(bot.tokenizer, bot.prompt_template, args.prompt_set, args.prompt_tokens)
+
+    runs = []
+    for concurrency in [int(value) for value in args.concurrency.split(",")]:
+        runs.append(run_benchmark(bot.engine, prompts, concurrency, args.num_requests, args.max_new_tokens, args.warmup))
+    bot.engine.stop()
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": vars(args),
+        "environment": environment(),
+        "runs": runs,
+    }
+    if bot.draft_model is not None:
+        report["speculative"] = bot.engine.stats()
+    if args.compile:
+        report["compiled"] = bot.engine.stats()
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,538 @@
+import argparse
+import dataclasses
+import http.client
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+from benchmark.prompts import PROMPT_SETS
+from benchmark.runner import environment, summarize
+from model_registry import resident_set_bytes
+
+ARRIVALS = ("closed", "poisson", "ramp")
+THINK_TIMES = ("exponential", "constant", "uniform")
+APP_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test_UI.py")
+
+HistoryMessage = namedtuple("HistoryMessage", ("origin", "message"))
+
+
+class TurnResult:
+    """
+    A class to record one simulated chat turn.
+
+    Attributes
+    ----------
+    start : float
+        ``time.perf_counter()`` when the message was sent.
+    ttft : float or None
+        Seconds until the first chunk of the answer, None when the target does not stream.
+    latency : float or None
+        Seconds until the answer was complete.
+    chars : int
+        Length of the answer (0 for the app target, which does not return it).
+    reruns : int
+        Streamlit script runs caused by the turn (0 for other targets).
+    error : str or None
+        Why the turn failed.
+    """
+    __slots__ = ("start", "ttft", "latency", "chars", "reruns", "error")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.ttft = None
+        self.latency = None
+        self.chars = 0
+        self.reruns = 0
+        self.error = None
+
+    def finish(self, chars=0, error=None):
+        self.latency = time.perf_counter() - self.start
+        self.chars = chars
+        self.error = error
+        return self
+
+
+class BotTarget:
+    """
+    Sends the simulated chats straight to a ChatBot in this process.
+
+    Attributes
+    ----------
+    bot : ChatBot
+        The chatbot under test.
+    params : SamplingParams
+        The chatbot's sampling settings with the load test's token budget.
+    """
+    name = "bot"
+
+    def __init__(self, bot, max_new_tokens=64):
+        self.bot = bot
+        self.params = dataclasses.replace(bot.sampling_params, max_new_tokens=max_new_tokens)
+
+    def session(self):
+        return _BotSession(self)
+
+    def memory(self):
+        return resident_set_bytes()
+
+    def close(self):
+        self.bot.engine.stop()
+
+
+class _BotSession:
+    def __init__(self, target):
+        self.target = target
+        self.session_id = uuid.uuid4().hex
+        self.history = []
+
+    def send(self, question):
+        result = TurnResult()
+        chunks = []
+        try:
+            for chunk in self.target.bot.stream_response(question, self.target.params, self.history, self.session_id):
+                if result.ttft is None:
+                    result.ttft = time.perf_counter() - result.start
+                chunks.append(chunk)
+        except Exception as error:
+            return result.finish(error=f"{type(error).__name__}: {error}")
+        answer = "".join(chunks).strip()
+        self.history += [HistoryMessage("human", question), HistoryMessage("ai", answer)]
+        return result.finish(len(answer))
+
+
+class HttpTarget:
+    """
+    Sends the simulated chats to the ``/chat/stream`` endpoint of ``server.py``.
+
+    The server's memory is read from its ``/health`` endpoint.
+
+    Attributes
+    ----------
+    url : str
+        Base URL of the server.
+    max_new_tokens : int
+        Token budget sent with every message.
+    timeout : float
+        Socket timeout in seconds.
+    """
+    name = "http"
+
+    def __init__(self, url, max_new_tokens=64, timeout=300.0):
+        self.url = url
+        self.max_new_tokens = max_new_tokens
+        self.timeout = timeout
+        parts = urlsplit(url)
+        self._host, self._port = parts.hostname, parts.port or 80
+
+    def session(self):
+        return _HttpSession(self)
+
+    def memory(self):
+        try:
+            status, body = self._request("GET", "/health")
+            return json.loads(body).get("rss_bytes") if status == 200 else None
+        except (OSError, ValueError):
+            return None
+
+    def close(self):
+        pass
+
+    def _request(self, method, path, payload=None):
+        connection = http.client.HTTPConnection(self._host, self._port, timeout=self.timeout)
+        try:
+            body = json.dumps(payload).encode("utf-8") if payload is not None else None
+            connection.request(method, path, body, {"Content-Type": "application/json"})
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            connection.close()
+
+
+class _HttpSession:
+    def __init__(self, target):
+        self.target = target
+        self.session_id = uuid.uuid4().hex
+        self.history = []
+
+    def send(self, question):
+        target = self.target
+        result = TurnResult()
+        payload = {"message": question, "history": self.history, "session_id": self.session_id,
+                   "max_new_tokens": target.max_new_tokens}
+        connection = http.client.HTTPConnection(target._host, target._port, timeout=target.timeout)
+        chunks = []
+        try:
+            connection.request("POST", "/chat/stream", json.dumps(payload).encode("utf-8"),
+                               {"Content-Type": "application/json"})
+            response = connection.getresponse()
+            if response.status != 200:
+                return result.finish(error=f"HTTP {response.status}")
+            event = None
+            for line in response:
+                line = line.decode("utf-8").rstrip("\r\n")
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line[5:])
+                    if event == "error":
+                        return result.finish(error=f"HTTP {data.get('status')}: {data.get('error')}")
+                    if event is None and "text" in data:
+                        if result.ttft is None:
+                            result.ttft = time.perf_counter() - result.start
+                        chunks.append(data["text"])
+                elif not line:
+                    event = None
+        except (OSError, ValueError) as error:
+            return result.finish(error=f"{type(error).__name__}: {error}")
+        finally:
+            connection.close()
+        answer = "".join(chunks).strip()
+        self.history += [{"origin": "human", "message": question}, {"origin": "ai", "message": answer}]
+        return result.finish(len(answer))
+
+
+class AppTarget:
+    """
+    Runs the Streamlit chat app headless, one ``AppTest`` per simulated user.
+
+    Every user opens the page (one script run) and then submits the chat form for every
+    message; the submit reruns the whole script, which streams the answer before it returns, so
+    the turn latency is the rerun time the user waits for. There is no time to first token.
+    All users share the process, and therefore the app's cached resources and the model; their
+    conversations are written to the app's conversation store.
+
+    Attributes
+    ----------
+    script : str
+        Path of the Streamlit script.
+    timeout : float
+        Longest script run in seconds.
+    """
+    name = "app"
+
+    def __init__(self, script=APP_SCRIPT, timeout=300.0):
+        from streamlit.testing.v1 import AppTest
+
+        self.script = script
+        self.timeout = timeout
+        self._app_test = AppTest
+
+    def session(self):
+        return _AppSession(self)
+
+    def memory(self):
+        return resident_set_bytes()
+
+    def close(self):
+        pass
+
+
+class _AppSession:
+    def __init__(self, target):
+        self.app = target._app_test.from_file(target.script, default_timeout=target.timeout)
+        self.opened = False
+
+    def send(self, question):
+        reruns = 0
+        result = TurnResult()
+        try:
+            if not self.opened:
+                self.app.run()
+                self.opened = True
+                reruns += 1
+                result = TurnResult()
+            self.app.text_input(key="human_prompt").input(question)
+            self.app.get("form")[0].button[0].click().run()
+            reruns += 1
+        except Exception as error:
+            result.finish(error=f"{type(error).__name__}: {error}")
+            result.reruns = reruns
+            return result
+        error = f"script raised: {self.app.exception[0].message}" if self.app.exception else None
+        result.finish(error=error)
+        result.reruns = reruns
+        return result
+
+
+class LoadProfile:
+    """
+    A class to describe when simulated users arrive and how they chat.
+
+    Attributes
+    ----------
+    users : int
+        Number of simulated users.
+    arrival : str
+        "closed" starts every user at once; "poisson" starts users with exponential gaps at
+        ``rate`` users per second; "ramp" starts them evenly over ``ramp_seconds``.
+    rate : float
+        Arrival rate of the "poisson" process, in users per second.
+    ramp_seconds : float
+        Length of the "ramp".
+    turns : int
+        Messages each user sends before leaving.
+    think_time : float
+        Mean pause between an answer and the user's next message, in seconds.
+    think_distribution : str
+        "exponential", "constant" or "uniform" (between 0 and twice the mean).
+    duration : float or None
+        Stop sending new messages after this many seconds.
+    """
+
+    def __init__(self, users, arrival="closed", rate=1.0, ramp_seconds=10.0, turns=5, think_time=2.0,
+                 think_distribution="exponential", duration=None):
+        if arrival not in ARRIVALS:
+            raise ValueError(f"Unknown arrival process: {arrival}")
+        if think_distribution not in THINK_TIMES:
+            raise ValueError(f"Unknown think-time distribution: {think_distribution}")
+        self.users = users
+        self.arrival = arrival
+        self.rate = rate
+        self.ramp_seconds = ramp_seconds
+        self.turns = turns
+        self.think_time = think_time
+        self.think_distribution = think_distribution
+        self.duration = duration
+
+    def arrival_times(self, rng):
+        """
+        Returns the start offset of every user in seconds.
+        """
+        if self.arrival == "closed":
+            return [0.0] * self.users
+        if self.arrival == "ramp":
+            return [self.ramp_seconds * user / self.users for user in range(self.users)]
+        times, now = [], 0.0
+        for _ in range(self.users):
+            times.append(now)
+            now += rng.expovariate(self.rate)
+        return times
+
+    def pause(self, rng):
+        """
+        Returns one think time in seconds.
+        """
+        if self.think_time <= 0:
+            return 0.0
+        if self.think_distribution == "constant":
+            return self.think_time
+        if self.think_distribution == "uniform":
+            return rng.uniform(0, 2 * self.think_time)
+        return rng.expovariate(1 / self.think_time)
+
+
+def run_load(target, profile, questions, sample_interval=1.0, seed=0):
+    """
+    Simulates concurrent chat users against a target and measures how it copes.
+
+    Every user runs in its own thread: it arrives according to the profile, sends ``turns``
+    questions drawn from ``questions`` and thinks between the answer and its next question. A
+    sampler records the target's memory and the number of users waiting for an answer every
+    ``sample_interval`` seconds.
+
+    Parameters
+    ----------
+    target : BotTarget, HttpTarget or AppTarget
+        What the users talk to.
+    profile : LoadProfile
+        Arrivals, turns and think times of the users.
+    questions : list of str
+        Questions the users pick from at random.
+    sample_interval : float, optional
+        Seconds between two memory samples (default is 1).
+    seed : int, optional
+        Seed of the arrival, think-time and question choices (default is 0).
+
+    Returns
+    -------
+    dict
+        Throughput, latency percentiles, errors, reruns and the memory timeline of the run.
+    """
+    rng = random.Random(seed)
+    offsets = profile.arrival_times(rng)
+    seeds = [rng.random() for _ in offsets]
+    results = []
+    lock = threading.Lock()
+    waiting = [0]
+    start = time.perf_counter()
+    stop = threading.Event()
+
+    def user(offset, user_seed):
+        user_rng = random.Random(user_seed)
+        if stop.wait(offset):
+            return
+        session = target.session()
+        for turn in range(profile.turns):
+            if profile.duration is not None and time.perf_counter() - start >= profile.duration:
+                return
+            with lock:
+                waiting[0] += 1
+            result = session.send(user_rng.choice(questions))
+            with lock:
+                waiting[0] -= 1
+                results.append(result)
+            if turn + 1 < profile.turns and stop.wait(profile.pause(user_rng)):
+                return
+
+    timeline = []
+
+    def sample():
+        while True:
+            with lock:
+                active = waiting[0]
+            timeline.append({"seconds": round(time.perf_counter() - start, 3), "waiting_users": active,
+                             "rss_bytes": target.memory()})
+            if stop.wait(sample_interval):
+                return
+
+    threads = [threading.Thread(target=user, args=args, daemon=True) for args in zip(offsets, seeds)]
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    finally:
+        stop.set()
+        sampler.join()
+    elapsed = time.perf_counter() - start
+
+    done = [result for result in results if result.error is None]
+    errors = {}
+    for result in results:
+        if result.error is not None:
+            errors[result.error] = errors.get(result.error, 0) + 1
+    memory = [sample["rss_bytes"] for sample in timeline if sample["rss_bytes"] is not None]
+    return {
+        "target": target.name,
+        "users": profile.users,
+        "arrival": profile.arrival,
+        "turns": len(results),
+        "completed": len(done),
+        "failed": len(results) - len(done),
+        "errors": errors,
+        "seconds": elapsed,
+        "turns_per_second": len(done) / elapsed if elapsed else 0.0,
+        "chars_per_second": sum(result.chars for result in done) / elapsed if elapsed else 0.0,
+        "ttft": summarize([result.ttft for result in done if result.ttft is not None]),
+        "latency": summarize([result.latency for result in done]),
+        "reruns": sum(result.reruns for result in results),
+        "reruns_per_turn": sum(result.reruns for result in results) / len(results) if results else 0.0,
+        "peak_waiting_users": max((sample["waiting_users"] for sample in timeline), default=0),
+        "peak_rss_bytes": max(memory, default=None),
+        "timeline": timeline,
+    }
+
+
+def saturation(runs, min_gain=0.1):
+    """
+    Returns the first user count whose throughput did not grow with the added users.
+
+    Parameters
+    ----------
+    runs : list of dict
+        Outputs of ``run_load`` with increasing user counts.
+    min_gain : float, optional
+        Smallest relative throughput gain that still counts as growth (default is 0.1).
+
+    Returns
+    -------
+    int or None
+        Users of the first saturated run, None if throughput kept growing.
+    """
+    for previous, run in zip(runs, runs[1:]):
+        if run["turns_per_second"] < previous["turns_per_second"] * (1 + min_gain) or run["failed"]:
+            return run["users"]
+    return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark.load",
+        description="Simulate concurrent chat users against the chatbot, the HTTP server or the Streamlit app.",
+    )
+    parser.add_argument("--target", default="bot", choices=("bot", "http", "app"))
+    parser.add_argument("--model", default="tiny", help='model path for the bot and app targets, or "tiny" for a random offline model (default)')
+    parser.add_argument("--device", default="auto")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="server of the http target")
+    parser.add_argument("--script", default=APP_SCRIPT, help="Streamlit script of the app target")
+    parser.add_argument("--users", default="1,10,50", help="comma-separated user counts, one run each")
+    parser.add_argument("--arrival", default="closed", choices=ARRIVALS)
+    parser.add_argument("--rate", type=float, default=2.0, help="users per second of the poisson arrivals")
+    parser.add_argument("--ramp", type=float, default=10.0, help="seconds over which the ramp arrivals start")
+    parser.add_argument("--turns", type=int, default=5, help="messages per user")
+    parser.add_argument("--think-time", type=float, default=2.0, help="mean seconds between an answer and the next message")
+    parser.add_argument("--think-distribution", default="exponential", choices=THINK_TIMES)
+    parser.add_argument("--duration", type=float, default=None, help="stop sending new messages after this many seconds")
+    parser.add_argument("--prompt-set", default="faq", choices=sorted(PROMPT_SETS))
+    parser.add_argument("--max-new-tokens", type=int, default=64, help="token budget per answer (bot and http targets)")
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="seconds between memory samples")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="write the JSON report to this file")
+    return parser.parse_args(argv)
+
+
+def load_target(args):
+    if args.target == "http":
+        return HttpTarget(args.url, args.max_new_tokens)
+    from chatbot import ChatBot
+
+    if args.model == "tiny":
+        from benchmark.tiny_model import build_tiny_model, build_tiny_tokenizer
+
+        tokenizer = build_tiny_tokenizer()
+        bot = ChatBot.from_model(build_tiny_model(tokenizer), tokenizer, max_batch_size=args.max_batch_size)
+    else:
+        bot = ChatBot(args.model, device=args.device, max_batch_size=args.max_batch_size, response_cache_path=None,
+                      semantic_cache_dir=None)
+    if args.target == "bot":
+        return BotTarget(bot, args.max_new_tokens)
+    # The app acquires its model from the registry; every model path resolves to the chatbot loaded here.
+    # Entries of several keys then share one bot, so none may be unloaded (which stops its engine).
+    import model_registry
+
+    model_registry.registry.idle_timeout = None
+    model_registry.registry.loader = lambda *key: bot
+    return AppTarget(args.script)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    target = load_target(args)
+    questions = PROMPT_SETS[args.prompt_set]
+    runs = []
+    try:
+        for users in [int(value) for value in args.users.split(",")]:
+            profile = LoadProfile(users, args.arrival, args.rate, args.ramp, args.turns, args.think_time,
+                                  args.think_distribution, args.duration)
+            run = run_load(target, profile, questions, args.sample_interval, args.seed)
+            runs.append(run)
+            print(f"{users} users: {run['turns_per_second']:.2f} turns/s, p95 latency "
+                  f"{run['latency']['p95'] or 0:.2f}s, {run['failed']} failed", file=sys.stderr, flush=True)
+    finally:
+        target.close()
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": vars(args),
+        "environment": environment(),
+        "saturation_users": saturation(runs),
+        "runs": runs,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+PROMPT_SETS = {
+    "faq": [
+        "Thủ đô của Việt Nam là gì?",
+        "Làm thế nào để đổi mật khẩu tài khoản?",
+        "Giờ làm việc của bộ phận hỗ trợ khách hàng là mấy giờ?",
+        "Tôi có thể thanh toán bằng thẻ tín dụng không?",
+        "Phí vận chuyển nội thành là bao nhiêu?",
+        "Làm sao để hủy đơn hàng đã đặt?",
+        "Chính sách đổi trả sản phẩm như thế nào?",
+        "Tôi quên tên đăng nhập thì phải làm gì?",
+    ],
+    "open": [
+        "Hãy viết một đoạn văn ngắn giới thiệu về vịnh Hạ Long.",
+        "Giải thích sự khác nhau giữa trí tuệ nhân tạo và học máy.",
+        "Viết một bài thơ lục bát về mùa thu Hà Nội.",
+        "Tóm tắt lịch sử hình thành của thành phố Hồ Chí Minh.",
+        "Cho tôi năm lời khuyên để học lập trình Python hiệu quả.",
+        "Phân tích ưu và nhược điểm của việc làm việc từ xa.",
+        "Kể một câu chuyện ngắn về một chú mèo đi lạc.",
+        "Hướng dẫn nấu món phở bò truyền thống.",
+    ],
+}
+
+
+def build_prompts(tokenizer, prompt_template, prompt_set="faq", prompt_tokens=None):
+    """
+    Turns a named prompt set into prompt token ids.
+
+    Parameters
+    ----------
+    tokenizer : PreTrainedTokenizer
+        The tokenizer of the model under test.
+    prompt_template : str
+        Template with an ``{instruction}`` field, usually ``ChatBot.prompt_template``.
+    prompt_set : str, optional
+        Key of ``PROMPT_SETS`` (default is "faq").
+    prompt_tokens : int, optional
+        Exact prompt length in tokens; questions are repeated or cut to reach it
+        (default keeps the natural length).
+
+    Returns
+    -------
+    list of list of int
+        One list of token ids per prompt.
+    """
+    prompts = []
+    for instruction in PROMPT_SETS[prompt_set]:
+        input_ids = tokenizer(prompt_template.format(instruction=instruction))["input_ids"]
+        if prompt_tokens is not None:
+            while len(input_ids) < prompt_tokens:
+                input_ids = input_ids + tokenizer(" " + instruction, add_special_tokens=False)["input_ids"]
+            input_ids = input_ids[-prompt_tokens:]
+        prompts.append(input_ids)
+    return prompts
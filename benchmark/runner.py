@@ -0,0 +1,235 @@
+import platform
+import resource
+import sys
+import threading
+import time
+
+import torch
+
+from engine import SamplingParams
+
+
+def percentile(values, q):
+    """
+    Returns the ``q``-th percentile of a list using linear interpolation.
+
+    Parameters
+    ----------
+    values : list of float
+        The samples.
+    q : float
+        Percentile between 0 and 100.
+
+    Returns
+    -------
+    float or None
+        The percentile, or None for an empty list.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(values):
+    """
+    Returns mean, p50, p95 and p99 of a list of latencies.
+
+    Parameters
+    ----------
+    values : list of float
+        Latencies in seconds.
+
+    Returns
+    -------
+    dict
+        The summary statistics.
+    """
+    return {
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+    }
+
+
+def peak_rss_bytes():
+    """
+    Returns the peak resident memory of the current process.
+
+    Returns
+    -------
+    int
+        Peak resident set size in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RequestTrace:
+    """
+    A class to record the timeline of one benchmark request.
+
+    Attributes
+    ----------
+    start : float
+        ``time.perf_counter()`` when the request was submitted.
+    token_times : list of float
+        Arrival time of every generated token.
+    end : float
+        Time the request finished.
+    ttft : float
+        Time to first token in seconds.
+    inter_token : list of float
+        Gaps between consecutive tokens in seconds.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.token_times = []
+        self.end = None
+
+    @property
+    def ttft(self):
+        return self.token_times[0] - self.start if self.token_times else None
+
+    @property
+    def inter_token(self):
+        return [later - earlier for earlier, later in zip(self.token_times, self.token_times[1:])]
+
+
+def run_benchmark(engine, prompts, concurrency=1, num_requests=None, max_new_tokens=64, warmup=1):
+    """
+    Drives an inference engine with a fixed prompt set at a given concurrency.
+
+    Every client thread submits one request at a time (closed loop) and consumes its token
+    stream, so the trace contains the real arrival time of each token. Requests use greedy
+    decoding and ignore the end-of-sequence token, so every run generates the same number of
+    tokens and results are comparable between runs.
+
+    Parameters
+    ----------
+    engine : InferenceEngine
+        The engine under test, usually ``ChatBot.engine``. Any object whose
+        ``submit(prompt_ids, params)`` returns a request with a ``stream()`` of token ids works.
+    prompts : list of list of int
+        Prompt token ids, used round-robin.
+    concurrency : int, optional
+        Number of concurrent clients (default is 1).
+    num_requests : int, optional
+        Total number of measured requests (default is ``len(prompts)``).
+    max_new_tokens : int, optional
+        Tokens generated per request (default is 64).
+    warmup : int, optional
+        Unmeasured requests sent first to prime caches and kernels (default is 1).
+
+    Returns
+    -------
+    dict
+        Latency, throughput and memory metrics of the run.
+    """
+    params = SamplingParams(do_sample=False, max_new_tokens=max_new_tokens, ignore_eos=True)
+    for index in range(warmup):
+        engine.submit(prompts[index % len(prompts)], params).wait()
+
+    num_requests = num_requests or len(prompts)
+    traces = []
+    counter = iter(range(num_requests))
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            trace = RequestTrace()
+            request = engine.submit(prompts[index % len(prompts)], params)
+            for _ in request.stream():
+                trace.token_times.append(time.perf_counter())
+            trace.end = time.perf_counter()
+            with lock:
+                traces.append(trace)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    output_tokens = sum(len(trace.token_times) for trace in traces)
+    return {
+        "concurrency": concurrency,
+        "requests": len(traces),
+        "prompt_tokens": sum(len(prompt) for prompt in prompts) / len(prompts),
+        "max_new_tokens": max_new_tokens,
+        "output_tokens": output_tokens,
+        "seconds": elapsed,
+        "tokens_per_second": output_tokens / elapsed if elapsed else 0.0,
+        "requests_per_second": len(traces) / elapsed if elapsed else 0.0,
+        "ttft": summarize([trace.ttft for trace in traces if trace.ttft is not None]),
+        "inter_token_latency": summarize([gap for trace in traces for gap in trace.inter_token]),
+        "end_to_end": summarize([trace.end - trace.start for trace in traces]),
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+def environment():
+    """
+    Returns a description of the machine and library versions a run was measured on.
+
+    Returns
+    -------
+    dict
+        Python, torch and platform information.
+    """
+    import transformers
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "torch": torch.__version__,
+        "transformers": transformers.__version__,
+        "threads": torch.get_num_threads(),
+        "cuda": torch.cuda.is_available(),
+    }
+
+
+def compare(result, baseline, tolerance=0.1):
+    """
+    Compares a run against a baseline and lists the metrics that regressed.
+
+    Parameters
+    ----------
+    result : dict
+        Output of the current benchmark run.
+    baseline : dict
+        Output of an earlier run with the same settings.
+    tolerance : float, optional
+        Allowed relative slowdown (default is 0.1, i.e. 10%).
+
+    Returns
+    -------
+    list of str
+        Human-readable descriptions of the regressions, empty if there are none.
+    """
+    regressions = []
+    baseline_runs = {run["concurrency"]: run for run in baseline["runs"]}
+    for run in result["runs"]:
+        old = baseline_runs.get(run["concurrency"])
+        if old is None:
+            continue
+        if run["tokens_per_second"] < old["tokens_per_second"] * (1 - tolerance):
+            regressions.append(
+                f"concurrency {run['concurrency']}: tokens/sec {run['tokens_per_second']:.1f} < {old['tokens_per_second']:.1f}"
+            )
+        for metric in ("ttft", "end_to_end"):
+            new_p95, old_p95 = run[metric]["p95"], old[metric]["p95"]
+            if new_p95 is not None and old_p95 is not None and new_p95 > old_p95 * (1 + tolerance):
+                regressions.append(f"concurrency {run['concurrency']}: {metric} p95 {new_p95:.4f}s > {old_p95:.4f}s")
+    return regressions
@@ -0,0 +1,77 @@
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+from benchmark.prompts import PROMPT_SETS
+
+
+def build_tiny_tokenizer(vocab_size=512):
+    """
+    Trains a small byte-level BPE tokenizer on the built-in prompt sets.
+
+    Byte-level BPE splits Vietnamese characters into several tokens, like PhoGPT's tokenizer
+    does for rare words, so incremental decoding is exercised realistically.
+
+    Parameters
+    ----------
+    vocab_size : int, optional
+        Target vocabulary size (default is 512).
+
+    Returns
+    -------
+    PreTrainedTokenizerFast
+        The tokenizer, with "<eos>" and "<pad>" special tokens.
+    """
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=vocab_size,
+        special_tokens=["<eos>", "<pad>"],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+        show_progress=False,
+    )
+    corpus = ["### Câu hỏi: " + text + "\n### Trả lời:" for texts in PROMPT_SETS.values() for text in texts]
+    tokenizer.train_from_iterator(corpus, trainer)
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        eos_token="<eos>",
+        pad_token="<pad>",
+        model_input_names=["input_ids", "attention_mask"],
+    )
+
+
+def build_tiny_model(tokenizer, hidden_size=64, num_layers=2, num_heads=4, seed=0):
+    """
+    Builds a small randomly initialised causal language model.
+
+    Parameters
+    ----------
+    tokenizer : PreTrainedTokenizerFast
+        The tokenizer whose vocabulary the model uses.
+    hidden_size : int, optional
+        Width of the model (default is 64).
+    num_layers : int, optional
+        Number of decoder layers (default is 2).
+    num_heads : int, optional
+        Number of attention heads (default is 4).
+    seed : int, optional
+        Seed for the random weights (default is 0).
+
+    Returns
+    -------
+    LlamaForCausalLM
+        The model in evaluation mode.
+    """
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 4,
+        num_hidden_layers=num_layers,
+        num_attention_heads=num_heads,
+        max_position_embeddings=4096,
+        eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+    )
+    return LlamaForCausalLM(config).eval()
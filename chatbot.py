@@ -1,5 +1,63 @@
+import dataclasses
+import os
+import queue
+import time
+import weakref
+from dataclasses import dataclass
+from typing import Optional
+
 import torch
-from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+
+from admission import AdmissionController, AdmissionError
+from compiled_engine import CompiledEngine
+from conversation_context import ConversationContext
+from device_policy import available_memory, configure_cpu_threads, default_dtype, quantize_int8, select_device, state_dict_nbytes
+from document_index import DocumentIndex, select_passages
+from engine import InferenceEngine, SamplingParams
+from metrics import RequestMetrics, collector
+from profiling import DEFAULT_TRACE_DIR, RequestProfiler
+from request_lifecycle import GenerationCancelled, RequestLifecycle
+from response_cache import ResponseCache, normalize_instruction, settings_key
+from semantic_cache import SemanticCache
+from session_cache import SessionCacheStore
+from speculative import SpeculativeEngine
+from startup import DEFAULT_SNAPSHOT_DIR, StartupReport, load_pretrained
+from stopping import StopSequenceCriteria, context_length, find_stop, partial_stop_length, token_budget
+from streaming import IncrementalDecoder
+
+
+DEFAULT_RESPONSE_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "responses.sqlite")
+DEFAULT_SEMANTIC_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "semantic")
+DEFAULT_DOCUMENT_INDEX = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "documents")
+
+
+@dataclass
+class BatchResult:
+    """Class for keeping track of the answer to one question of a batch.
+
+    Attributes
+    ----------
+    index : int
+        Position of the question in the batch.
+    response : str or None
+        The answer, None when the question failed.
+    prompt_tokens : int
+        Number of prompt tokens.
+    output_tokens : int
+        Number of generated tokens.
+    finish_reason : str or None
+        Why the generation ended ("eos", "stop", "length" or "error").
+    error : str, optional
+        Description of the failure, if any.
+    """
+    index: int
+    response: Optional[str]
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    finish_reason: Optional[str] = None
+    error: Optional[str] = None
+
+
 class ChatBot:
     """
     A class to represent a conversational AI chatbot.
@@ -8,8 +66,10 @@ class ChatBot:
     ----------
     model_path : str
         Path to the pre-trained language model.
+    model_id : str
+        Identifies the weights (path, data type and quantization); the persistent caches are keyed on it.
     device : str
-        The device to run the model on (default is "cuda:1").
+        The device the model runs on, as resolved by ``select_device``.
     config : AutoConfig
         Configuration for the pre-trained model.
     model : AutoModelForCausalLM
@@ -18,17 +78,82 @@ class ChatBot:
         The tokenizer for processing input and output text.
     prompt_template : str
         Template for formatting input instructions to the model.
+    history_template : str
+        Template for formatting one earlier question/answer turn of the conversation.
+    stop_strings : tuple of str
+        Template markers that end an answer when the model starts a new turn on its own.
+    context_window : int
+        Maximum number of tokens the model attends to; bounds the token budget of a request.
+    context : ConversationContext
+        Builds conversation prompts under the prompt token budget, dropping (and optionally summarizing) old turns.
+    session_cache : SessionCacheStore
+        Key/value caches of recent conversations, reused to prefill only the new tokens of a turn.
+    response_cache : ResponseCache
+        Cache of complete answers to first-turn questions asked with cacheable sampling settings.
+    semantic_cache : SemanticCache or None
+        Cache answering paraphrases of earlier first-turn questions, None when disabled.
+    document_index : DocumentIndex or None
+        Local documents searched for passages that are put into the prompt, None when disabled.
+    retrieval_template : str
+        Template putting the retrieved passages in front of the question.
+    retrieval_tokens : int
+        Token budget of the retrieved passages in a prompt.
+    draft_model : AutoModelForCausalLM or None
+        Small model drafting tokens for speculative decoding, None when disabled.
+    engine : InferenceEngine
+        Continuous-batching engine shared by every caller of this chatbot, a SpeculativeEngine
+        when a draft model is configured, or a CompiledEngine when compiled decoding is enabled.
+    sampling_params : SamplingParams
+        Default sampling settings used by generate_response.
+    metrics : MetricsCollector
+        Collector receiving the per-stage timings of every request.
+    profiler : RequestProfiler
+        Captures profiler traces of sampled requests and of switched-on sessions; off by default.
+    admission : AdmissionController
+        Admits requests into the engine against a memory budget, shortening or rejecting those
+        that do not fit, and shrinks the batch after an out-of-memory error.
+    lifecycle : RequestLifecycle
+        Deduplicates repeated and identical concurrent requests and cancels abandoned ones.
+    startup_report : StartupReport
+        Time spent in each phase of loading the chatbot.
 
     Methods
     -------
-    __init__(model_path, device="cuda:1", torch_dtype=torch.bfloat16):
+    __init__(model_path, device="auto", torch_dtype=None, max_batch_size=8, session_cache_bytes=2 * 1024 ** 3, quantize=None, response_cache_path=DEFAULT_RESPONSE_CACHE, semantic_cache_dir=None, draft_model_path=None, snapshot_dir=DEFAULT_SNAPSHOT_DIR, warmup=False, prompt_budget=None, summarize_history=False, compile=False, document_index_dir=DEFAULT_DOCUMENT_INDEX, retrieval_tokens=512, memory_budget="auto", colocated_workers=1):
         Initializes the ChatBot with the specified model path, device, and data type.
-    
-    generate_response(instruction):
+
+    from_model(model, tokenizer, device="cpu", max_batch_size=8, session_cache_bytes=2 * 1024 ** 3, response_cache_path=None, semantic_cache_dir=None, draft_model=None, prompt_budget=None, summarize_history=False, compile=False, document_index_dir=None, retrieval_tokens=512, memory_budget="auto", colocated_workers=1):
+        Builds a ChatBot around an already loaded model and tokenizer.
+
+    retrieve(instruction):
+        Returns the document passages put into the prompt of a question.
+
+    warm_up():
+        Runs one short generation so the first user request does not pay for kernel initialization.
+
+    embed_instruction(instruction):
+        Returns a normalized embedding of a question from the model's hidden states.
+
+    encode_conversation(instruction, history=None, session_id=None):
+        Builds the prompt token ids from the conversation history and the new instruction.
+
+    summarize_turns(summary, turns, max_tokens=256):
+        Folds earlier turns into a short summary of the conversation.
+
+    generate_response(instruction, sampling_params=None, history=None, session_id=None, use_cache=True):
         Generates a response from the chatbot based on the given instruction.
+
+    stream_response(instruction, sampling_params=None, history=None, session_id=None, use_cache=True):
+        Yields the response text chunk by chunk while it is being generated.
+
+    generate_many(instructions, sampling_params=None, max_in_flight=None):
+        Answers many independent questions, yielding the answers as they finish.
+
+    cancel(session_id):
+        Stops generating the unfinished answer of a session.
     """
 
-    def __init__(self, model_path, device="cuda:1", torch_dtype=torch.bfloat16):
+    def __init__(self, model_path, device="auto", torch_dtype=None, max_batch_size=8, session_cache_bytes=2 * 1024 ** 3, quantize=None, response_cache_path=DEFAULT_RESPONSE_CACHE, semantic_cache_dir=None, draft_model_path=None, snapshot_dir=DEFAULT_SNAPSHOT_DIR, warmup=False, prompt_budget=None, summarize_history=False, compile=False, document_index_dir=DEFAULT_DOCUMENT_INDEX, retrieval_tokens=512, memory_budget="auto", colocated_workers=1):
         """
         Initializes the ChatBot with the specified model path, device, and data type.
 
@@ -37,51 +162,734 @@ class ChatBot:
         model_path : str
             Path to the pre-trained language model.
         device : str, optional
-            The device to run the model on (default is "cuda:1").
+            The device to run the model on (default is "auto", which picks a GPU when available and falls back to the CPU).
         torch_dtype : torch.dtype, optional
-            The data type for the model's tensors (default is torch.bfloat16).
+            The data type for the model's tensors (default is bfloat16 on GPUs and float32 on the CPU).
+        max_batch_size : int, optional
+            Maximum number of requests decoded together (default is 8).
+        session_cache_bytes : int, optional
+            Memory budget of the per-session KV cache store (default is 2 GiB).
+        quantize : str, optional
+            "int8" applies dynamic int8 quantization to the linear layers; only supported on the CPU.
+        response_cache_path : str, optional
+            SQLite file of the persistent response cache (default is cache/responses.sqlite next to this module, None keeps it in memory).
+        semantic_cache_dir : str, optional
+            Folder of the semantic cache index, e.g. ``DEFAULT_SEMANTIC_CACHE`` (default is None,
+            disabled; calibrate its threshold for the model with ``calibrate_threshold`` first).
+        draft_model_path : str, optional
+            Path to a small model sharing the tokenizer, enabling speculative decoding (default is None).
+        snapshot_dir : str, optional
+            Folder of the local snapshot cache that makes later starts faster (default is cache/snapshots
+            next to this module, None disables it).
+        warmup : bool, optional
+            Run one short generation before returning (default is False).
+        prompt_budget : int, optional
+            Largest conversation prompt in tokens; older turns are dropped beyond it (default is the
+            context window minus the default ``max_new_tokens``).
+        summarize_history : bool, optional
+            Fold dropped turns into a rolling summary generated in the background (default is False).
+        compile : bool, optional
+            Decode with a ``torch.compile``-d model on bucketed shapes, compiled during loading; falls
+            back to eager decoding when compilation fails (default is False).
+        document_index_dir : str, optional
+            Folder of the document index built by ``document_index.py`` (default is cache/documents
+            next to this module, None disables retrieval). Retrieval stays off until an index is built.
+        retrieval_tokens : int, optional
+            Token budget of the retrieved passages in a prompt (default is 512).
+        memory_budget : int or str, optional
+            Bytes the key/value caches and activations of running requests may use (default is
+            "auto": 80% of the device memory still free after loading, less ``session_cache_bytes``;
+            None disables the limit).
+        colocated_workers : int, optional
+            Processes loading a chatbot onto the same device at the same time, e.g. workers of a
+            WorkerPool; the "auto" budget is split between them (default is 1).
         """
+        self.startup_report = StartupReport()
         self.model_path = model_path
-        self.device = device
-        self.config = AutoConfig.from_pretrained(model_path, trust_remote_code=True)
-        self.config.init_device = device
+        self._quantize = quantize
+        with self.startup_report.phase("device"):
+            self.device = select_device(device)
+            if quantize not in (None, "int8"):
+                raise ValueError(f"Unsupported quantization mode: {quantize}")
+            if quantize == "int8" and self.device != "cpu":
+                raise ValueError("int8 dynamic quantization is only supported on the CPU")
+            if torch_dtype is None or quantize == "int8":
+                torch_dtype = default_dtype(self.device)
+            if self.device == "cpu":
+                configure_cpu_threads()
+
+        self.config, self.model, self.tokenizer = load_pretrained(
+            model_path, torch_dtype, self.device, snapshot_dir, self.startup_report
+        )
+        with self.startup_report.phase("to_device"):
+            self.model.to(self.device)
+        if quantize == "int8":
+            with self.startup_report.phase("quantize"):
+                self.model = quantize_int8(self.model)
+
+        draft_model = None
+        if draft_model_path is not None:
+            with self.startup_report.phase("draft_model"):
+                _, draft_model, _ = load_pretrained(draft_model_path, torch_dtype, self.device, snapshot_dir)
+                draft_model.to(self.device)
+                if quantize == "int8":
+                    draft_model = quantize_int8(draft_model)
+
+        with self.startup_report.phase("setup"):
+            self._setup(max_batch_size, session_cache_bytes, response_cache_path, semantic_cache_dir, draft_model,
+                        prompt_budget, summarize_history, compile, document_index_dir, retrieval_tokens, memory_budget,
+                        colocated_workers)
+        if warmup:
+            with self.startup_report.phase("warmup"):
+                self.warm_up()
+
+    @classmethod
+    def from_model(cls, model, tokenizer, device="cpu", max_batch_size=8, session_cache_bytes=2 * 1024 ** 3, response_cache_path=None, semantic_cache_dir=None, draft_model=None, prompt_budget=None, summarize_history=False, compile=False, document_index_dir=None, retrieval_tokens=512, memory_budget="auto", colocated_workers=1):
+        """
+        Builds a ChatBot around an already loaded model and tokenizer.
 
-        self.model = AutoModelForCausalLM.from_pretrained(model_path, config=self.config, torch_dtype=torch_dtype, trust_remote_code=True)
-        self.model.eval()
+        This is mainly useful to run the chatbot on CPU with a tiny randomly initialised model.
 
-        self.tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+        Parameters
+        ----------
+        model : PreTrainedModel
+            The causal language model.
+        tokenizer : PreTrainedTokenizer
+            The tokenizer matching the model.
+        device : str, optional
+            The device the model lives on (default is "cpu").
+        max_batch_size : int, optional
+            Maximum number of requests decoded together (default is 8).
+        session_cache_bytes : int, optional
+            Memory budget of the per-session KV cache store (default is 2 GiB).
+        response_cache_path : str, optional
+            SQLite file of the persistent response cache (default is None, memory only).
+        semantic_cache_dir : str, optional
+            Folder of the semantic cache index (default is None, disabled).
+        draft_model : PreTrainedModel, optional
+            Small model sharing the tokenizer, enabling speculative decoding (default is None).
+        prompt_budget : int, optional
+            Largest conversation prompt in tokens (default is the context window minus the default ``max_new_tokens``).
+        summarize_history : bool, optional
+            Fold dropped turns into a rolling summary generated in the background (default is False).
+        compile : bool, optional
+            Decode with a ``torch.compile``-d model on bucketed shapes (default is False).
+        document_index_dir : str, optional
+            Folder of the document index searched before every generated answer (default is None, disabled).
+        retrieval_tokens : int, optional
+            Token budget of the retrieved passages in a prompt (default is 512).
+        memory_budget : int or str, optional
+            Bytes the running requests may use (default is "auto", derived from the free memory;
+            None disables the limit).
+        colocated_workers : int, optional
+            Processes sharing the device, between which the "auto" budget is split (default is 1).
+
+        Returns
+        -------
+        ChatBot
+            The chatbot instance.
+        """
+        bot = cls.__new__(cls)
+        bot.model_path = getattr(model, "name_or_path", None)
+        bot._quantize = None
+        bot.device = device
+        bot.config = model.config
+        bot.model = model.eval()
+        bot.tokenizer = tokenizer
+        bot.startup_report = StartupReport()
+        bot._setup(max_batch_size, session_cache_bytes, response_cache_path, semantic_cache_dir, draft_model,
+                   prompt_budget, summarize_history, compile, document_index_dir, retrieval_tokens, memory_budget,
+                   colocated_workers)
+        return bot
+
+    def _setup(self, max_batch_size, session_cache_bytes, response_cache_path, semantic_cache_dir, draft_model=None,
+               prompt_budget=None, summarize_history=False, compile=False, document_index_dir=None, retrieval_tokens=512, memory_budget="auto", colocated_workers=1):
         self.prompt_template = "### Câu hỏi: {instruction}\n### Trả lời:"
+        self.history_template = "### Câu hỏi: {instruction}\n### Trả lời: {response}\n"
+        self.stop_strings = ("### Câu hỏi:", "### Trả lời:")
+        self.context_window = context_length(self.config)
+        self.session_cache = SessionCacheStore(session_cache_bytes)
+        # Caches on disk outlive the process and are shared by every model of the checkout.
+        self.model_id = f"{self.model_path}|{self.model.dtype}|{self._quantize or 'none'}"
+        self.response_cache = ResponseCache(response_cache_path, namespace=self.model_id)
+        self.semantic_cache = None
+        if semantic_cache_dir is not None:
+            self.semantic_cache = SemanticCache(self.embed_instruction, semantic_cache_dir, namespace=self.model_id)
+        self.sampling_params = SamplingParams(do_sample=True, temperature=1.0, top_k=50, top_p=0.9, max_new_tokens=1024)
+        if prompt_budget is None:
+            prompt_budget = max(self.context_window - self.sampling_params.max_new_tokens, self.context_window // 2)
+        self.context = ConversationContext(
+            self.tokenizer,
+            self.history_template,
+            self.prompt_template,
+            prompt_budget,
+            summarizer=self.summarize_turns if summarize_history else None,
+        )
+        self.document_index = DocumentIndex(document_index_dir) if document_index_dir is not None else None
+        self.retrieval_template = "Dựa vào các tài liệu sau:\n{passages}\nhãy trả lời: {instruction}"
+        # The passages never take more than half of the prompt, so recent turns still fit.
+        self.retrieval_tokens = min(retrieval_tokens, prompt_budget // 2)
+        self.draft_model = draft_model
+        if draft_model is not None and compile:
+            raise ValueError("Compiled decoding cannot be combined with speculative decoding")
+        if draft_model is not None:
+            self.engine = SpeculativeEngine(
+                self.model,
+                draft_model,
+                self.device,
+                eos_token_id=self.tokenizer.eos_token_id,
+                pad_token_id=self.tokenizer.pad_token_id,
+            )
+        elif compile:
+            self.engine = CompiledEngine(
+                self.model,
+                self.device,
+                eos_token_id=self.tokenizer.eos_token_id,
+                pad_token_id=self.tokenizer.pad_token_id,
+                max_batch_size=max_batch_size,
+                max_length=self.context_window,
+            )
+            self.engine.warm_up()
+        else:
+            self.engine = InferenceEngine(
+                self.model,
+                self.device,
+                eos_token_id=self.tokenizer.eos_token_id,
+                pad_token_id=self.tokenizer.pad_token_id,
+                max_batch_size=max_batch_size,
+            )
+        self.profiler = RequestProfiler(DEFAULT_TRACE_DIR)
+        self.engine.profiler = self.profiler
+        if memory_budget == "auto":
+            memory_budget = self._auto_memory_budget(session_cache_bytes, colocated_workers, draft_model)
+        # The estimates count the draft model's cache and the padded shapes of compiled decode steps.
+        padding = {}
+        if compile and self.engine.compiled:
+            padding = {"batch_buckets": self.engine.batch_buckets, "length_buckets": self.engine.length_buckets}
+        self.admission = AdmissionController(
+            self.config, self.model.dtype, str(self.device), memory_budget,
+            draft_config=draft_model.config if draft_model is not None else None, **padding
+        )
+        self.engine.admission = self.admission
+        self.engine.start()
+        self.lifecycle = RequestLifecycle()
+        self.metrics = collector
+        engine = weakref.ref(self.engine)
+        self.metrics.register_gauge(
+            "chatbot_engine_running_requests", "Requests in the decode batch.", lambda: len(engine().running) if engine() else 0
+        )
+        self.metrics.register_gauge(
+            "chatbot_engine_waiting_requests", "Requests waiting for a batch slot.", lambda: len(engine().waiting) if engine() else 0
+        )
+        if draft_model is not None:
+            self.metrics.register_gauge(
+                "chatbot_speculative_acceptance_rate", "Fraction of draft tokens accepted by the main model.",
+                lambda: engine().stats()["acceptance_rate"] if engine() else 0
+            )
+            self.metrics.register_gauge(
+                "chatbot_speculative_tokens_per_second", "Generated tokens per second of decode time.",
+                lambda: engine().stats()["effective_tokens_per_second"] if engine() else 0
+            )
+        admission = weakref.ref(self.admission)
+        self.metrics.register_gauge(
+            "chatbot_memory_budget_bytes", "Memory the running requests may use.",
+            lambda: (admission().budget or 0) if admission() else 0
+        )
+        self.metrics.register_gauge(
+            "chatbot_memory_reserved_bytes", "Estimated memory reserved by the running requests.",
+            lambda: admission().reserved if admission() else 0
+        )
+        self.metrics.register_gauge(
+            "chatbot_memory_used_bytes", "Memory allocated on the device, or resident memory on the CPU.",
+            lambda: (admission().stats()["used_bytes"] or 0) if admission() else 0
+        )
+        if compile:
+            self.metrics.register_gauge(
+                "chatbot_compiled_bucket_hit_rate", "Fraction of decode steps run on a compiled bucket shape.",
+                lambda: engine().stats()["bucket_hit_rate"] if engine() else 0
+            )
+            self.metrics.register_gauge(
+                "chatbot_decode_seconds_per_token", "Average duration of a decode step.",
+                lambda: engine().stats()["seconds_per_token"] if engine() else 0
+            )
+
+    def _auto_memory_budget(self, session_cache_bytes, colocated_workers, draft_model):
+        free = available_memory(str(self.device))
+        if free is None:
+            return None
+        # Co-located workers load concurrently, so the weights of the others may not be allocated yet:
+        # they are taken out of the free memory (erring low when they are) and the rest is split evenly.
+        weights = state_dict_nbytes(self.model) + (state_dict_nbytes(draft_model) if draft_model is not None else 0)
+        share = (int(0.8 * free) - (colocated_workers - 1) * weights) // colocated_workers
+        # The session cache grows later into the same memory; keep at least a fifth of the share for requests.
+        return max(share - session_cache_bytes, free // (5 * colocated_workers))
+
+    def retrieve(self, instruction):
+        """
+        Returns the document passages put into the prompt of a question.
+
+        The best-scoring passages of the document index are kept while their total length stays
+        within ``retrieval_tokens``; a passage that does not fit is skipped for a shorter one.
+
+        Parameters
+        ----------
+        instruction : str
+            The question from the user.
+
+        Returns
+        -------
+        list of Passage
+            The passages, best first; empty when retrieval is disabled or nothing matches.
+        """
+        if self.document_index is None:
+            return []
+        passages = self.document_index.search(instruction, k=8)
+        return select_passages(passages, self.context.count, self.retrieval_tokens)
+
+    def _augment(self, instruction, metrics=None):
+        # The retrieval stage runs before prompt_template formatting: passages become part of the instruction.
+        start = time.perf_counter()
+        passages = self.retrieve(instruction)
+        if metrics is not None:
+            metrics.retrieve = time.perf_counter() - start
+            metrics.retrieved_passages = len(passages)
+        if not passages:
+            return instruction
+        text = "\n".join(f"[{number}] {passage.text}" for number, passage in enumerate(passages, 1))
+        return self.retrieval_template.format(passages=text, instruction=instruction)
 
-    def generate_response(self, instruction):
+    def warm_up(self):
+        """
+        Runs one short generation so the first user request does not pay for kernel initialization.
+
+        The prefill and decode paths, the cache layout detection and the memory allocator are all
+        exercised once; the request bypasses the response caches and the metrics.
+        """
+        input_ids = self.tokenizer(self.prompt_template.format(instruction="Xin chào"))["input_ids"]
+        self.engine.submit(input_ids, SamplingParams(do_sample=False, max_new_tokens=4, ignore_eos=True)).wait()
+
+    @torch.no_grad()
+    def embed_instruction(self, instruction):
+        """
+        Returns a normalized embedding of a question from the model's hidden states.
+
+        The last hidden layer is mean-pooled over the question tokens, so no separate embedding
+        model has to be downloaded or kept in memory. The forward pass runs on the engine thread
+        between two steps, so it never overlaps a prefill or a decode step.
+
+        Parameters
+        ----------
+        instruction : str
+            The question to embed.
+
+        Returns
+        -------
+        numpy.ndarray
+            1-D float32 vector of unit length.
+
+        Raises
+        ------
+        AdmissionError
+            When the pass does not fit into the memory budget next to the running requests.
+        """
+        input_ids = self.tokenizer(instruction, return_tensors="pt")
+        return self.engine.call(self._embed, input_ids)
+
+    @torch.no_grad()
+    def _embed(self, input_ids):
+        if not self.admission.fits(input_ids["input_ids"].shape[1]):
+            raise AdmissionError("no memory left to embed the question next to the running requests")
+        outputs = self.model(
+            input_ids=input_ids["input_ids"].to(self.device),
+            attention_mask=input_ids["attention_mask"].to(self.device),
+            output_hidden_states=True,
+            use_cache=False,
+        )
+        vector = outputs.hidden_states[-1][0].float().mean(dim=0)
+        return torch.nn.functional.normalize(vector, dim=0).cpu().numpy()
+
+    def encode_conversation(self, instruction, history=None, session_id=None):
+        """
+        Builds the prompt token ids from the conversation history and the new instruction.
+
+        When the session's previous turn is still in the session cache and the prompt stays within
+        the budget, its token ids are reused as they are, so the new prompt extends the cached
+        tokens exactly and only the new question has to be prefilled. Otherwise the prompt is built
+        by ``self.context`` from per-turn token ids, leaving out the oldest turns that do not fit.
+
+        Parameters
+        ----------
+        instruction : str
+            The new question from the user.
+        history : list of Message, optional
+            Earlier messages of the conversation; AI messages without a preceding question are ignored.
+        session_id : str, optional
+            Identifier of the chat session.
+
+        Returns
+        -------
+        tuple
+            ``(input_ids, turns)`` with the prompt token ids and the number of earlier turns.
+        """
+        turns = []
+        question = None
+        for chat in history or []:
+            if chat.origin == "human":
+                question = chat.message
+            elif question is not None:
+                turns.append((question, chat.message))
+                question = None
+
+        entry = self.session_cache.get(session_id) if session_id is not None else None
+        if turns and entry is not None and entry.turns == len(turns):
+            suffix = "\n" + self.prompt_template.format(instruction=instruction)
+            input_ids = entry.token_ids + self.tokenizer(suffix, add_special_tokens=False)["input_ids"]
+            if len(input_ids) <= self.context.max_tokens:
+                return input_ids, len(turns)
+
+        input_ids, _ = self.context.build(instruction, turns, session_id)
+        return input_ids, len(turns)
+
+    def summarize_turns(self, summary, turns, max_tokens=256):
+        """
+        Folds earlier turns into a short summary of the conversation.
+
+        Used by the conversation context to keep the gist of turns that no longer fit into the
+        prompt budget. The summary is generated greedily by the shared engine.
+
+        Parameters
+        ----------
+        summary : str or None
+            The previous summary of the conversation.
+        turns : list of tuple
+            The ``(question, answer)`` turns to add to it.
+        max_tokens : int, optional
+            Maximum length of the summary in tokens (default is 256).
+
+        Returns
+        -------
+        str
+            The new summary.
+        """
+        conversation = "".join(self.history_template.format(instruction=q, response=a) for q, a in turns)
+        instruction = "Tóm tắt ngắn gọn cuộc hội thoại sau, giữ lại các thông tin quan trọng.\n"
+        if summary:
+            instruction += f"Tóm tắt trước đó: {summary}\n"
+        input_ids = self.tokenizer(self.prompt_template.format(instruction=instruction + conversation))["input_ids"]
+        params = SamplingParams(do_sample=False, max_new_tokens=token_budget(len(input_ids), max(max_tokens, 1), self.context_window))
+        request = self.engine.submit(input_ids, params, stopping=StopSequenceCriteria(self.tokenizer, self.stop_strings))
+        request.wait()
+        output_ids = request.output_ids[:request.stopping.kept_tokens()]
+        return self.tokenizer.decode(output_ids, skip_special_tokens=True).strip()
+
+    def _submit(self, instruction, sampling_params, history, session_id):
+        metrics = RequestMetrics()
+        question = instruction
+        instruction = self._augment(instruction, metrics)
+        start = time.perf_counter()
+        input_ids, turns = self.encode_conversation(instruction, history, session_id)
+        metrics.tokenize = time.perf_counter() - start
+        sampling_params = sampling_params or self.sampling_params
+        budget = token_budget(len(input_ids), sampling_params.max_new_tokens, self.context_window)
+        if budget < sampling_params.max_new_tokens:
+            sampling_params = dataclasses.replace(sampling_params, max_new_tokens=budget)
+        prefix_cache, prefix_length = None, 0
+        if session_id is not None:
+            prefix_cache, prefix_length = self.session_cache.match(session_id, input_ids)
+        profile = None
+        if self.profiler.wants(session_id):
+            profile = {"session_id": session_id, "instruction": question[:500], "turns": turns,
+                       "retrieve": metrics.retrieve, "retrieved_passages": metrics.retrieved_passages,
+                       "tokenize": metrics.tokenize, "sampling": dataclasses.asdict(sampling_params)}
+        request = self.engine.submit(
+            input_ids,
+            sampling_params,
+            prefix_cache=prefix_cache,
+            prefix_length=prefix_length,
+            keep_cache=session_id is not None,
+            stopping=StopSequenceCriteria(self.tokenizer, self.stop_strings + tuple(sampling_params.stop)),
+            profile=profile,
+        )
+        return request, turns, metrics
+
+    def _cache_context(self):
+        # Answers are grounded in the documents of one index version; a rebuild invalidates them.
+        if self.document_index is None:
+            return ""
+        return self.document_index.version or ""
+
+    def _cached_response(self, instruction, sampling_params, context):
+        response = self.response_cache.get(instruction, sampling_params, context)
+        if response is not None:
+            return response, "response_cache"
+        if self.semantic_cache is not None:
+            try:
+                response = self.semantic_cache.get(instruction, sampling_params, context)
+            except AdmissionError:
+                # Embedding is an optimization; under memory pressure the question is generated.
+                response = None
+            if response is not None:
+                return response, "semantic_cache"
+        return None, None
+
+    def _record(self, metrics, start, request=None, detokenize=0.0):
+        metrics.total = time.perf_counter() - start
+        metrics.detokenize = detokenize
+        if request is not None:
+            metrics.queue_wait = (request.admitted_time or request.finish_time) - request.arrival_time
+            metrics.prefill = request.prefill_seconds
+            if request.first_token_time is not None:
+                metrics.decode = request.finish_time - request.first_token_time
+            metrics.prompt_tokens = len(request.prompt_ids)
+            metrics.cached_tokens = request.prefix_length
+            metrics.output_tokens = len(request.output_ids)
+            metrics.finish_reason = request.finish_reason
+        self.metrics.record(metrics)
+
+    def _store_response(self, instruction, sampling_params, response, generation_seconds, context):
+        self.response_cache.put(instruction, sampling_params, response, generation_seconds, context)
+        if self.semantic_cache is not None:
+            try:
+                self.semantic_cache.put(instruction, sampling_params, response, context)
+            except AdmissionError:
+                pass
+
+    def _remember(self, session_id, request, turns):
+        if session_id is None or request.cache is None:
+            return
+        # Tokens of a stop string are not part of the answer the next turn's prompt repeats.
+        token_ids = request.prompt_ids + request.output_ids[:request.stopping.kept_tokens()]
+        self.session_cache.put(session_id, token_ids, request.cache, min(request.cache_length, len(token_ids)), turns + 1)
+
+    def generate_response(self, instruction, sampling_params=None, history=None, session_id=None, use_cache=True):
         """
         Generates a response from the chatbot based on the given instruction.
 
+        The prompt is queued on the shared inference engine, so concurrent callers are decoded
+        together in one batch instead of waiting for each other. First-turn questions asked with
+        cacheable sampling settings are answered from the response cache, or from the semantic
+        cache when a paraphrase was answered before. Cached answers are only reused while the
+        document index is at the version they were grounded in.
+
         Parameters
         ----------
         instruction : str
             The input instruction or question from the user.
+        sampling_params : SamplingParams, optional
+            Sampling settings for this request (defaults to ``self.sampling_params``).
+        history : list of Message, optional
+            Earlier messages of the conversation.
+        session_id : str, optional
+            Identifier of the chat session, enabling KV cache reuse across turns.
+        use_cache : bool, optional
+            Set to False to bypass the response cache for this request (default is True).
 
         Returns
         -------
         str
             The generated response from the chatbot.
+
+        Raises
+        ------
+        GenerationCancelled
+            When the answer was cancelled (by ``cancel`` or a newer question of the session)
+            before it was complete.
         """
-        
-        input_prompt = self.prompt_template.format(instruction=instruction)
-        input_ids = self.tokenizer(input_prompt, return_tensors="pt")
+        sampling_params = sampling_params or self.sampling_params
+        key, shared = self._flight_key(instruction, sampling_params, history)
+
+        def source():
+            # The answer is streamed and joined, so a cancelled request leaves the engine between chunks.
+            return self._stream_response(instruction, sampling_params, history, session_id, use_cache)
+
+        return "".join(self.lifecycle.stream(key, source, session_id, shared))
+
+    def stream_response(self, instruction, sampling_params=None, history=None, session_id=None, use_cache=True):
+        """
+        Yields the response text chunk by chunk while it is being generated.
+
+        The first chunk is available after a single forward pass over the prompt, instead of
+        after the whole answer has been generated. A cached answer is yielded as a single chunk.
+        When the caller stops iterating, the generation is cancelled in the engine.
+
+        Parameters
+        ----------
+        instruction : str
+            The input instruction or question from the user.
+        sampling_params : SamplingParams, optional
+            Sampling settings for this request (defaults to ``self.sampling_params``).
+        history : list of Message, optional
+            Earlier messages of the conversation.
+        session_id : str, optional
+            Identifier of the chat session, enabling KV cache reuse across turns.
+        use_cache : bool, optional
+            Set to False to bypass the response cache for this request (default is True).
+
+        Yields
+        ------
+        str
+            The next piece of the response text.
+
+        Raises
+        ------
+        GenerationCancelled
+            When the answer is cancelled by ``cancel`` or a newer question of the session.
+        """
+        sampling_params = sampling_params or self.sampling_params
+        key, shared = self._flight_key(instruction, sampling_params, history)
+
+        def source():
+            return self._stream_response(instruction, sampling_params, history, session_id, use_cache)
+
+        yield from self.lifecycle.stream(key, source, session_id, shared)
+
+    def generate_many(self, instructions, sampling_params=None, max_in_flight=None):
+        """
+        Answers many independent questions, yielding the answers as they finish.
+
+        Meant for offline jobs. The prompts are sorted by length, so the requests that are prefilled
+        and decoded together have similar lengths and little padding, and the engine is kept full
+        with ``max_in_flight`` requests at a time. The response caches are bypassed.
+
+        Parameters
+        ----------
+        instructions : sequence of str
+            The questions, each answered without conversation history.
+        sampling_params : SamplingParams, optional
+            Sampling settings for every question (defaults to ``self.sampling_params``).
+        max_in_flight : int, optional
+            Requests queued on the engine at once (default is twice the maximum batch size).
+
+        Yields
+        ------
+        BatchResult
+            The answer of one question, in completion order.
+        """
+        sampling_params = sampling_params or self.sampling_params
+        max_in_flight = max_in_flight or 2 * self.engine.max_batch_size
+        prompts = [self.context.build(self._augment(instruction), [])[0] for instruction in instructions]
+        order = sorted(range(len(prompts)), key=lambda index: len(prompts[index]))
+        finished = queue.Queue()
+        running = {}
+        position = 0
+        try:
+            while position < len(order) or running:
+                while position < len(order) and len(running) < max_in_flight:
+                    index = order[position]
+                    position += 1
+                    try:
+                        budget = token_budget(len(prompts[index]), sampling_params.max_new_tokens, self.context_window)
+                        request = self.engine.submit(
+                            prompts[index],
+                            dataclasses.replace(sampling_params, max_new_tokens=budget),
+                            stopping=StopSequenceCriteria(self.tokenizer, self.stop_strings + tuple(sampling_params.stop)),
+                        )
+                    except (ValueError, AdmissionError) as error:
+                        # A prompt that is too long for the context or the memory budget fails on its own.
+                        yield BatchResult(index, None, len(prompts[index]), finish_reason="error", error=str(error))
+                        continue
+                    running[request.request_id] = (index, request)
+                    request.add_done_callback(finished.put)
+                if not running:
+                    continue
+                request = finished.get()
+                index, _ = running.pop(request.request_id)
+                if request.error is not None:
+                    yield BatchResult(index, None, len(request.prompt_ids), len(request.output_ids), "error", str(request.error))
+                    continue
+                response = self.tokenizer.decode(request.output_ids, skip_special_tokens=True)
+                response = response[:find_stop(response, request.stopping.stop_strings)].strip()
+                yield BatchResult(index, response, len(request.prompt_ids), len(request.output_ids), request.finish_reason)
+        finally:
+            # A consumer that stops early (e.g. an interrupted job) leaves no work behind in the engine.
+            for _, request in running.values():
+                request.cancel()
+
+    def cancel(self, session_id):
+        """
+        Stops generating the unfinished answer of a session.
+
+        Used when the user sends a new message or leaves. Streamed and complete answers alike are
+        generated chunk by chunk; after the next chunk the engine drops the request at its next
+        step, unless another session shares the same answer.
+
+        Parameters
+        ----------
+        session_id : str
+            Identifier of the chat session.
+
+        Returns
+        -------
+        bool
+            True if an answer was being generated.
+        """
+        return self.lifecycle.cancel(session_id)
+
+    def _flight_key(self, instruction, sampling_params, history):
+        # Deterministic first-turn requests may be shared between sessions, like the response cache does.
+        key = (normalize_instruction(instruction), settings_key(sampling_params),
+               tuple((chat.origin, chat.message) for chat in history or []))
+        shared = not _has_turns(history) and (not sampling_params.do_sample or sampling_params.cacheable)
+        return key, shared
+
+    def _stream_response(self, instruction, sampling_params, history, session_id, use_cache):
+        start = time.perf_counter()
+        use_cache = use_cache and not _has_turns(history)
+        if use_cache:
+            context = self._cache_context()
+            cached, source = self._cached_response(instruction, sampling_params, context)
+            if cached is not None:
+                self._record(RequestMetrics(source=source), start)
+                yield cached
+                return
+
+        request, turns, metrics = self._submit(instruction, sampling_params, history, session_id)
+        try:
+            stop_strings = request.stopping.stop_strings
+            decoder = IncrementalDecoder(self.tokenizer)
+            detokenize = 0.0
+            pending = ""
+            started = stopped = False
+            for token_id in request.stream():
+                if stopped:
+                    continue
+                decode_start = time.perf_counter()
+                pending += decoder.push(token_id)
+                index = find_stop(pending, stop_strings)
+                if index is not None:
+                    pending, stopped = pending[:index], True
+                    continue
+                # Text that may be the start of a stop string (or trailing spaces) waits for the next token.
+                ready = len(pending[:len(pending) - partial_stop_length(pending, stop_strings)].rstrip())
+                chunk, pending = pending[:ready], pending[ready:]
+                if not started:
+                    chunk = chunk.lstrip()
+                    started = bool(chunk)
+                detokenize += time.perf_counter() - decode_start
+                if chunk:
+                    yield chunk
+            if request.finish_reason == "cancelled":
+                raise GenerationCancelled(f"request {request.request_id} was cancelled before it finished")
+            self._remember(session_id, request, turns)
+            decode_start = time.perf_counter()
+            if not stopped:
+                pending += decoder.flush()
+                pending = pending[:find_stop(pending, stop_strings)]
+            detokenize += time.perf_counter() - decode_start
+            self._record(metrics, start, request, detokenize)
+            if not started:
+                pending = pending.lstrip()
+            if pending.rstrip():
+                yield pending.rstrip()
+            if use_cache:
+                response = self.tokenizer.decode(request.output_ids, skip_special_tokens=True)
+                response = response[:find_stop(response, stop_strings)].strip()
+                self._store_response(instruction, sampling_params, response, time.perf_counter() - start, context)
+        finally:
+            # Closing the generator early (the consumer left) stops the decode loop for this request.
+            if not request.done():
+                request.cancel()
 
-        outputs = self.model.generate(
-            inputs=input_ids["input_ids"].to(self.device),
-            attention_mask=input_ids["attention_mask"].to(self.device),
-            do_sample=True,
-            temperature=1.0,
-            top_k=50,
-            top_p=0.9,
-            max_new_tokens=1024,
-            eos_token_id=self.tokenizer.eos_token_id,
-            pad_token_id=self.tokenizer.pad_token_id
-        )
 
-        response = self.tokenizer.batch_decode(outputs, skip_special_tokens=True)[0]
-        response = response.split("### Trả lời:")[1]
-        return response.strip()
+def _has_turns(history):
+    return any(chat.origin == "human" for chat in history or [])
@@ -0,0 +1,261 @@
+import threading
+import time
+import warnings
+
+import torch
+
+from engine import InferenceEngine
+from kv_cache import CacheLayout
+
+
+class CompiledEngine(InferenceEngine):
+    """
+    A continuous-batching engine whose decode step runs a ``torch.compile``-d model on fixed shapes.
+
+    A compiled graph is only valid for the input shapes it was traced with, and the decode batch
+    changes shape at every step: the key/value cache grows by one position and requests join and
+    leave the batch. To keep the number of graphs small, decode steps are run on bucketed shapes:
+
+    - the batch is padded to the next power of two (up to ``max_batch_size``) with masked rows;
+    - the key/value cache is left-padded once to the next length bucket (powers of two from
+      ``min_bucket`` to ``max_length``). Every decode step adds one position at the end and drops
+      one leading padding position, so the cache keeps the same shape until its padding is used
+      up and it moves to the next bucket.
+
+    The key/value cache is thus a window of fixed shape between bucket changes, so the compiled
+    model sees at most ``len(batch_buckets) * len(length_buckets)`` shapes and ``warm_up``
+    compiles all of them before the first request. It is not a preallocated static cache: with
+    tuple ``past_key_values`` the attention layers concatenate the new position into fresh
+    tensors at every step, and the stable shapes only spare the compiler new graphs. Prefill runs eagerly,
+    as do decode steps longer than the largest bucket. When ``torch.compile`` is not available
+    or a compiled call fails, the engine warns once and decodes eagerly on the exact shapes,
+    like InferenceEngine.
+
+    Attributes
+    ----------
+    compiled : bool
+        Whether decode steps currently run the compiled model.
+    compile_error : str or None
+        Why compilation was given up, if it was.
+    batch_buckets : tuple of int
+        Batch sizes the decode batch is padded to.
+    length_buckets : tuple of int
+        Cache lengths the key/value cache is padded to.
+
+    Methods
+    -------
+    warm_up(batch_sizes=None, lengths=None):
+        Compiles the decode step for every bucket before requests arrive.
+
+    stats():
+        Returns bucket hit rates and decode latency per token.
+    """
+
+    def __init__(self, model, device, eos_token_id, pad_token_id=None, max_batch_size=8, max_length=2048,
+                 min_bucket=64, compile_mode=None):
+        """
+        Initializes the CompiledEngine.
+
+        Parameters
+        ----------
+        model : PreTrainedModel
+            The causal language model used for generation.
+        device : str
+            The device the model lives on.
+        eos_token_id : int
+            Token id that ends a generation.
+        pad_token_id : int, optional
+            Token id used for left padding (defaults to ``eos_token_id``).
+        max_batch_size : int, optional
+            Maximum number of requests decoded together (default is 8).
+        max_length : int, optional
+            Largest cache length with a bucket, usually the context window (default is 2048).
+        min_bucket : int, optional
+            Smallest cache length bucket (default is 64).
+        compile_mode : str, optional
+            ``mode`` argument of ``torch.compile``, such as "reduce-overhead" (default is None).
+        """
+        super().__init__(model, device, eos_token_id, pad_token_id, max_batch_size)
+        self.batch_buckets = _buckets(1, max_batch_size)
+        self.length_buckets = _buckets(min_bucket, max_length)
+        self.compiled = False
+        self.compile_error = None
+        self.warmup_seconds = 0.0
+        self.decode_steps = 0
+        self.decode_tokens = 0
+        self.decode_seconds = 0.0
+        self.bucket_misses = 0
+        self.bucket_counts = {}
+        self._decode_model = model
+        self._stats_lock = threading.Lock()
+        self._compile(compile_mode)
+
+    @torch.no_grad()
+    def warm_up(self, batch_sizes=None, lengths=None):
+        """
+        Compiles the decode step for every bucket, so no request pays for a compilation.
+
+        Must be called before the scheduler thread is started.
+
+        Parameters
+        ----------
+        batch_sizes : list of int, optional
+            Batch buckets to compile (default is all of them).
+        lengths : list of int, optional
+            Cache length buckets to compile (default is all of them).
+
+        Returns
+        -------
+        float
+            Seconds spent compiling.
+        """
+        if not self.compiled:
+            return 0.0
+        start = time.perf_counter()
+        if self.layout is None:
+            self.layout = CacheLayout.detect(self.model, self.device)
+        for batch in batch_sizes or self.batch_buckets:
+            token = torch.full((batch, 1), self.pad_token_id, dtype=torch.long, device=self.device)
+            first = self.model(input_ids=token, use_cache=True).past_key_values
+            for length in lengths or self.length_buckets:
+                cache = self.layout.pad_left(first, length - 1)
+                attention_mask = torch.zeros((batch, length + 1), dtype=torch.long, device=self.device)
+                attention_mask[:, -2:] = 1
+                try:
+                    # A freshly padded cache and the rolled window of later steps have different
+                    # strides, so both variants are compiled.
+                    _, cache = self._forward(token, attention_mask, cache, self._decode_model)
+                    cache = self.layout.trim_left(cache, 1, copy=False)
+                    self._forward(token, attention_mask, cache, self._decode_model)
+                except Exception as error:
+                    self._fall_back(error)
+                    return 0.0
+        self.warmup_seconds += time.perf_counter() - start
+        return self.warmup_seconds
+
+    def stats(self):
+        """
+        Returns bucket hit rates and decode latency per token.
+
+        Returns
+        -------
+        dict
+            Whether the decode step is compiled, decode steps per ``"<batch>x<length>"`` bucket,
+            the fraction of steps that ran on a bucket, and the average time per decode step,
+            which is the latency of one token of every running request.
+        """
+        with self._stats_lock:
+            hits = sum(self.bucket_counts.values())
+            steps = hits + self.bucket_misses
+            return {
+                "compiled": self.compiled,
+                "compile_error": self.compile_error,
+                "warmup_seconds": self.warmup_seconds,
+                "decode_steps": self.decode_steps,
+                "decode_tokens": self.decode_tokens,
+                "bucket_hit_rate": hits / steps if steps else 0.0,
+                "bucket_misses": self.bucket_misses,
+                "buckets": dict(self.bucket_counts),
+                "seconds_per_token": self.decode_seconds / self.decode_steps if self.decode_steps else 0.0,
+                "tokens_per_second": self.decode_tokens / self.decode_seconds if self.decode_seconds else 0.0,
+            }
+
+    def _compile(self, mode):
+        try:
+            import torch._dynamo
+
+            # Each bucket is one graph per stride variant; the default limit would evict some of them.
+            limit = 2 * len(self.batch_buckets) * len(self.length_buckets) + 8
+            torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, limit)
+            self._decode_model = torch.compile(self.model, mode=mode, dynamic=False)
+            self.compiled = True
+        except Exception as error:
+            self._fall_back(error)
+
+    def _fall_back(self, error):
+        warnings.warn(f"Compiled decoding is not available, decoding eagerly: {error}")
+        self.compiled = False
+        self.compile_error = str(error)
+        self._decode_model = self.model
+
+    def _decode(self):
+        start = time.perf_counter()
+        rows = len(self.running)
+        key = self._bucketed_decode()
+        if key is None:
+            self._strip()
+            super()._decode()
+        with self._stats_lock:
+            self.decode_steps += 1
+            self.decode_tokens += rows
+            self.decode_seconds += time.perf_counter() - start
+            if key is None:
+                self.bucket_misses += 1
+            else:
+                self.bucket_counts[key] = self.bucket_counts.get(key, 0) + 1
+
+    def _bucketed_decode(self):
+        # Returns the bucket of the step, or None when it has to run eagerly on the exact shapes.
+        if not self.compiled:
+            return None
+        rows = len(self.running)
+        batch = _bucket(self.batch_buckets, rows)
+        length = _bucket(self.length_buckets, self.attention_mask.shape[1])
+        if batch is None or length is None:
+            return None
+        self._pad(batch, length)
+        input_ids = torch.full((batch, 1), self.pad_token_id, dtype=torch.long)
+        input_ids[:rows, 0] = torch.tensor([request.output_ids[-1] for request in self.running])
+        input_ids = input_ids.to(self.device)
+        attention_mask = torch.cat([self.attention_mask, self.attention_mask.new_ones((batch, 1))], dim=1)
+        try:
+            logits, cache = self._forward(input_ids, attention_mask, self.cache, self._decode_model)
+        except Exception as error:
+            self._fall_back(error)
+            return None
+        self.cache, self.attention_mask = cache, attention_mask
+        if not self.attention_mask[:rows, 0].any():
+            self.cache = self.layout.trim_left(self.cache, 1, copy=False)
+            self.attention_mask = self.attention_mask[:, 1:]
+        self._append_tokens(self.running, logits[:rows])
+        return f"{batch}x{length}"
+
+    def _pad(self, batch, length):
+        width = self.attention_mask.shape[1]
+        if width < length:
+            self.cache = self.layout.pad_left(self.cache, length - width)
+            self.attention_mask = torch.nn.functional.pad(self.attention_mask, (length - width, 0))
+        extra = batch - self.attention_mask.shape[0]
+        if extra > 0:
+            # Filler rows copy the first request's cache but are fully masked.
+            filler = self.layout.select(self.cache, torch.zeros(extra, dtype=torch.long, device=self.device))
+            self.cache = self.layout.concat([self.cache, filler])
+            self.attention_mask = torch.cat([self.attention_mask, self.attention_mask.new_zeros((extra, length))])
+
+    def _strip(self):
+        # Removes the filler rows, which the batching code of InferenceEngine does not know about.
+        if self.cache is not None and self.attention_mask.shape[0] > len(self.running):
+            index = torch.arange(len(self.running), device=self.device)
+            self.cache = self.layout.select(self.cache, index)
+            self.attention_mask = self.attention_mask[:len(self.running)]
+
+    def _merge(self, new, cache, attention_mask):
+        self._strip()
+        super()._merge(new, cache, attention_mask)
+
+
+def _buckets(smallest, largest):
+    sizes = []
+    size = smallest
+    while size < largest:
+        sizes.append(size)
+        size *= 2
+    sizes.append(largest)
+    return tuple(sizes)
+
+
+def _bucket(buckets, size):
+    for bucket in buckets:
+        if bucket >= size:
+            return bucket
+    return None
@@ -0,0 +1,248 @@
+import threading
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ConversationContext:
+    """
+    Builds conversation prompts that fit a token budget.
+
+    Every turn is formatted with the history template and tokenized once; the token ids are kept
+    in an LRU cache keyed on the text, so a new turn only tokenizes the new question and the
+    previous answer. When the turns no longer fit into ``max_tokens``, the oldest ones are dropped
+    until the prompt is down to ``low_water`` of the budget. Dropping in one larger step (instead
+    of one turn per request) keeps the start of the prompt stable for the following turns, so the
+    session KV cache can be reused until the budget is reached again.
+
+    With a ``summarizer``, dropped turns are folded into a rolling summary of the session in a
+    background thread, in chunks of at most ``low_water`` of the budget, and the summary is put
+    in front of the kept turns once it is ready. The request that dropped the turns never waits
+    for it. A summary longer than a quarter of the budget is not used.
+
+    Attributes
+    ----------
+    max_tokens : int
+        Largest prompt, in tokens, the context builds.
+    low_water : float
+        Fraction of ``max_tokens`` the turns are trimmed to when the budget is exceeded.
+    summarizer : callable or None
+        ``summarizer(summary, turns, max_tokens)`` returning a new summary of at most ``max_tokens``
+        tokens from the previous one (or None) and a list of ``(question, answer)`` turns.
+
+    Methods
+    -------
+    build(instruction, turns, session_id=None):
+        Returns the prompt token ids of a new question and the number of dropped turns.
+
+    count(text):
+        Returns the number of tokens of a text, using the cache.
+
+    summary(session_id):
+        Returns the rolling summary of a session, or None.
+
+    forget(session_id):
+        Drops everything the context remembers about a session.
+    """
+
+    def __init__(self, tokenizer, history_template, prompt_template, max_tokens, low_water=0.5, summarizer=None,
+                 summary_template="### Tóm tắt: {summary}\n", cache_size=16384, max_sessions=10000):
+        """
+        Initializes the ConversationContext.
+
+        Parameters
+        ----------
+        tokenizer : PreTrainedTokenizer
+            The tokenizer of the model.
+        history_template : str
+            Template of an earlier turn, with ``{instruction}`` and ``{response}`` fields.
+        prompt_template : str
+            Template of the new question, with an ``{instruction}`` field.
+        max_tokens : int
+            Largest prompt in tokens.
+        low_water : float, optional
+            Fraction of the budget kept after trimming (default is 0.5).
+        summarizer : callable, optional
+            Function folding dropped turns into a summary (default is None, dropped turns are forgotten).
+        summary_template : str, optional
+            Template of the summary put in front of the turns, with a ``{summary}`` field.
+        cache_size : int, optional
+            Number of tokenized texts kept (default is 16384).
+        max_sessions : int, optional
+            Number of sessions whose trimming point and summary are kept (default is 10000).
+        """
+        self.tokenizer = tokenizer
+        self.history_template = history_template
+        self.prompt_template = prompt_template
+        self.summary_template = summary_template
+        self.max_tokens = max_tokens
+        self.low_water = low_water
+        self.summarizer = summarizer
+        self.cache_size = cache_size
+        self.max_sessions = max_sessions
+        self._prefix = list(tokenizer("")["input_ids"])
+        self._tokens = OrderedDict()
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="history-summarizer") if summarizer else None
+
+    def count(self, text):
+        """
+        Returns the number of tokens of a text.
+
+        Parameters
+        ----------
+        text : str
+            The text.
+
+        Returns
+        -------
+        int
+            Number of tokens, without special tokens.
+        """
+        return len(self._encode(text))
+
+    def build(self, instruction, turns, session_id=None):
+        """
+        Returns the prompt token ids of a new question under the token budget.
+
+        Parameters
+        ----------
+        instruction : str
+            The new question.
+        turns : list of tuple
+            Earlier ``(question, answer)`` turns, oldest first.
+        session_id : str, optional
+            Identifier of the chat session; remembers where the prompt starts and holds the summary.
+
+        Returns
+        -------
+        tuple
+            ``(input_ids, dropped)`` with the prompt token ids and the number of leading turns left out.
+        """
+        question = self._encode(self.prompt_template.format(instruction=instruction))
+        turn_ids = [self._encode(self.history_template.format(instruction=q, response=a)) for q, a in turns]
+        state = self._state(session_id)
+        summary = self._encode(self.summary_template.format(summary=state["summary"])) if state["summary"] else ()
+        if len(summary) > self.max_tokens // 4:
+            summary = ()
+
+        budget = self.max_tokens - len(self._prefix) - len(summary) - len(question)
+        start = _index(turns, state["first"])
+        total = sum(len(ids) for ids in turn_ids[start:])
+        if total > budget:
+            target = budget * self.low_water
+            while start < len(turns) and total > target:
+                total -= len(turn_ids[start])
+                start += 1
+        if session_id is not None:
+            with self._lock:
+                state["first"] = turns[start] if start < len(turns) else None
+        if start and self._executor is not None and session_id is not None:
+            self._summarize(session_id, state, turns[:start], turn_ids[:start])
+
+        input_ids = list(self._prefix) + list(summary)
+        for ids in turn_ids[start:]:
+            input_ids += ids
+        return input_ids + list(question), start
+
+    def summary(self, session_id):
+        """
+        Returns the rolling summary of a session.
+
+        Parameters
+        ----------
+        session_id : str
+            Identifier of the chat session.
+
+        Returns
+        -------
+        str or None
+            The summary of the dropped turns, or None when there is none yet.
+        """
+        with self._lock:
+            state = self._sessions.get(session_id)
+            return state["summary"] if state else None
+
+    def forget(self, session_id):
+        """
+        Drops the trimming point and the summary of a session.
+
+        Parameters
+        ----------
+        session_id : str
+            Identifier of the chat session.
+        """
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _encode(self, text):
+        with self._lock:
+            ids = self._tokens.get(text)
+            if ids is not None:
+                self._tokens.move_to_end(text)
+                return ids
+        ids = tuple(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+        with self._lock:
+            self._tokens[text] = ids
+            while len(self._tokens) > self.cache_size:
+                self._tokens.popitem(last=False)
+        return ids
+
+    def _state(self, session_id):
+        if session_id is None:
+            return {"first": None, "summary": None, "summarized": None, "running": False}
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is None:
+                state = {"first": None, "summary": None, "summarized": None, "running": False}
+                self._sessions[session_id] = state
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            self._sessions.move_to_end(session_id)
+            return state
+
+    def _summarize(self, session_id, state, dropped, dropped_ids):
+        with self._lock:
+            if state["running"] or state["summarized"] == dropped[-1]:
+                return
+            state["running"] = True
+            new = dropped[_index(dropped, state["summarized"], after=True):]
+            new_ids = dropped_ids[len(dropped) - len(new):]
+            # Every dropped turn is folded in, oldest first, in chunks the summarizer can take at once.
+            chunks, size = [[]], 0
+            for turn, ids in zip(new, new_ids):
+                if chunks[-1] and size + len(ids) > self.max_tokens * self.low_water:
+                    chunks.append([])
+                    size = 0
+                chunks[-1].append(turn)
+                size += len(ids)
+            previous = state["summary"]
+
+        def run():
+            summary = previous
+            try:
+                for chunk in chunks:
+                    summary = self.summarizer(summary, chunk, self.max_tokens // 4 - 8)
+                    if not summary:
+                        break
+                    with self._lock:
+                        state["summary"] = summary
+                        state["summarized"] = chunk[-1]
+            except Exception as error:
+                warnings.warn(f"Could not summarize the history of session {session_id}: {error}")
+            finally:
+                with self._lock:
+                    state["running"] = False
+
+        self._executor.submit(run)
+
+
+def _index(turns, turn, after=False):
+    # Position of a remembered turn in the current list (searched from the end), or 0 when it is gone.
+    if turn is None:
+        return 0
+    for position in range(len(turns) - 1, -1, -1):
+        if turns[position] == turn:
+            return position + 1 if after else position
+    return 0
@@ -0,0 +1,312 @@
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+DEFAULT_CONVERSATION_STORE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "conversations.sqlite")
+
+
+class Turn:
+    """
+    A compact record of one stored chat message.
+
+    Attributes
+    ----------
+    seq : int
+        Position of the message in its conversation, starting at 0.
+    origin : str
+        "human" or "ai".
+    message : str
+        The content of the message.
+    created : float
+        ``time.time()`` when the message was added.
+    """
+    __slots__ = ("seq", "origin", "message", "created")
+
+    def __init__(self, seq, origin, message, created):
+        self.seq = seq
+        self.origin = origin
+        self.message = message
+        self.created = created
+
+    def __repr__(self):
+        return f"Turn(seq={self.seq}, origin={self.origin!r}, message={self.message!r})"
+
+
+class _SessionTail:
+    __slots__ = ("count", "turns")
+
+    def __init__(self, count, turns, tail_size):
+        self.count = count
+        self.turns = deque(turns, maxlen=tail_size)
+
+
+class ConversationStore:
+    """
+    A durable store of chat conversations with a bounded in-memory footprint.
+
+    Messages are appended to an SQLite table that survives restarts. Only the last ``tail_size``
+    messages of the ``max_sessions`` most recently used sessions are kept in memory; older
+    messages, and sessions that were not used for a while, are paged back in from disk on
+    demand. Writes are buffered and committed in batches by a background thread, every
+    ``flush_interval`` seconds or once ``batch_size`` messages are pending, so a chat turn never
+    waits for the disk.
+
+    Attributes
+    ----------
+    path : str
+        Location of the SQLite file.
+    tail_size : int
+        Messages per session kept in memory.
+    max_sessions : int
+        Sessions whose tail is kept in memory.
+
+    Methods
+    -------
+    append(session_id, origin, message):
+        Adds a message to the end of a conversation.
+
+    count(session_id):
+        Returns the number of messages of a conversation.
+
+    recent(session_id, limit):
+        Returns the last ``limit`` messages of a conversation, oldest first.
+
+    page(session_id, before, limit):
+        Returns up to ``limit`` messages preceding position ``before``, oldest first.
+
+    delete(session_id):
+        Removes a conversation.
+
+    flush():
+        Writes every pending message to disk.
+
+    close():
+        Flushes and stops the background writer.
+    """
+
+    def __init__(self, path=DEFAULT_CONVERSATION_STORE, tail_size=50, max_sessions=1024, flush_interval=1.0, batch_size=256):
+        """
+        Initializes the ConversationStore.
+
+        Parameters
+        ----------
+        path : str, optional
+            Location of the SQLite file (default is cache/conversations.sqlite next to this module).
+        tail_size : int, optional
+            Messages per session kept in memory (default is 50).
+        max_sessions : int, optional
+            Sessions whose tail is kept in memory (default is 1024).
+        flush_interval : float, optional
+            Longest time a message waits before it is written (default is 1 second).
+        batch_size : int, optional
+            Pending messages that trigger an immediate write (default is 256).
+        """
+        self.path = path
+        self.tail_size = tail_size
+        self.max_sessions = max_sessions
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self._sessions = OrderedDict()
+        self._pending = []
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._closed = False
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "session_id TEXT NOT NULL, seq INTEGER NOT NULL, origin TEXT NOT NULL, message TEXT NOT NULL, "
+            "created REAL NOT NULL, PRIMARY KEY (session_id, seq)) WITHOUT ROWID"
+        )
+        self._db.commit()
+
+        self._writer = threading.Thread(target=self._write_loop, name="conversation-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def append(self, session_id, origin, message):
+        """
+        Adds a message to the end of a conversation.
+
+        Parameters
+        ----------
+        session_id : str
+            Identifier of the conversation.
+        origin : str
+            "human" or "ai".
+        message : str
+            The content of the message.
+
+        Returns
+        -------
+        Turn
+            The stored record.
+        """
+        with self._lock:
+            tail = self._tail(session_id)
+            turn = Turn(tail.count, origin, message, time.time())
+            tail.count += 1
+            tail.turns.append(turn)
+            self._pending.append((session_id, turn))
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify()
+            return turn
+
+    def count(self, session_id):
+        """
+        Returns the number of messages of a conversation.
+
+        Parameters
+        ----------
+        session_id : str
+            Identifier of the conversation.
+
+        Returns
+        -------
+        int
+            Number of stored messages.
+        """
+        with self._lock:
+            return self._tail(session_id).count
+
+    def recent(self, session_id, limit):
+        """
+        Returns the last messages of a conversation.
+
+        Parameters
+        ----------
+        session_id : str
+            Identifier of the conversation.
+        limit : int
+            Maximum number of messages.
+
+        Returns
+        -------
+        list of Turn
+            The messages, oldest first.
+        """
+        with self._lock:
+            tail = self._tail(session_id)
+            if limit <= len(tail.turns) or len(tail.turns) == tail.count:
+                return list(tail.turns)[-limit:] if limit > 0 else []
+            count = tail.count
+        return self.page(session_id, count, limit)
+
+    def page(self, session_id, before, limit):
+        """
+        Returns the messages preceding a position, reading them from disk when needed.
+
+        Parameters
+        ----------
+        session_id : str
+            Identifier of the conversation.
+        before : int
+            Position of the first message that is not returned.
+        limit : int
+            Maximum number of messages.
+
+        Returns
+        -------
+        list of Turn
+            The messages, oldest first.
+        """
+        with self._lock:
+            tail = self._tail(session_id)
+            if tail.turns and tail.turns[0].seq <= max(before - limit, 0) and before <= tail.count:
+                return [turn for turn in tail.turns if before - limit <= turn.seq < before]
+            self._flush_locked()
+            rows = self._db.execute(
+                "SELECT seq, origin, message, created FROM messages WHERE session_id = ? AND seq < ? "
+                "ORDER BY seq DESC LIMIT ?",
+                (session_id, before, limit),
+            ).fetchall()
+        return [Turn(*row) for row in reversed(rows)]
+
+    def delete(self, session_id):
+        """
+        Removes a conversation from memory and disk.
+
+        Parameters
+        ----------
+        session_id : str
+            Identifier of the conversation.
+        """
+        with self._lock:
+            self._flush_locked()
+            self._sessions.pop(session_id, None)
+            self._db.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._db.commit()
+
+    def flush(self):
+        """
+        Writes every pending message to disk.
+        """
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        """
+        Flushes pending messages and stops the background writer.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._flush_locked()
+            self._condition.notify()
+        self._writer.join()
+
+    def stats(self):
+        """
+        Returns how many sessions and messages are held in memory.
+
+        Returns
+        -------
+        dict
+            Cached sessions, cached messages and pending writes.
+        """
+        with self._lock:
+            return {
+                "sessions_in_memory": len(self._sessions),
+                "messages_in_memory": sum(len(tail.turns) for tail in self._sessions.values()),
+                "pending_writes": len(self._pending),
+            }
+
+    def _tail(self, session_id):
+        tail = self._sessions.get(session_id)
+        if tail is not None:
+            self._sessions.move_to_end(session_id)
+            return tail
+        self._flush_locked()
+        rows = self._db.execute(
+            "SELECT seq, origin, message, created FROM messages WHERE session_id = ? ORDER BY seq DESC LIMIT ?",
+            (session_id, self.tail_size),
+        ).fetchall()
+        count = rows[0][0] + 1 if rows else 0
+        tail = _SessionTail(count, [Turn(*row) for row in reversed(rows)], self.tail_size)
+        self._sessions[session_id] = tail
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return tail
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        self._db.executemany(
+            "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?)",
+            [(session_id, turn.seq, turn.origin, turn.message, turn.created) for session_id, turn in self._pending],
+        )
+        self._db.commit()
+        self._pending = []
+
+    def _write_loop(self):
+        with self._lock:
+            while not self._closed:
+                self._condition.wait(self.flush_interval)
+                self._flush_locked()
@@ -0,0 +1,532 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import unicodedata
+from dataclasses import dataclass
+
+import numpy as np
+
+DOCUMENT_EXTENSIONS = (".txt", ".md")
+_WORD = re.compile(r"\w+")
+_SENTENCE_END = re.compile(r"(?<=[.!?…;:])\s+")
+_PARAGRAPH = re.compile(r"\n\s*\n")
+
+
+@dataclass
+class Passage:
+    """Class for keeping track of one retrieved passage.
+
+    Attributes
+    ----------
+    source : str
+        Path of the document the passage was cut from.
+    text : str
+        The passage.
+    score : float
+        BM25 score of the passage for the query.
+    passage_id : int
+        Position of the passage in the index version it was read from.
+    """
+    source: str
+    text: str
+    score: float = 0.0
+    passage_id: int = -1
+
+
+def tokenize(text):
+    """
+    Splits Vietnamese text into index terms.
+
+    Vietnamese words are written as space-separated syllables ("thủ đô"), so besides the
+    lower-cased syllables every pair of adjacent syllables is a term ("thủ_đô"); a multi-syllable
+    word then outscores passages that only contain its syllables far apart.
+
+    Parameters
+    ----------
+    text : str
+        The text.
+
+    Returns
+    -------
+    list of str
+        Syllables followed by syllable bigrams.
+    """
+    syllables = _WORD.findall(unicodedata.normalize("NFC", text).lower())
+    return syllables + [f"{first}_{second}" for first, second in zip(syllables, syllables[1:])]
+
+
+def chunk_text(text, max_words=120, overlap=30):
+    """
+    Cuts a document into passages of about ``max_words`` words at sentence boundaries.
+
+    Consecutive passages share up to ``overlap`` words of whole sentences, so an answer spanning
+    a boundary is still found in one passage. Sentences longer than ``max_words`` are cut.
+
+    Parameters
+    ----------
+    text : str
+        The document.
+    max_words : int, optional
+        Largest passage in words (default is 120).
+    overlap : int, optional
+        Words repeated from the end of the previous passage (default is 30).
+
+    Returns
+    -------
+    list of str
+        The passages in document order.
+    """
+    sentences = []
+    for paragraph in _PARAGRAPH.split(unicodedata.normalize("NFC", text)):
+        for sentence in _SENTENCE_END.split(paragraph.strip()):
+            words = sentence.split()
+            for start in range(0, len(words), max_words):
+                sentences.append(words[start:start + max_words])
+
+    passages = []
+    current = []
+    for words in sentences:
+        if current and sum(len(sentence) for sentence in current) + len(words) > max_words:
+            passages.append(" ".join(" ".join(sentence) for sentence in current))
+            kept = []
+            while current and sum(len(sentence) for sentence in kept) + len(current[-1]) <= overlap:
+                kept.insert(0, current.pop())
+            current = kept
+        current.append(words)
+    if current:
+        passages.append(" ".join(" ".join(sentence) for sentence in current))
+    return passages
+
+
+class DocumentIndex:
+    """
+    A BM25 index of local documents backed by memory-mapped NumPy arrays.
+
+    Documents are cut into passages by ``chunk_text`` and every passage into terms by
+    ``tokenize``. The index keeps an inverted list per term, with the term's BM25 weight in each
+    passage precomputed at build time, so a query only sums ``idf * weight`` over the postings
+    of its terms and picks the top passages with ``argpartition``. The passage texts, postings
+    and per-passage term lists live in ``.npy`` files that are memory-mapped read-only, so an
+    index much larger than memory only costs the pages a query touches.
+
+    ``build`` is incremental: a document whose size and modification time (or, failing that,
+    content hash) did not change keeps its passages and term lists, and only new or changed
+    documents are read and tokenized. Every build writes a new version folder and then switches
+    the ``CURRENT`` pointer, so an open index keeps answering queries during a build and picks up
+    the new version at its next query.
+
+    Attributes
+    ----------
+    directory : str
+        Folder holding the index versions.
+    k1 : float
+        BM25 term frequency saturation.
+    b : float
+        BM25 length normalization.
+    size : int
+        Number of indexed passages.
+    version : str or None
+        Name of the current index version, None before the first build.
+
+    Methods
+    -------
+    build(paths, max_words=120, overlap=30):
+        Indexes the documents under ``paths``, reusing the unchanged ones.
+
+    search(query, k=5):
+        Returns the ``k`` best passages for a query.
+
+    stats():
+        Returns the size of the index and the latency of the queries.
+    """
+
+    def __init__(self, directory, k1=1.2, b=0.75):
+        """
+        Initializes the DocumentIndex, opening the current version in ``directory`` if there is one.
+
+        Parameters
+        ----------
+        directory : str
+            Folder holding the index versions.
+        k1 : float, optional
+            BM25 term frequency saturation (default is 1.2).
+        b : float, optional
+            BM25 length normalization (default is 0.75).
+        """
+        self.directory = directory
+        self.k1 = k1
+        self.b = b
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.last_query_seconds = 0.0
+        self._version = None
+        self._checked = None
+        self._arrays = {}
+        self._manifest = {"files": {}, "sources": []}
+        self._vocabulary = {}
+        self._lock = threading.Lock()
+        self._refresh()
+
+    @property
+    def size(self):
+        """
+        Returns the number of indexed passages.
+
+        Returns
+        -------
+        int
+            Number of passages of the current version.
+        """
+        self._refresh()
+        return len(self._arrays["passage_sources"]) if self._arrays else 0
+
+    @property
+    def version(self):
+        """
+        Returns the name of the current index version.
+
+        Returns
+        -------
+        str or None
+            Folder name of the version queries read, None while nothing has been built.
+        """
+        self._refresh()
+        return self._version
+
+    def search(self, query, k=5):
+        """
+        Returns the best passages for a query.
+
+        Parameters
+        ----------
+        query : str
+            The question.
+        k : int, optional
+            Number of passages (default is 5).
+
+        Returns
+        -------
+        list of Passage
+            Passages with a positive score, best first.
+        """
+        start = time.perf_counter()
+        self._refresh()
+        with self._lock:
+            arrays, vocabulary, sources = self._arrays, self._vocabulary, self._manifest["sources"]
+        passages = []
+        if arrays:
+            terms = sorted({vocabulary[term] for term in tokenize(query) if term in vocabulary})
+            scores = np.zeros(len(arrays["passage_sources"]), dtype=np.float32)
+            offsets, postings, weights, idf = arrays["postings_offsets"], arrays["postings"], arrays["weights"], arrays["idf"]
+            for term in terms:
+                begin, end = offsets[term], offsets[term + 1]
+                # A passage appears once in a term's postings, so fancy-index accumulation is exact.
+                scores[postings[begin:end]] += idf[term] * weights[begin:end]
+            k = min(k, len(scores))
+            if terms and k > 0:
+                top = np.argpartition(-scores, k - 1)[:k]
+                top = top[np.argsort(-scores[top], kind="stable")]
+                text, text_offsets, passage_sources = arrays["text"], arrays["text_offsets"], arrays["passage_sources"]
+                for passage_id in top:
+                    if scores[passage_id] <= 0:
+                        break
+                    raw = bytes(text[text_offsets[passage_id]:text_offsets[passage_id + 1]])
+                    passages.append(Passage(sources[passage_sources[passage_id]], raw.decode("utf-8"), float(scores[passage_id]), int(passage_id)))
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.queries += 1
+            self.query_seconds += elapsed
+            self.last_query_seconds = elapsed
+        return passages
+
+    def stats(self):
+        """
+        Returns the size of the index and the latency of the queries.
+
+        Returns
+        -------
+        dict
+            Documents, passages, terms, query count and mean and last query seconds.
+        """
+        self._refresh()
+        with self._lock:
+            return {
+                "version": self._version,
+                "documents": len(self._manifest["files"]),
+                "passages": len(self._arrays["passage_sources"]) if self._arrays else 0,
+                "terms": len(self._vocabulary),
+                "queries": self.queries,
+                "mean_query_seconds": self.query_seconds / self.queries if self.queries else 0.0,
+                "last_query_seconds": self.last_query_seconds,
+            }
+
+    def build(self, paths, max_words=120, overlap=30):
+        """
+        Indexes the documents under ``paths``, reusing the unchanged ones.
+
+        ``paths`` is the whole corpus: documents indexed before that are no longer found are
+        removed. Changing ``max_words`` or ``overlap`` re-chunks every document.
+
+        Parameters
+        ----------
+        paths : list of str
+            Files, or folders searched recursively for ``DOCUMENT_EXTENSIONS`` files.
+        max_words : int, optional
+            Largest passage in words (default is 120).
+        overlap : int, optional
+            Words shared by consecutive passages (default is 30).
+
+        Returns
+        -------
+        dict
+            Counts of added, updated, removed and unchanged documents, passages and terms, and seconds.
+        """
+        start = time.perf_counter()
+        self._refresh()
+        with self._lock:
+            old, arrays, vocabulary = self._manifest, self._arrays, self._vocabulary
+        chunking = {"max_words": max_words, "overlap": overlap}
+        reuse = bool(arrays) and old.get("chunking") == chunking
+        old_terms = list(vocabulary)
+        term_ids = dict(vocabulary)
+        counts = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+
+        files = {}
+        plan = []
+        texts, text_lengths, terms, term_counts, term_lengths, lengths, passage_files = [], [], [], [], [], [], []
+        for path in _document_paths(paths):
+            status = os.stat(path)
+            entry = {"size": status.st_size, "mtime": status.st_mtime_ns}
+            previous = old["files"].get(path) if reuse else None
+            content = None
+            if previous is not None and (previous["size"], previous["mtime"]) != (entry["size"], entry["mtime"]):
+                with open(path, "rb") as f:
+                    content = f.read()
+                if hashlib.sha256(content).hexdigest() != previous["sha256"]:
+                    previous = None
+            if previous is not None:
+                entry["sha256"] = previous["sha256"]
+                files[path] = entry
+                counts["unchanged"] += 1
+                plan.append(("old",) + tuple(previous["passages"]))
+                continue
+            if content is None:
+                with open(path, "rb") as f:
+                    content = f.read()
+            entry["sha256"] = hashlib.sha256(content).hexdigest()
+            files[path] = entry
+            counts["updated" if path in old["files"] else "added"] += 1
+            plan.append(("new", chunk_text(content.decode("utf-8", errors="replace"), max_words, overlap)))
+        counts["removed"] = len(set(old["files"]) - set(files))
+
+        # Gather the kept passages from the old arrays and tokenize the new ones, in file order.
+        sources = list(files)
+        first_passage = 0
+        for path, item in zip(sources, plan):
+            if item[0] == "old":
+                _, first, last = item
+                text_begin, text_end = arrays["text_offsets"][first], arrays["text_offsets"][last]
+                texts.append(np.asarray(arrays["text"][text_begin:text_end]))
+                text_lengths.append(np.diff(arrays["text_offsets"][first:last + 1]))
+                term_begin, term_end = arrays["term_offsets"][first], arrays["term_offsets"][last]
+                # Old term ids are translated through the old vocabulary, which is kept as a prefix.
+                terms.append(np.asarray(arrays["terms"][term_begin:term_end], dtype=np.int64))
+                term_counts.append(np.asarray(arrays["term_counts"][term_begin:term_end]))
+                term_lengths.append(np.diff(arrays["term_offsets"][first:last + 1]))
+                lengths.append(np.asarray(arrays["lengths"][first:last]))
+            else:
+                encoded = [passage.encode("utf-8") for passage in item[1]]
+                texts.append(np.frombuffer(b"".join(encoded), dtype=np.uint8))
+                text_lengths.append(np.array([len(data) for data in encoded], dtype=np.int64))
+                passage_terms, passage_counts, passage_term_lengths, passage_lengths = [], [], [], []
+                for passage in item[1]:
+                    tokens = tokenize(passage)
+                    frequencies = {}
+                    for token in tokens:
+                        term = term_ids.get(token)
+                        if term is None:
+                            term = term_ids[token] = len(old_terms)
+                            old_terms.append(token)
+                        frequencies[term] = frequencies.get(term, 0) + 1
+                    passage_terms += frequencies.keys()
+                    passage_counts += frequencies.values()
+                    passage_term_lengths.append(len(frequencies))
+                    passage_lengths.append(len(tokens))
+                terms.append(np.array(passage_terms, dtype=np.int64))
+                term_counts.append(np.array(passage_counts, dtype=np.int32))
+                term_lengths.append(np.array(passage_term_lengths, dtype=np.int64))
+                lengths.append(np.array(passage_lengths, dtype=np.int32))
+            files[path]["passages"] = [first_passage, first_passage + len(lengths[-1])]
+            first_passage += len(lengths[-1])
+
+        version = self._write(files, sources, chunking, old_terms, texts, text_lengths, terms, term_counts, term_lengths, lengths)
+        self._checked = None
+        self._refresh()
+        stats = self.stats()
+        counts.update(passages=stats["passages"], terms=stats["terms"], version=version, seconds=time.perf_counter() - start)
+        return counts
+
+    def _write(self, files, sources, chunking, vocabulary, texts, text_lengths, terms, term_counts, term_lengths, lengths):
+        concat = lambda parts, dtype: np.concatenate([np.asarray(part, dtype=dtype) for part in parts]) if parts else np.zeros(0, dtype)
+        text = concat(texts, np.uint8)
+        text_offsets = np.concatenate([[0], np.cumsum(concat(text_lengths, np.int64))]).astype(np.int64)
+        passage_terms = concat(terms, np.int64)
+        passage_term_counts = concat(term_counts, np.int32)
+        term_offsets = np.concatenate([[0], np.cumsum(concat(term_lengths, np.int64))]).astype(np.int64)
+        passage_lengths = concat(lengths, np.int32)
+        passage_sources = np.repeat(np.arange(len(sources), dtype=np.int32),
+                                    [files[path]["passages"][1] - files[path]["passages"][0] for path in sources])
+
+        # Terms of removed documents are dropped and the remaining ones renumbered.
+        used, passage_terms = np.unique(passage_terms, return_inverse=True)
+        passage_terms = passage_terms.astype(np.int32)
+        vocabulary = [vocabulary[term] for term in used]
+
+        # Inverted lists: postings grouped by term, passages in increasing order within a term.
+        passage_of_term = np.repeat(np.arange(len(passage_lengths), dtype=np.int32), np.diff(term_offsets))
+        order = np.argsort(passage_terms, kind="stable")
+        postings = passage_of_term[order]
+        frequency = passage_term_counts[order].astype(np.float32)
+        document_frequency = np.bincount(passage_terms, minlength=len(vocabulary))
+        postings_offsets = np.concatenate([[0], np.cumsum(document_frequency)]).astype(np.int64)
+        count = len(passage_lengths)
+        average_length = float(passage_lengths.mean()) if count else 0.0
+        norm = self.k1 * (1 - self.b + self.b * passage_lengths[postings] / max(average_length, 1e-9))
+        weights = (frequency * (self.k1 + 1) / (frequency + norm)).astype(np.float32)
+        idf = np.log1p((count - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+
+        version = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}-{int(time.time_ns() % 1000000):06d}"
+        folder = os.path.join(self.directory, version)
+        os.makedirs(folder)
+        for name, array in (("text", text), ("text_offsets", text_offsets), ("terms", passage_terms),
+                            ("term_counts", passage_term_counts), ("term_offsets", term_offsets),
+                            ("lengths", passage_lengths), ("passage_sources", passage_sources),
+                            ("postings", postings), ("postings_offsets", postings_offsets),
+                            ("weights", weights), ("idf", idf)):
+            np.save(os.path.join(folder, f"{name}.npy"), array)
+        with open(os.path.join(folder, "vocabulary.json"), "w", encoding="utf-8") as f:
+            json.dump(vocabulary, f, ensure_ascii=False)
+        with open(os.path.join(folder, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump({"files": files, "sources": sources, "chunking": chunking, "k1": self.k1, "b": self.b,
+                       "average_length": average_length}, f, ensure_ascii=False)
+        with open(os.path.join(self.directory, "CURRENT.tmp"), "w") as f:
+            f.write(version)
+        os.replace(os.path.join(self.directory, "CURRENT.tmp"), os.path.join(self.directory, "CURRENT"))
+        # The previous version is kept for indexes that are just opening it; open memory maps of
+        # older ones stay readable after their files are removed.
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name not in (version, self._version) and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+        return version
+
+    def _refresh(self):
+        # Rereads CURRENT at most every 100 ms, so a build by another process is picked up cheaply.
+        now = time.monotonic()
+        if self._checked is not None and now - self._checked < 0.1:
+            return
+        self._checked = now
+        try:
+            with open(os.path.join(self.directory, "CURRENT")) as f:
+                version = f.read().strip()
+        except FileNotFoundError:
+            return
+        if version == self._version:
+            return
+        folder = os.path.join(self.directory, version)
+        with open(os.path.join(folder, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+        with open(os.path.join(folder, "vocabulary.json"), encoding="utf-8") as f:
+            vocabulary = {term: term_id for term_id, term in enumerate(json.load(f))}
+        arrays = {}
+        for name in os.listdir(folder):
+            if name.endswith(".npy"):
+                arrays[name[:-4]] = _load(os.path.join(folder, name))
+        with self._lock:
+            self._version, self._manifest, self._vocabulary, self._arrays = version, manifest, vocabulary, arrays
+
+
+def _load(path):
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        # Empty arrays cannot be memory-mapped.
+        return np.load(path)
+
+
+def _document_paths(paths):
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, folders, names in os.walk(path):
+                folders.sort()
+                found += [os.path.join(root, name) for name in sorted(names) if name.lower().endswith(DOCUMENT_EXTENSIONS)]
+        elif os.path.isfile(path):
+            found.append(path)
+        else:
+            raise FileNotFoundError(path)
+    return [os.path.abspath(path) for path in found]
+
+
+def select_passages(passages, count, max_tokens):
+    """
+    Keeps the best passages whose total length fits a token budget.
+
+    Parameters
+    ----------
+    passages : list of Passage
+        Candidate passages, best first.
+    count : callable
+        Function returning the number of tokens of a passage text.
+    max_tokens : int
+        The budget.
+
+    Returns
+    -------
+    list of Passage
+        The kept passages, best first; a passage that does not fit is skipped for a shorter one.
+    """
+    kept = []
+    used = 0
+    for passage in passages:
+        size = count(passage.text)
+        if used + size <= max_tokens:
+            kept.append(passage)
+            used += size
+    return kept
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the local document index used for retrieval.")
+    parser.add_argument("index", help="folder of the index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="index documents; unchanged documents are reused")
+    build.add_argument("paths", nargs="+", help=f"files or folders of {', '.join(DOCUMENT_EXTENSIONS)} documents")
+    build.add_argument("--max-words", type=int, default=120, help="largest passage in words")
+    build.add_argument("--overlap", type=int, default=30, help="words shared by consecutive passages")
+    search = commands.add_parser("search", help="print the best passages for a question")
+    search.add_argument("query")
+    search.add_argument("-k", type=int, default=5)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    index = DocumentIndex(args.index)
+    if args.command == "build":
+        print(json.dumps(index.build(args.paths, args.max_words, args.overlap), indent=2))
+        return 0
+    for passage in index.search(args.query, args.k):
+        print(f"{passage.score:.3f}  {passage.source}\n{passage.text}\n")
+    print(f"{index.last_query_seconds * 1000:.2f} ms", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
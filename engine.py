@@ -0,0 +1,760 @@
+import concurrent.futures
+import inspect
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import torch
+
+from admission import AdmissionError, is_out_of_memory
+from kv_cache import CacheLayout
+
+
+@dataclass
+class SamplingParams:
+    """Class for keeping track of the sampling settings of a single generation request.
+
+    Attributes
+    ----------
+    do_sample : bool
+        Sample from the distribution when True, otherwise pick the most likely token.
+    temperature : float
+        Softmax temperature applied to the logits before sampling.
+    top_k : int
+        Keep only the ``top_k`` most likely tokens (0 disables the filter).
+    top_p : float
+        Keep the smallest set of tokens whose cumulative probability reaches ``top_p``.
+    max_new_tokens : int
+        Upper bound on the number of generated tokens.
+    seed : int, optional
+        Seed for a per-request random generator, making sampling reproducible.
+    cacheable : bool
+        Allow the response cache to store and replay sampled answers.
+    ignore_eos : bool
+        Keep generating after the end-of-sequence token, so benchmarks get fixed output lengths.
+    stop : tuple of str
+        Extra strings that end the generation; ChatBot adds its template markers to them.
+    """
+    do_sample: bool = True
+    temperature: float = 1.0
+    top_k: int = 50
+    top_p: float = 0.9
+    max_new_tokens: int = 1024
+    seed: Optional[int] = None
+    cacheable: bool = False
+    ignore_eos: bool = False
+    stop: Tuple[str, ...] = ()
+
+
+class GenerationRequest:
+    """
+    A class to represent one prompt travelling through the inference engine.
+
+    Attributes
+    ----------
+    request_id : int
+        Unique, increasing identifier of the request.
+    prompt_ids : list of int
+        Token ids of the prompt.
+    params : SamplingParams
+        Sampling settings of this request.
+    output_ids : list of int
+        Token ids generated so far.
+    finish_reason : str or None
+        "eos", "stop", "length" or "cancelled" once the request is finished.
+    error : Exception or None
+        The exception that aborted the request, if any.
+    cache : tuple or None
+        Key/value cache of the finished request when it was submitted with ``keep_cache``.
+    cache_length : int
+        Number of leading tokens of ``prompt_ids + output_ids`` covered by ``cache``.
+    stopping : callable or None
+        Called with every generated token id; returning True finishes the request with "stop".
+    arrival_time, admitted_time, first_token_time, finish_time : float
+        ``time.perf_counter()`` timestamps of the request's life cycle.
+    prefill_seconds : float
+        Duration of the prefill step the request was part of.
+    profile : dict or None
+        Metadata written with the profiler trace of the request, None when it is not profiled.
+
+    Methods
+    -------
+    done():
+        Returns True once the request is finished.
+
+    wait(timeout=None):
+        Blocks until the request is finished and returns the generated token ids.
+
+    stream(timeout=None):
+        Yields generated token ids one by one while the request is being decoded.
+
+    cancel():
+        Asks the engine to stop generating for this request.
+
+    add_done_callback(callback):
+        Calls ``callback(request)`` once the request is finished.
+    """
+
+    def __init__(self, request_id, prompt_ids, params, device):
+        self.request_id = request_id
+        self.prompt_ids = list(prompt_ids)
+        self.params = params
+        self.output_ids = []
+        self.finish_reason = None
+        self.error = None
+        self.arrival_time = time.perf_counter()
+        self.admitted_time = None
+        self.first_token_time = None
+        self.finish_time = None
+        self.prefill_seconds = 0.0
+        self.prefix_cache = None
+        self.prefix_length = 0
+        self.keep_cache = False
+        self.cache = None
+        self.cache_length = 0
+        self.stopping = None
+        self.cancelled = False
+        self.profile = None
+        self.generator = None
+        if params.seed is not None:
+            self.generator = torch.Generator(device=device)
+            self.generator.manual_seed(params.seed)
+        self._finished = threading.Event()
+        self._tokens = queue.Queue()
+        self._callbacks = []
+        self._callback_lock = threading.Lock()
+
+    def done(self):
+        """
+        Returns True once the request is finished.
+
+        Returns
+        -------
+        bool
+            Whether the request has finished, successfully or not.
+        """
+        return self._finished.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the request is finished.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum number of seconds to wait (default is to wait forever).
+
+        Returns
+        -------
+        list of int
+            The generated token ids.
+        """
+        if not self._finished.wait(timeout):
+            raise TimeoutError(f"Request {self.request_id} did not finish within {timeout} seconds")
+        if self.error is not None:
+            raise self.error
+        return self.output_ids
+
+    def stream(self, timeout=None):
+        """
+        Yields generated token ids as soon as the engine produces them.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum number of seconds to wait for each token (default is to wait forever).
+
+        Yields
+        ------
+        int
+            The next generated token id.
+        """
+        while True:
+            try:
+                token = self._tokens.get(timeout=timeout)
+            except queue.Empty:
+                raise TimeoutError(f"Request {self.request_id} produced no token within {timeout} seconds")
+            if token is None:
+                break
+            yield token
+        if self.error is not None:
+            raise self.error
+
+    def cancel(self):
+        """
+        Asks the engine to stop generating for this request.
+
+        A waiting request is dropped before its prefill and a running one leaves the batch at the
+        next scheduler step, so no decode step is spent on an answer nobody reads anymore. The
+        request then finishes with the reason "cancelled".
+        """
+        self.cancelled = True
+
+    def add_done_callback(self, callback):
+        """
+        Calls ``callback(request)`` once the request is finished.
+
+        The callback runs on the engine thread, so it should only hand the request over (e.g. put
+        it in a queue). It is called immediately when the request is already finished.
+
+        Parameters
+        ----------
+        callback : callable
+            Function taking the finished request.
+        """
+        with self._callback_lock:
+            if not self._finished.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _push(self, token):
+        self.output_ids.append(token)
+        self._tokens.put(token)
+
+    def _finish(self, reason, error=None):
+        self.finish_time = time.perf_counter()
+        self.finish_reason = reason
+        self.error = error
+        with self._callback_lock:
+            self._finished.set()
+            callbacks, self._callbacks = self._callbacks, []
+        self._tokens.put(None)
+        for callback in callbacks:
+            callback(self)
+
+
+class InferenceEngine:
+    """
+    A continuous-batching inference engine for causal language models.
+
+    Requests are put in a waiting queue by ``submit``. At every scheduler step the engine
+    prefills as many waiting requests as fit into the running batch, runs a single decode
+    step for the whole batch and drops the requests that finished. Finished requests leave
+    the batch immediately, so new requests never wait for the longest answer in the batch.
+
+    Attributes
+    ----------
+    model : PreTrainedModel
+        The causal language model used for generation.
+    device : str
+        The device the model lives on.
+    max_batch_size : int
+        Maximum number of requests decoded together.
+    eos_token_id : int
+        Token id that ends a generation.
+    pad_token_id : int
+        Token id used to left-pad prompts of different lengths.
+    profiler : RequestProfiler or None
+        Captures profiler traces of the requests submitted with ``profile`` metadata.
+    admission : AdmissionController or None
+        Admits waiting requests only while their estimated memory fits its budget, and shrinks
+        the batch after an out-of-memory error; None admits by batch slots alone.
+
+    Methods
+    -------
+    submit(prompt_ids, params=None, prefix_cache=None, prefix_length=0, keep_cache=False, stopping=None, profile=None):
+        Queues a prompt for generation and returns its GenerationRequest.
+
+    step():
+        Runs one scheduler iteration (admit, decode, retire).
+
+    call(function, *args):
+        Runs a function on the engine thread between two steps and returns its result.
+
+    run_until_complete():
+        Runs scheduler iterations until no work is left.
+
+    start():
+        Starts the background scheduler thread.
+
+    stop():
+        Stops the background scheduler thread.
+    """
+
+    def __init__(self, model, device, eos_token_id, pad_token_id=None, max_batch_size=8):
+        """
+        Initializes the InferenceEngine.
+
+        Parameters
+        ----------
+        model : PreTrainedModel
+            The causal language model used for generation.
+        device : str
+            The device the model lives on.
+        eos_token_id : int
+            Token id that ends a generation.
+        pad_token_id : int, optional
+            Token id used for left padding (defaults to ``eos_token_id``).
+        max_batch_size : int, optional
+            Maximum number of requests decoded together (default is 8).
+        """
+        self.model = model
+        self.device = device
+        self.eos_token_id = eos_token_id
+        self.pad_token_id = eos_token_id if pad_token_id is None else pad_token_id
+        self.max_batch_size = max_batch_size
+
+        self.layout = None
+        self.takes_position_ids = "position_ids" in inspect.signature(model.forward).parameters
+        self.waiting = deque()
+        self.running = []
+        self.cache = None
+        self.attention_mask = None
+        self.profiler = None
+        self.admission = None
+
+        self._calls = deque()
+        self._ids = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    def submit(self, prompt_ids, params=None, prefix_cache=None, prefix_length=0, keep_cache=False, stopping=None, profile=None):
+        """
+        Queues a prompt for generation.
+
+        Parameters
+        ----------
+        prompt_ids : list of int
+            Token ids of the prompt.
+        params : SamplingParams, optional
+            Sampling settings for this request (defaults to ``SamplingParams()``).
+        prefix_cache : tuple, optional
+            ``past_key_values`` (batch size 1, no padding) covering at least the first
+            ``prefix_length`` prompt tokens. Only the remaining tokens are prefilled.
+        prefix_length : int, optional
+            Number of leading prompt tokens covered by ``prefix_cache`` (default is 0).
+        keep_cache : bool, optional
+            Keep the request's key/value cache in ``request.cache`` once it finishes, so the
+            next turn of the conversation can reuse it (default is False).
+        stopping : callable, optional
+            Stopping criteria called with every generated token id on the engine thread, such as
+            a StopSequenceCriteria; the request finishes with "stop" when it returns True.
+        profile : dict, optional
+            Capture a profiler trace of this request with ``self.profiler``, writing these
+            metadata with it (default is None, not profiled).
+
+        Returns
+        -------
+        GenerationRequest
+            Handle that can be waited on for the generated token ids. Its ``params`` may have a
+            smaller ``max_new_tokens`` than requested when the memory budget is tight.
+
+        Raises
+        ------
+        AdmissionError
+            When ``self.admission`` rejects the request.
+        """
+        if not prompt_ids:
+            raise ValueError("prompt_ids must contain at least one token")
+        if prefix_cache is not None and not 0 < prefix_length < len(prompt_ids):
+            raise ValueError("prefix_length must leave at least one prompt token to prefill")
+        params = params or SamplingParams()
+        if self.admission is not None:
+            params = self.admission.check(len(prompt_ids), params, len(self.waiting))
+        request = GenerationRequest(next(self._ids), prompt_ids, params, self.device)
+        if prefix_cache is not None:
+            request.prefix_cache = prefix_cache
+            request.prefix_length = prefix_length
+        request.keep_cache = keep_cache
+        request.stopping = stopping
+        if profile is not None and self.profiler is not None:
+            request.profile = profile
+            self.profiler.expect(request)
+        with self._condition:
+            self.waiting.append(request)
+            self._condition.notify()
+        return request
+
+    def has_work(self):
+        """
+        Returns True while requests are waiting or running, or calls are queued.
+
+        Returns
+        -------
+        bool
+            Whether the engine has unfinished work.
+        """
+        return bool(self.waiting or self.running or self._calls)
+
+    @torch.no_grad()
+    def step(self):
+        """
+        Runs one scheduler iteration.
+
+        Cancelled requests are dropped, waiting requests are admitted into the free batch slots
+        and prefilled, then every running request gets one new token and finished requests are
+        removed from the batch.
+
+        Returns
+        -------
+        bool
+            False if there was nothing to do.
+        """
+        if not self.has_work():
+            return False
+        self._run_calls()
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.before_step(self)
+        try:
+            self._drop_cancelled()
+            self._admit()
+            if self.running:
+                self._decode()
+        except Exception as error:
+            if self.admission is not None and is_out_of_memory(error):
+                self._shed(error)
+            else:
+                self._abort(error)
+        if self.admission is not None:
+            self.admission.after_step(self)
+        if profiler is not None:
+            profiler.after_step(self)
+        return True
+
+    def call(self, function, *args):
+        """
+        Runs a function on the engine thread between two steps and returns its result.
+
+        Meant for forward passes outside of generation, such as embeddings: they then never run
+        concurrently with a prefill or a decode step of the model. Without a scheduler thread the
+        function runs on the calling thread.
+
+        Parameters
+        ----------
+        function : callable
+            The function to run.
+        *args
+            Its arguments.
+
+        Returns
+        -------
+        object
+            What the function returned; an exception it raised is raised here.
+        """
+        with self._condition:
+            inline = self._thread is None or threading.current_thread() is self._thread
+            if not inline:
+                future = concurrent.futures.Future()
+                self._calls.append((future, function, args))
+                self._condition.notify()
+        if inline:
+            return function(*args)
+        return future.result()
+
+    def run_until_complete(self):
+        """
+        Runs scheduler iterations until every submitted request has finished.
+        """
+        while self.step():
+            pass
+
+    def start(self):
+        """
+        Starts the background scheduler thread if it is not running yet.
+        """
+        with self._condition:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._loop, name="inference-engine", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background scheduler thread after its current step.
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._condition:
+            calls, self._calls = self._calls, deque()
+        for future, _, _ in calls:
+            future.set_exception(RuntimeError("the inference engine was stopped"))
+
+    def _loop(self):
+        while True:
+            with self._condition:
+                while not self._stopping and not self.has_work():
+                    self._condition.wait()
+                if self._stopping:
+                    return
+            self.step()
+
+    def _run_calls(self):
+        # Returns True if a queued call ran.
+        if not self._calls:
+            return False
+        with self._condition:
+            calls, self._calls = self._calls, deque()
+        for future, function, args in calls:
+            try:
+                future.set_result(function(*args))
+            except Exception as error:
+                if self.admission is not None and is_out_of_memory(error):
+                    self.admission.on_out_of_memory(self)
+                future.set_exception(error)
+        return True
+
+    def _drop_cancelled(self):
+        with self._condition:
+            cancelled = [request for request in self.waiting if request.cancelled]
+            if cancelled:
+                self.waiting = deque(request for request in self.waiting if not request.cancelled)
+        for request in cancelled:
+            request._finish("cancelled")
+        finished = {request.request_id: "cancelled" for request in self.running if request.cancelled}
+        if finished:
+            self._retire(finished)
+
+    def _admit(self):
+        free = self.max_batch_size - len(self.running)
+        if free <= 0 or not self.waiting:
+            return
+        rejected = []
+        with self._condition:
+            if self.admission is None:
+                new = [self.waiting.popleft() for _ in range(min(free, len(self.waiting)))]
+            else:
+                new, rejected = self.admission.admit(self.running, self.waiting, free)
+        for request in rejected:
+            request._finish("error", AdmissionError(
+                f"request {request.request_id} does not fit into the memory budget after an out-of-memory error"
+            ))
+        if not new:
+            return
+        now = time.perf_counter()
+        for request in new:
+            request.admitted_time = now
+        if self.layout is None:
+            self.layout = CacheLayout.detect(self.model, self.device)
+
+        fresh = [request for request in new if request.prefix_cache is None]
+        if fresh:
+            self._prefill(fresh)
+        for request in new:
+            if request.prefix_cache is not None:
+                self._prefill_with_prefix(request)
+
+    def _prefill(self, new):
+        width = max(len(request.prompt_ids) for request in new)
+        input_ids = torch.full((len(new), width), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(new), width), dtype=torch.long)
+        for row, request in enumerate(new):
+            input_ids[row, width - len(request.prompt_ids):] = torch.tensor(request.prompt_ids)
+            attention_mask[row, width - len(request.prompt_ids):] = 1
+        input_ids = input_ids.to(self.device)
+        attention_mask = attention_mask.to(self.device)
+
+        start = time.perf_counter()
+        try:
+            logits, cache = self._forward(input_ids, attention_mask, None)
+        except Exception as error:
+            if self.admission is not None and is_out_of_memory(error):
+                self.admission.on_out_of_memory(self)
+                if len(new) > 1:
+                    # Retry in smaller groups; only a prompt that fails on its own is dropped.
+                    del input_ids, attention_mask
+                    self._prefill(new[:len(new) // 2])
+                    self._prefill(new[len(new) // 2:])
+                    return
+                error = AdmissionError(f"out of memory while prefilling {len(new[0].prompt_ids)} prompt tokens: {error}")
+            for request in new:
+                request._finish("error", error)
+            return
+        self._merge(new, cache, attention_mask)
+        self._append_tokens(new, logits, start)
+
+    def _prefill_with_prefix(self, request):
+        # Only the prompt tokens after the reused prefix go through the model.
+        prefix = request.prefix_cache
+        request.prefix_cache = None
+        if self.layout.length(prefix) > request.prefix_length:
+            prefix = self.layout.truncate(prefix, request.prefix_length)
+        input_ids = torch.tensor([request.prompt_ids[request.prefix_length:]], device=self.device)
+        attention_mask = torch.ones((1, len(request.prompt_ids)), dtype=torch.long, device=self.device)
+
+        start = time.perf_counter()
+        try:
+            logits, cache = self._forward(input_ids, attention_mask, prefix)
+        except Exception as error:
+            if self.admission is not None and is_out_of_memory(error):
+                self.admission.on_out_of_memory(self)
+                error = AdmissionError(f"out of memory while prefilling {len(request.prompt_ids)} prompt tokens: {error}")
+            request._finish("error", error)
+            return
+        self._merge([request], cache, attention_mask)
+        self._append_tokens([request], logits, start)
+
+    def _decode(self):
+        input_ids = torch.tensor([[request.output_ids[-1]] for request in self.running], device=self.device)
+        attention_mask = torch.cat([self.attention_mask, self.attention_mask.new_ones((len(self.running), 1))], dim=1)
+        logits, self.cache = self._forward(input_ids, attention_mask, self.cache)
+        self.attention_mask = attention_mask
+        self._append_tokens(self.running, logits)
+
+    def _forward(self, input_ids, attention_mask, cache, model=None):
+        kwargs = {}
+        if self.takes_position_ids:
+            position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+            kwargs["position_ids"] = position_ids[:, -input_ids.shape[1]:]
+        outputs = (model or self.model)(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            past_key_values=cache,
+            use_cache=True,
+            **kwargs
+        )
+        return outputs.logits[:, -1, :], outputs.past_key_values
+
+    def _merge(self, new, cache, attention_mask):
+        if not self.running:
+            self.running, self.cache, self.attention_mask = list(new), cache, attention_mask
+            return
+        width = max(self.attention_mask.shape[1], attention_mask.shape[1])
+        old_pad = width - self.attention_mask.shape[1]
+        new_pad = width - attention_mask.shape[1]
+        self.cache = self.layout.concat([self.layout.pad_left(self.cache, old_pad), self.layout.pad_left(cache, new_pad)])
+        self.attention_mask = torch.cat([
+            torch.nn.functional.pad(self.attention_mask, (old_pad, 0)),
+            torch.nn.functional.pad(attention_mask, (new_pad, 0)),
+        ], dim=0)
+        self.running.extend(new)
+
+    def _append_tokens(self, requests, logits, prefill_start=None):
+        finished = {}
+        tokens = [sample_next_token(logits[row], request.params, request.generator) for row, request in enumerate(requests)]
+        now = time.perf_counter()
+        for request, token in zip(requests, tokens):
+            if prefill_start is not None:
+                request.prefill_seconds = now - prefill_start
+                request.first_token_time = now
+            reason = self._accept(request, token)
+            if reason is not None:
+                finished[request.request_id] = reason
+        if finished:
+            self._retire(finished)
+
+    def _accept(self, request, token):
+        # Returns why the request is finished after this token, or None to keep decoding.
+        if token == self.eos_token_id and not request.params.ignore_eos:
+            return "eos"
+        request._push(token)
+        if request.stopping is not None and request.stopping(token):
+            return "stop"
+        if len(request.output_ids) >= request.params.max_new_tokens:
+            return "length"
+        return None
+
+    def _retire(self, finished, errors=None):
+        keep = []
+        for row, request in enumerate(self.running):
+            if request.request_id not in finished:
+                keep.append(row)
+                continue
+            # The cache is extracted before the request is marked finished, so waiters see it.
+            if request.keep_cache and finished[request.request_id] not in ("cancelled", "error"):
+                self._extract_cache(row, request)
+            request._finish(finished[request.request_id], (errors or {}).get(request.request_id))
+        if len(keep) == len(self.running):
+            return
+        if not keep:
+            self.running, self.cache, self.attention_mask = [], None, None
+            return
+        index = torch.tensor(keep, device=self.device)
+        self.running = [self.running[row] for row in keep]
+        self.cache = self.layout.select(self.cache, index)
+        self.attention_mask = self.attention_mask.index_select(0, index)
+        # Columns that are padding for every remaining request can be dropped from the cache.
+        leading = int((self.attention_mask.cumsum(-1) == 0).all(dim=0).sum())
+        if leading:
+            self.cache = self.layout.trim_left(self.cache, leading)
+            self.attention_mask = self.attention_mask[:, leading:]
+
+    def _extract_cache(self, row, request):
+        length = int(self.attention_mask[row].sum())
+        cache = self.layout.select(self.cache, torch.tensor([row], device=self.device))
+        request.cache = self.layout.trim_left(cache, self.attention_mask.shape[1] - length)
+        request.cache_length = length
+
+    def _shed(self, error):
+        # Frees memory by dropping the most recently admitted request instead of the whole batch.
+        self.admission.on_out_of_memory(self)
+        if len(self.running) <= 1:
+            self._abort(AdmissionError(f"out of memory while decoding: {error}"))
+            return
+        newest = max(self.running, key=lambda request: request.admitted_time)
+        self._retire({newest.request_id: "error"}, {newest.request_id: AdmissionError(
+            f"request {newest.request_id} was dropped to free memory for the rest of the batch: {error}"
+        )})
+
+    def _abort(self, error):
+        failed = self.running
+        self.running, self.cache, self.attention_mask = [], None, None
+        for request in failed:
+            request._finish("error", error)
+
+
+def token_probabilities(logits, params):
+    """
+    Turns one row of logits into the sampling distribution of the request.
+
+    Temperature, top-k and top-p are applied exactly as in ``sample_next_token``, so sampling
+    from the returned probabilities is equivalent to calling it.
+
+    Parameters
+    ----------
+    logits : torch.Tensor
+        1-D tensor of next-token logits.
+    params : SamplingParams
+        Sampling settings of the request; ``do_sample`` must be True.
+
+    Returns
+    -------
+    torch.Tensor
+        1-D float tensor of probabilities summing to one.
+    """
+    logits = logits.float() / params.temperature
+    if params.top_k > 0:
+        kth = torch.topk(logits, min(params.top_k, logits.shape[-1])).values[-1]
+        logits = logits.masked_fill(logits < kth, float("-inf"))
+    if params.top_p < 1.0:
+        sorted_logits, sorted_indices = torch.sort(logits, descending=True)
+        cumulative = torch.softmax(sorted_logits, dim=-1).cumsum(-1)
+        remove = cumulative > params.top_p
+        remove[1:] = remove[:-1].clone()
+        remove[0] = False
+        logits = logits.masked_fill(remove.scatter(0, sorted_indices, remove), float("-inf"))
+    return torch.softmax(logits, dim=-1)
+
+
+def sample_next_token(logits, params, generator=None):
+    """
+    Picks the next token from one row of logits according to the sampling settings.
+
+    Parameters
+    ----------
+    logits : torch.Tensor
+        1-D tensor of next-token logits.
+    params : SamplingParams
+        Sampling settings of the request.
+    generator : torch.Generator, optional
+        Random generator used for sampling.
+
+    Returns
+    -------
+    int
+        The selected token id.
+    """
+    if not params.do_sample or params.temperature <= 0:
+        return int(torch.argmax(logits))
+    return int(torch.multinomial(token_probabilities(logits, params), 1, generator=generator))
@@ -0,0 +1,215 @@
+import torch
+
+
+class CacheLayout:
+    """
+    Describes where the sequence axis lives in a model's ``past_key_values``.
+
+    Hugging Face models return their key/value cache as nested tuples of tensors, but the
+    position of the sequence axis differs between architectures (PhoGPT/MPT stores keys as
+    ``[batch, heads, head_dim, seq]`` while most models use ``[batch, heads, seq, head_dim]``).
+    The layout is detected once per model by running two tiny forward passes and looking at
+    which axis grew, so the batching code never has to guess from tensor shapes.
+
+    Attributes
+    ----------
+    seq_dims : tuple
+        Nested tuple with the same structure as ``past_key_values`` holding the sequence axis
+        of every cache tensor. The batch axis is always 0.
+
+    Methods
+    -------
+    detect(model, device):
+        Runs a one-token prefill and a one-token decode step and builds the layout from them.
+    """
+
+    def __init__(self, seq_dims):
+        self.seq_dims = seq_dims
+
+    @classmethod
+    @torch.no_grad()
+    def detect(cls, model, device):
+        """
+        Detects the cache layout of a causal language model.
+
+        Parameters
+        ----------
+        model : PreTrainedModel
+            The model whose ``past_key_values`` layout should be detected.
+        device : str
+            The device the model lives on.
+
+        Returns
+        -------
+        CacheLayout
+            The detected layout.
+        """
+        token = torch.zeros((1, 1), dtype=torch.long, device=device)
+        first = model(input_ids=token, use_cache=True).past_key_values
+        second = model(input_ids=token, past_key_values=first, use_cache=True).past_key_values
+
+        def grown_axis(before, after):
+            for axis, (old, new) in enumerate(zip(before.shape, after.shape)):
+                if new == old + 1:
+                    return axis
+            raise ValueError(f"Could not find the sequence axis of a cache tensor with shape {tuple(after.shape)}")
+
+        return cls(_map2(grown_axis, first, second))
+
+    def length(self, cache):
+        """
+        Returns the number of cached positions (padding included).
+
+        Parameters
+        ----------
+        cache : tuple
+            A ``past_key_values`` structure.
+
+        Returns
+        -------
+        int
+            The size of the sequence axis.
+        """
+        tensor, dim = _first_leaf(cache, self.seq_dims)
+        return tensor.shape[dim]
+
+    def pad_left(self, cache, amount):
+        """
+        Prepends ``amount`` zero positions to every cache tensor.
+
+        Parameters
+        ----------
+        cache : tuple
+            A ``past_key_values`` structure.
+        amount : int
+            Number of positions to prepend.
+
+        Returns
+        -------
+        tuple
+            The padded cache.
+        """
+        if amount <= 0:
+            return cache
+
+        def pad(tensor, dim):
+            shape = list(tensor.shape)
+            shape[dim] = amount
+            return torch.cat([tensor.new_zeros(shape), tensor], dim=dim)
+
+        return _map2(pad, cache, self.seq_dims)
+
+    def trim_left(self, cache, amount, copy=True):
+        """
+        Drops the first ``amount`` positions of every cache tensor.
+
+        Parameters
+        ----------
+        cache : tuple
+            A ``past_key_values`` structure.
+        amount : int
+            Number of positions to drop.
+        copy : bool, optional
+            Return contiguous copies (default is True); False returns views of the original tensors.
+
+        Returns
+        -------
+        tuple
+            The trimmed cache.
+        """
+        if amount <= 0:
+            return cache
+        if not copy:
+            return _map2(lambda tensor, dim: tensor.narrow(dim, amount, tensor.shape[dim] - amount), cache, self.seq_dims)
+        return _map2(lambda tensor, dim: tensor.narrow(dim, amount, tensor.shape[dim] - amount).contiguous(), cache, self.seq_dims)
+
+    def truncate(self, cache, length):
+        """
+        Keeps only the first ``length`` positions of every cache tensor.
+
+        Parameters
+        ----------
+        cache : tuple
+            A ``past_key_values`` structure.
+        length : int
+            Number of positions to keep.
+
+        Returns
+        -------
+        tuple
+            The truncated cache.
+        """
+        return _map2(lambda tensor, dim: tensor.narrow(dim, 0, length), cache, self.seq_dims)
+
+    def select(self, cache, index):
+        """
+        Keeps the batch rows listed in ``index``.
+
+        Parameters
+        ----------
+        cache : tuple
+            A ``past_key_values`` structure.
+        index : torch.Tensor
+            1-D tensor of batch rows to keep.
+
+        Returns
+        -------
+        tuple
+            The cache restricted to the selected rows.
+        """
+        return _map2(lambda tensor, dim: tensor.index_select(0, index), cache, self.seq_dims)
+
+    def concat(self, caches):
+        """
+        Concatenates caches of equal length along the batch axis.
+
+        Parameters
+        ----------
+        caches : list of tuple
+            The caches to concatenate.
+
+        Returns
+        -------
+        tuple
+            The concatenated cache.
+        """
+        return _mapn(lambda tensors, dim: torch.cat(tensors, dim=0), caches, self.seq_dims)
+
+
+def cache_nbytes(cache):
+    """
+    Returns the number of bytes held by a ``past_key_values`` structure.
+
+    Parameters
+    ----------
+    cache : tuple
+        A ``past_key_values`` structure.
+
+    Returns
+    -------
+    int
+        Total size of all cache tensors in bytes.
+    """
+    if cache is None:
+        return 0
+    if torch.is_tensor(cache):
+        return cache.numel() * cache.element_size()
+    return sum(cache_nbytes(item) for item in cache)
+
+
+def _map2(fn, tree, other):
+    if isinstance(tree, (tuple, list)):
+        return tuple(_map2(fn, item, other_item) for item, other_item in zip(tree, other))
+    return fn(tree, other)
+
+
+def _mapn(fn, trees, dims):
+    if isinstance(dims, (tuple, list)):
+        return tuple(_mapn(fn, [tree[i] for tree in trees], dims[i]) for i in range(len(dims)))
+    return fn(trees, dims)
+
+
+def _first_leaf(tree, dims):
+    while isinstance(tree, (tuple, list)):
+        tree, dims = tree[0], dims[0]
+    return tree, dims
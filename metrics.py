@@ -0,0 +1,281 @@
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STAGES = ("retrieve", "tokenize", "queue_wait", "prefill", "decode", "detokenize", "total")
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (1, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+
+@dataclass
+class RequestMetrics:
+    """Class for keeping track of where the time of one chat request went.
+
+    Attributes
+    ----------
+    source : str
+        "model", "response_cache" or "semantic_cache".
+    retrieve : float
+        Seconds spent searching the document index for passages to put into the prompt.
+    tokenize : float
+        Seconds spent building and tokenizing the prompt.
+    queue_wait : float
+        Seconds between submission and admission into the decode batch.
+    prefill : float
+        Seconds of the prefill forward pass, including sampling of the first token.
+    decode : float
+        Seconds between the first and the last generated token.
+    detokenize : float
+        Seconds spent turning token ids into text and post-processing it.
+    total : float
+        End-to-end seconds as seen by the caller.
+    prompt_tokens : int
+        Number of prompt tokens.
+    cached_tokens : int
+        Prompt tokens whose key/value state was reused from the session cache.
+    retrieved_passages : int
+        Number of document passages put into the prompt.
+    output_tokens : int
+        Number of generated tokens.
+    finish_reason : str or None
+        Why generation stopped.
+    timestamp : float
+        ``time.time()`` when the request finished.
+    """
+    source: str = "model"
+    retrieve: float = 0.0
+    tokenize: float = 0.0
+    queue_wait: float = 0.0
+    prefill: float = 0.0
+    decode: float = 0.0
+    detokenize: float = 0.0
+    total: float = 0.0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    retrieved_passages: int = 0
+    output_tokens: int = 0
+    finish_reason: str = None
+    timestamp: float = field(default_factory=time.time)
+
+
+class Histogram:
+    """
+    A Prometheus-style histogram with fixed upper bounds.
+
+    Attributes
+    ----------
+    buckets : tuple of float
+        Upper bounds of the buckets; an implicit ``+Inf`` bucket follows.
+    counts : list of int
+        Observations per bucket (not cumulative).
+    total : float
+        Sum of all observations.
+    count : int
+        Number of observations.
+
+    Methods
+    -------
+    observe(value):
+        Adds one observation.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        Adds one observation.
+
+        Parameters
+        ----------
+        value : float
+            The observed value.
+        """
+        index = len(self.buckets)
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = position
+                break
+        self.counts[index] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsCollector:
+    """
+    A class to aggregate per-request metrics and export them in Prometheus text format.
+
+    Attributes
+    ----------
+    recent : collections.deque
+        The last ``keep_last`` RequestMetrics, newest last.
+
+    Methods
+    -------
+    record(metrics):
+        Adds one finished request to the histograms and the recent list.
+
+    register_gauge(name, help_text, function):
+        Exports the value returned by ``function`` as a gauge.
+
+    render():
+        Returns all metrics in Prometheus text exposition format.
+
+    serve(port=9464, host="127.0.0.1"):
+        Starts a background HTTP server exposing ``/metrics`` (once per process).
+    """
+
+    def __init__(self, keep_last=50):
+        """
+        Initializes the MetricsCollector.
+
+        Parameters
+        ----------
+        keep_last : int, optional
+            Number of recent requests kept for the debug panel (default is 50).
+        """
+        self.recent = deque(maxlen=keep_last)
+        self._stages = {stage: Histogram(LATENCY_BUCKETS) for stage in STAGES}
+        self._tokens = {kind: Histogram(TOKEN_BUCKETS) for kind in ("prompt", "cached", "output")}
+        self._requests = {}
+        self._gauges = {}
+        self._server = None
+        self._lock = threading.Lock()
+
+    def record(self, metrics):
+        """
+        Adds one finished request to the histograms and the recent list.
+
+        Parameters
+        ----------
+        metrics : RequestMetrics
+            Timings and token counts of the request.
+        """
+        with self._lock:
+            self.recent.append(metrics)
+            self._requests[metrics.source] = self._requests.get(metrics.source, 0) + 1
+            if metrics.source != "model":
+                self._stages["total"].observe(metrics.total)
+                return
+            for stage in STAGES:
+                self._stages[stage].observe(getattr(metrics, stage))
+            self._tokens["prompt"].observe(metrics.prompt_tokens)
+            self._tokens["cached"].observe(metrics.cached_tokens)
+            self._tokens["output"].observe(metrics.output_tokens)
+
+    def register_gauge(self, name, help_text, function):
+        """
+        Exports the value returned by ``function`` as a gauge.
+
+        Parameters
+        ----------
+        name : str
+            Metric name.
+        help_text : str
+            Description shown in the ``# HELP`` line.
+        function : callable
+            Called without arguments at every scrape; returns a number.
+        """
+        with self._lock:
+            self._gauges[name] = (help_text, function)
+
+    def recent_requests(self):
+        """
+        Returns the recent requests as dictionaries, newest first.
+
+        Returns
+        -------
+        list of dict
+            One dictionary per request.
+        """
+        with self._lock:
+            return [asdict(metrics) for metrics in reversed(self.recent)]
+
+    def render(self):
+        """
+        Returns all metrics in Prometheus text exposition format.
+
+        Returns
+        -------
+        str
+            The exposition text.
+        """
+        lines = []
+        with self._lock:
+            lines += ["# HELP chatbot_requests_total Finished chat requests by source.", "# TYPE chatbot_requests_total counter"]
+            for source, count in sorted(self._requests.items()):
+                lines.append(f'chatbot_requests_total{{source="{source}"}} {count}')
+            lines += ["# HELP chatbot_stage_seconds Time spent in each stage of a request.", "# TYPE chatbot_stage_seconds histogram"]
+            for stage, histogram in self._stages.items():
+                lines += _histogram_lines("chatbot_stage_seconds", f'stage="{stage}"', histogram)
+            lines += ["# HELP chatbot_tokens Prompt, reused and generated tokens per request.", "# TYPE chatbot_tokens histogram"]
+            for kind, histogram in self._tokens.items():
+                lines += _histogram_lines("chatbot_tokens", f'kind="{kind}"', histogram)
+            gauges = list(self._gauges.items())
+        for name, (help_text, function) in gauges:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {float(function())}"]
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=9464, host="127.0.0.1"):
+        """
+        Starts a background HTTP server exposing ``/metrics``.
+
+        Calling it again returns the running server, so it is safe to call on every
+        Streamlit rerun.
+
+        Parameters
+        ----------
+        port : int, optional
+            TCP port (default is 9464).
+        host : str, optional
+            Interface to bind (default is "127.0.0.1", local only).
+
+        Returns
+        -------
+        ThreadingHTTPServer
+            The running server.
+        """
+        with self._lock:
+            if self._server is not None:
+                return self._server
+            collector = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split("?")[0] != "/metrics":
+                        self.send_error(404)
+                        return
+                    body = collector.render().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass
+
+            self._server = ThreadingHTTPServer((host, port), Handler)
+            self._server.daemon_threads = True
+            threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True).start()
+            return self._server
+
+
+def _histogram_lines(name, labels, histogram):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.total}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+    return lines
+
+
+collector = MetricsCollector()
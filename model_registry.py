@@ -0,0 +1,329 @@
+import gc
+import os
+import threading
+import time
+import weakref
+
+
+class ModelEntry:
+    """
+    A class to represent one loaded (or loading) model inside the registry.
+
+    Attributes
+    ----------
+    key : tuple
+        ``(model_path, device, torch_dtype, quantize)`` identifying the model.
+    bot : ChatBot or None
+        The shared chatbot, None until the first load finished.
+    refcount : int
+        Number of live handles using the model.
+    load_seconds : float or None
+        Wall-clock time of the last load.
+    loads : int
+        Number of times the model was loaded.
+    last_used : float
+        Time (``time.time()``) of the last acquire or release.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.bot = None
+        self.refcount = 0
+        self.load_seconds = None
+        self.loads = 0
+        self.last_used = time.time()
+        self.lock = threading.Lock()
+        self.idle_timer = None
+
+
+class ModelHandle:
+    """
+    A lightweight, per-session reference to a shared model.
+
+    Attribute access is forwarded to the shared ChatBot, so a handle can be used wherever a
+    ChatBot was used before (``handle.generate_response(...)``). The reference is released by
+    ``release()`` or automatically when the handle is garbage collected, e.g. when Streamlit
+    drops the session state of a closed tab.
+
+    Attributes
+    ----------
+    key : tuple
+        ``(model_path, device, torch_dtype, quantize)`` of the referenced model.
+
+    Methods
+    -------
+    release():
+        Gives the reference back to the registry.
+    """
+
+    def __init__(self, registry, entry):
+        self.key = entry.key
+        self._entry = entry
+        self._finalizer = weakref.finalize(self, registry._release, entry)
+
+    @property
+    def bot(self):
+        """
+        Returns the shared ChatBot.
+
+        Returns
+        -------
+        ChatBot
+            The chatbot owned by the registry.
+        """
+        if not self._finalizer.alive:
+            raise RuntimeError("This model handle has already been released")
+        return self._entry.bot
+
+    def release(self):
+        """
+        Gives the reference back to the registry. Calling it twice is harmless.
+        """
+        self._finalizer()
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.bot, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class ModelRegistry:
+    """
+    A process-wide registry that loads each model once and shares it between sessions.
+
+    Models are keyed by ``(model_path, device, torch_dtype, quantize)``, with default dtypes
+    resolved first, and loaded lazily on the first ``acquire``. A requested device such as
+    "auto" is resolved once per registry and then always maps to the same device, so later
+    acquires find the loaded model even when another device now has more free memory.
+    Concurrent acquires of the same model wait for a single load, while loads of
+    different models do not block each other. A model whose reference count drops to zero is
+    unloaded after ``idle_timeout`` seconds unless it is acquired again in the meantime.
+
+    Attributes
+    ----------
+    idle_timeout : float or None
+        Seconds an unused model stays loaded (None keeps it forever).
+    loader : callable
+        Function ``loader(model_path, device, torch_dtype, quantize)`` returning a ChatBot.
+
+    Methods
+    -------
+    acquire(model_path, device="auto", torch_dtype=None, quantize=None):
+        Returns a handle to the shared model, loading it if needed.
+
+    unload(model_path, device="auto", torch_dtype=None, quantize=None):
+        Unloads a model that has no live handles.
+
+    unload_idle():
+        Unloads every model that has been unused for longer than ``idle_timeout``.
+
+    stats():
+        Returns load times, reference counts and memory usage.
+    """
+
+    def __init__(self, idle_timeout=600.0, loader=None):
+        """
+        Initializes the ModelRegistry.
+
+        Parameters
+        ----------
+        idle_timeout : float or None, optional
+            Seconds an unused model stays loaded (default is 600, None keeps it forever).
+        loader : callable, optional
+            Function ``loader(model_path, device, torch_dtype, quantize)`` returning a ChatBot
+            (default constructs a ChatBot with these arguments and warms it up).
+        """
+        self.idle_timeout = idle_timeout
+        self.loader = loader or _load_chatbot
+        self._entries = {}
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, model_path, device="auto", torch_dtype=None, quantize=None):
+        """
+        Returns a handle to the shared model, loading it on first use.
+
+        Parameters
+        ----------
+        model_path : str
+            Path to the pre-trained language model.
+        device : str, optional
+            The device to run the model on (default is "auto").
+        torch_dtype : torch.dtype, optional
+            The data type for the model's tensors (default depends on the device).
+        quantize : str, optional
+            "int8" for dynamic int8 quantization on the CPU (default is None).
+
+        Returns
+        -------
+        ModelHandle
+            A handle that keeps the model loaded until it is released.
+        """
+        key = self._key(model_path, device, torch_dtype, quantize)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = ModelEntry(key)
+            entry.refcount += 1
+            entry.last_used = time.time()
+            if entry.idle_timer is not None:
+                entry.idle_timer.cancel()
+                entry.idle_timer = None
+
+        try:
+            with entry.lock:
+                if entry.bot is None:
+                    start = time.perf_counter()
+                    entry.bot = self.loader(*key)
+                    entry.load_seconds = time.perf_counter() - start
+                    entry.loads += 1
+        except BaseException:
+            self._release(entry)
+            raise
+        return ModelHandle(self, entry)
+
+    def unload(self, model_path, device="auto", torch_dtype=None, quantize=None):
+        """
+        Unloads a model that has no live handles.
+
+        Parameters
+        ----------
+        model_path : str
+            Path to the pre-trained language model.
+        device : str, optional
+            The device the model runs on (default is "auto").
+        torch_dtype : torch.dtype, optional
+            The data type of the model's tensors (default depends on the device).
+        quantize : str, optional
+            The quantization mode the model was loaded with (default is None).
+
+        Returns
+        -------
+        bool
+            True if the model was unloaded.
+        """
+        key = self._key(model_path, device, torch_dtype, quantize)
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry is not None and self._unload(entry, min_idle=0.0)
+
+    def unload_idle(self):
+        """
+        Unloads every model that has been unused for longer than ``idle_timeout``.
+
+        Returns
+        -------
+        int
+            Number of unloaded models.
+        """
+        if self.idle_timeout is None:
+            return 0
+        with self._lock:
+            entries = list(self._entries.values())
+        return sum(self._unload(entry, min_idle=self.idle_timeout) for entry in entries)
+
+    def stats(self):
+        """
+        Returns load times, reference counts and memory usage of the registry.
+
+        Returns
+        -------
+        dict
+            ``{"rss_bytes": ..., "models": [...]}`` with one dict per registered model.
+        """
+        with self._lock:
+            entries = list(self._entries.values())
+        models = []
+        for entry in entries:
+            bot = entry.bot
+            models.append({
+                "model_path": entry.key[0],
+                "device": entry.key[1],
+                "torch_dtype": str(entry.key[2]),
+                "quantize": entry.key[3],
+                "loaded": bot is not None,
+                "refcount": entry.refcount,
+                "loads": entry.loads,
+                "load_seconds": entry.load_seconds,
+                "idle_seconds": time.time() - entry.last_used if entry.refcount == 0 else 0.0,
+                "parameter_bytes": _parameter_bytes(bot),
+                "startup": bot.startup_report.as_dict() if bot is not None else None,
+            })
+        return {"rss_bytes": resident_set_bytes(), "models": models}
+
+    def _key(self, model_path, device, torch_dtype, quantize):
+        from device_policy import default_dtype, select_device
+
+        resolved = self._devices.get(str(device))
+        if resolved is None:
+            # "auto" picks the emptiest GPU right now; pin the first answer so the key stays stable.
+            resolved = self._devices.setdefault(str(device), select_device(device))
+        device = resolved
+        if torch_dtype is None or quantize is not None:
+            torch_dtype = default_dtype(device)
+        return (model_path, device, torch_dtype, quantize)
+
+    def _release(self, entry):
+        with self._lock:
+            entry.refcount -= 1
+            entry.last_used = time.time()
+            if entry.refcount > 0 or self.idle_timeout is None:
+                return
+            entry.idle_timer = threading.Timer(self.idle_timeout, self._unload, args=(entry, self.idle_timeout))
+            entry.idle_timer.daemon = True
+            entry.idle_timer.start()
+
+    def _unload(self, entry, min_idle):
+        with self._lock:
+            if entry.refcount > 0 or entry.bot is None or time.time() - entry.last_used < min_idle:
+                return False
+            bot, entry.bot = entry.bot, None
+        bot.engine.stop()
+        device = bot.device
+        del bot
+        gc.collect()
+        if str(device).startswith("cuda"):
+            import torch
+
+            torch.cuda.empty_cache()
+        return True
+
+
+def _parameter_bytes(bot):
+    if bot is None:
+        return 0
+    from device_policy import state_dict_nbytes
+
+    return state_dict_nbytes(bot.model)
+
+
+def _load_chatbot(model_path, device, torch_dtype, quantize):
+    # Imported here so that importing the registry imports neither torch nor transformers.
+    from chatbot import ChatBot
+
+    return ChatBot(model_path, device=device, torch_dtype=torch_dtype, quantize=quantize, warmup=True)
+
+
+def resident_set_bytes():
+    """
+    Returns the resident memory of the current process.
+
+    Returns
+    -------
+    int or None
+        Resident set size in bytes, or None when ``/proc`` is not available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+registry = ModelRegistry()
@@ -0,0 +1,263 @@
+import json
+import os
+import random
+import threading
+import time
+import warnings
+from collections import deque
+
+import torch
+
+DEFAULT_TRACE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "traces")
+
+
+class RequestProfiler:
+    """
+    Captures torch profiler traces of individual chat requests.
+
+    A request is profiled when it belongs to a session switched on with ``profile_session`` or,
+    failing that, with probability ``sample_rate``. The capture runs on the engine thread (the
+    torch profiler only sees operators of the thread that started it): it starts in the engine
+    step that admits the request and stops in the step it finishes, recording operator CPU time,
+    input shapes, memory allocations and the Python stack of every operator. The trace is then
+    written from a background thread as a Chrome trace (open it in ``chrome://tracing`` or
+    Perfetto) with the request metadata under ``otherData``, next to a text table of the most
+    expensive operators.
+
+    Other requests decoded in the same batch appear in the trace too; their number is part of the
+    metadata. Only one request is captured at a time, and a selected request that was admitted
+    while another capture ran is skipped. With no session switched on and a zero ``sample_rate``
+    a request costs one comparison and an engine step one method call.
+
+    Attributes
+    ----------
+    directory : str
+        Folder the traces are written to.
+    sample_rate : float
+        Fraction of requests profiled.
+    sessions : set of str
+        Sessions whose every request is profiled.
+    traces : collections.deque
+        Paths of the most recently written traces, newest last.
+
+    Methods
+    -------
+    wants(session_id=None):
+        Returns True if the next request of a session should be profiled.
+
+    profile_session(session_id, enabled=True):
+        Switches profiling of every request of a session on or off.
+
+    expect(request):
+        Registers a submitted request that is to be profiled.
+
+    before_step(engine):
+        Starts a capture for a registered request; called by the engine before every step.
+
+    after_step(engine):
+        Ends the capture once its request has finished; called by the engine after every step.
+
+    stats():
+        Returns the profiling settings and counters.
+    """
+
+    def __init__(self, directory=DEFAULT_TRACE_DIR, sample_rate=0.0, keep_last=20, with_stack=True, row_limit=30):
+        """
+        Initializes the RequestProfiler.
+
+        Parameters
+        ----------
+        directory : str, optional
+            Folder the traces are written to (default is cache/traces next to this module).
+        sample_rate : float, optional
+            Fraction of requests profiled (default is 0.0, only switched-on sessions).
+        keep_last : int, optional
+            Number of trace paths remembered by ``traces`` (default is 20).
+        with_stack : bool, optional
+            Record the Python stack of every operator (default is True).
+        row_limit : int, optional
+            Operators listed in the text summary (default is 30).
+        """
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.sessions = set()
+        self.traces = deque(maxlen=keep_last)
+        self.with_stack = with_stack
+        self.row_limit = row_limit
+        self.captured = 0
+        self.skipped = 0
+        self.failed = 0
+        self._pending = deque()
+        self._capture = None
+        self._lock = threading.Lock()
+
+    def wants(self, session_id=None):
+        """
+        Returns True if the next request of a session should be profiled.
+
+        Parameters
+        ----------
+        session_id : str, optional
+            Identifier of the chat session.
+
+        Returns
+        -------
+        bool
+            Whether to pass profiling metadata with the request.
+        """
+        if not self.sessions and not self.sample_rate:
+            return False
+        return session_id in self.sessions or random.random() < self.sample_rate
+
+    def profile_session(self, session_id, enabled=True):
+        """
+        Switches profiling of every request of a session on or off.
+
+        Parameters
+        ----------
+        session_id : str
+            Identifier of the chat session.
+        enabled : bool, optional
+            Whether to profile the session (default is True).
+        """
+        with self._lock:
+            if enabled:
+                self.sessions.add(session_id)
+            else:
+                self.sessions.discard(session_id)
+
+    def expect(self, request):
+        """
+        Registers a submitted request that is to be profiled.
+
+        Parameters
+        ----------
+        request : GenerationRequest
+            The request; its ``profile`` attribute holds the metadata written with the trace.
+        """
+        with self._lock:
+            self._pending.append(request)
+
+    def before_step(self, engine):
+        """
+        Starts a capture for a registered request that has not been admitted yet.
+
+        Parameters
+        ----------
+        engine : InferenceEngine
+            The engine about to run a step, on its own thread.
+        """
+        if not self._pending or self._capture is not None:
+            return
+        with self._lock:
+            request = None
+            while self._pending and request is None:
+                request = self._pending.popleft()
+                if request.admitted_time is not None or request.done():
+                    self.skipped += 1
+                    request = None
+        if request is None:
+            return
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if str(engine.device).startswith("cuda"):
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        profiler = torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True, with_stack=self.with_stack)
+        try:
+            profiler.__enter__()
+        except Exception as error:
+            self.failed += 1
+            warnings.warn(f"Could not start the profiler for request {request.request_id}: {error}")
+            return
+        self._capture = (request, profiler, time.time(), len(engine.running), [0, 0])
+
+    def after_step(self, engine):
+        """
+        Ends the capture once its request has finished and hands the trace to a writer thread.
+
+        Parameters
+        ----------
+        engine : InferenceEngine
+            The engine that just ran a step, on its own thread.
+        """
+        if self._capture is None:
+            return
+        request, profiler, started, batch_at_start, steps = self._capture
+        steps[0] += 1
+        steps[1] = max(steps[1], len(engine.running))
+        if not request.done():
+            return
+        self._capture = None
+        with self._lock:
+            # Selected requests admitted during the capture cannot be traced from their start.
+            kept = deque(pending for pending in self._pending if pending.admitted_time is None and not pending.done())
+            self.skipped += len(self._pending) - len(kept)
+            self._pending = kept
+        try:
+            profiler.__exit__(None, None, None)
+        except Exception as error:
+            self.failed += 1
+            warnings.warn(f"Could not stop the profiler for request {request.request_id}: {error}")
+            return
+        metadata = {
+            "request_id": request.request_id,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started)),
+            "engine": type(engine).__name__,
+            "device": str(engine.device),
+            "prompt_tokens": len(request.prompt_ids),
+            "cached_tokens": request.prefix_length,
+            "output_tokens": len(request.output_ids),
+            "finish_reason": request.finish_reason,
+            "queue_wait": (request.admitted_time or request.finish_time) - request.arrival_time,
+            "prefill": request.prefill_seconds,
+            "decode": request.finish_time - request.first_token_time if request.first_token_time is not None else 0.0,
+            "engine_steps": steps[0],
+            "running_at_start": batch_at_start,
+            "max_running": steps[1],
+        }
+        metadata.update(request.profile)
+        threading.Thread(target=self._write, args=(profiler, metadata), name="profile-writer", daemon=True).start()
+
+    def stats(self):
+        """
+        Returns the profiling settings and counters.
+
+        Returns
+        -------
+        dict
+            Sample rate, profiled sessions, capture counts and the latest trace paths.
+        """
+        with self._lock:
+            return {
+                "sample_rate": self.sample_rate,
+                "sessions": sorted(self.sessions),
+                "active": self._capture is not None,
+                "pending": len(self._pending),
+                "captured": self.captured,
+                "skipped": self.skipped,
+                "failed": self.failed,
+                "traces": list(self.traces),
+            }
+
+    def _write(self, profiler, metadata):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            name = time.strftime("%Y%m%d-%H%M%S") + f"-request{metadata['request_id']}"
+            path = os.path.join(self.directory, name + ".json")
+            profiler.export_chrome_trace(path + ".tmp")
+            with open(path + ".tmp", encoding="utf-8") as f:
+                trace = json.load(f)
+            trace["otherData"] = {**trace.get("otherData", {}), **metadata}
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(trace, f, ensure_ascii=False)
+            os.replace(path + ".tmp", path)
+            table = profiler.key_averages().table(sort_by="self_cpu_time_total", row_limit=self.row_limit)
+            with open(os.path.join(self.directory, name + ".txt"), "w", encoding="utf-8") as f:
+                f.write(json.dumps(metadata, ensure_ascii=False, indent=2) + "\n\n" + table + "\n")
+        except Exception as error:
+            with self._lock:
+                self.failed += 1
+            warnings.warn(f"Could not write the profile of request {metadata['request_id']}: {error}")
+            return
+        with self._lock:
+            self.captured += 1
+            self.traces.append(path)
@@ -0,0 +1,243 @@
+import threading
+
+
+class GenerationCancelled(RuntimeError):
+    """Raised to the subscriber of a generation that was cancelled before it finished."""
+
+
+class _Flight:
+    """
+    One running generation, replayed to every subscriber.
+    """
+
+    def __init__(self, key, source, shared):
+        self.key = key
+        self.source = source
+        self.shared = shared
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self.pulling = False
+        self.subscribers = 0
+        self.condition = threading.Condition()
+
+
+class _Subscription:
+    __slots__ = ("flight", "session_id", "cancelled")
+
+    def __init__(self, flight, session_id):
+        self.flight = flight
+        self.session_id = session_id
+        self.cancelled = False
+
+    def cancel(self):
+        with self.flight.condition:
+            self.cancelled = True
+            self.flight.condition.notify_all()
+
+
+class RequestLifecycle:
+    """
+    A class to deduplicate, share and cancel chat generations.
+
+    Every generation is a "flight": a chunk iterator that is read once and replayed to all of its
+    subscribers, whichever of them is ahead pulls the next chunk. On top of that:
+
+    - a session asking the same question again while the answer is still being generated (a
+      double submit) subscribes to the running flight instead of starting a second one;
+    - a session asking a different question cancels its previous, unfinished subscription;
+    - identical shareable requests (first-turn questions with deterministic settings) from
+      different sessions share one flight (single-flight).
+
+    A cancelled subscription raises GenerationCancelled instead of ending like a complete answer,
+    so its partial text is never taken for the answer. When the last subscriber of a flight
+    leaves before it finished, because it was cancelled or because the consumer stopped
+    iterating, the chunk iterator is closed. ChatBot's iterators
+    cancel their engine request when closed, so the model stops decoding the abandoned answer.
+
+    Attributes
+    ----------
+    started : int
+        Flights started.
+    deduplicated : int
+        Repeated submissions of a session that joined its running flight.
+    shared : int
+        Requests that joined a flight started by another session.
+    cancelled : int
+        Subscriptions cancelled by a newer request of the same session or by ``cancel``.
+
+    Methods
+    -------
+    stream(key, source, session_id=None, shared=False):
+        Returns an iterator over the chunks of the flight serving a request.
+
+    cancel(session_id):
+        Cancels the unfinished request of a session.
+
+    stats():
+        Returns the counters and the number of running flights.
+    """
+
+    def __init__(self):
+        self.started = 0
+        self.deduplicated = 0
+        self.shared = 0
+        self.cancelled = 0
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._sessions = {}
+
+    def stream(self, key, source, session_id=None, shared=False):
+        """
+        Returns an iterator over the chunks of the flight serving a request.
+
+        Parameters
+        ----------
+        key : hashable
+            Identity of the request; requests with equal keys produce the same answer.
+        source : callable
+            Called without arguments to start a new flight; returns the chunk iterator. It is
+            only called when no running flight can be joined.
+        session_id : str, optional
+            Identifier of the chat session issuing the request.
+        shared : bool, optional
+            Whether other sessions may join the flight (default is False).
+
+        Returns
+        -------
+        iterator of str
+            The chunks of the answer, from the first one. It raises GenerationCancelled when the
+            subscription is cancelled before the answer is complete.
+        """
+        cancelled = None
+        with self._lock:
+            flight = None
+            current = self._sessions.get(session_id) if session_id is not None else None
+            if current is not None:
+                if current.flight.key == key and not current.flight.finished:
+                    flight = current.flight
+                    self.deduplicated += 1
+                else:
+                    cancelled = current
+                    self.cancelled += 1
+            if flight is None and shared:
+                flight = self._flights.get(key)
+                if flight is not None:
+                    self.shared += 1
+            if flight is None:
+                flight = _Flight(key, source(), shared)
+                self.started += 1
+                if shared:
+                    self._flights[key] = flight
+            flight.subscribers += 1
+            subscription = _Subscription(flight, session_id)
+            if session_id is not None:
+                self._sessions[session_id] = subscription
+        if cancelled is not None:
+            cancelled.cancel()
+        return self._subscribe(subscription)
+
+    def cancel(self, session_id):
+        """
+        Cancels the unfinished request of a session, e.g. when the user left.
+
+        Parameters
+        ----------
+        session_id : str
+            Identifier of the chat session.
+
+        Returns
+        -------
+        bool
+            True if a request was cancelled.
+        """
+        with self._lock:
+            subscription = self._sessions.pop(session_id, None)
+            if subscription is None or subscription.flight.finished:
+                return False
+            self.cancelled += 1
+        subscription.cancel()
+        return True
+
+    def stats(self):
+        """
+        Returns the counters and the number of running flights.
+
+        Returns
+        -------
+        dict
+            Started, deduplicated, shared and cancelled requests, and the active sessions.
+        """
+        with self._lock:
+            return {
+                "started": self.started,
+                "deduplicated": self.deduplicated,
+                "shared": self.shared,
+                "cancelled": self.cancelled,
+                "active_sessions": len(self._sessions),
+            }
+
+    def _subscribe(self, subscription):
+        flight = subscription.flight
+        position = 0
+        try:
+            while True:
+                with flight.condition:
+                    while True:
+                        if subscription.cancelled:
+                            raise GenerationCancelled("the generation was cancelled before it finished")
+                        if position < len(flight.chunks):
+                            chunk = flight.chunks[position]
+                            position += 1
+                            break
+                        if flight.finished:
+                            if flight.error is not None:
+                                raise flight.error
+                            return
+                        if not flight.pulling:
+                            flight.pulling = True
+                            chunk = None
+                            break
+                        flight.condition.wait()
+                if chunk is None:
+                    self._pull(flight)
+                    continue
+                yield chunk
+        finally:
+            self._leave(subscription)
+
+    def _pull(self, flight):
+        finished, error = False, None
+        try:
+            chunk = next(flight.source)
+        except StopIteration:
+            finished = True
+        except Exception as caught:
+            finished, error = True, caught
+        with flight.condition:
+            if finished:
+                flight.finished, flight.error = True, error
+            else:
+                flight.chunks.append(chunk)
+            flight.pulling = False
+            flight.condition.notify_all()
+        if finished and flight.shared:
+            with self._lock:
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+
+    def _leave(self, subscription):
+        flight = subscription.flight
+        with self._lock:
+            flight.subscribers -= 1
+            if subscription.session_id is not None and self._sessions.get(subscription.session_id) is subscription:
+                del self._sessions[subscription.session_id]
+            abandoned = flight.subscribers == 0 and not flight.finished
+            if abandoned and self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        if abandoned:
+            with flight.condition:
+                flight.finished = True
+            close = getattr(flight.source, "close", None)
+            if close is not None:
+                close()
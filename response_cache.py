@@ -0,0 +1,309 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import asdict
+
+
+def normalize_instruction(instruction):
+    """
+    Normalizes a question so trivially different spellings share a cache entry.
+
+    Vietnamese text can arrive in composed or decomposed Unicode form depending on the input
+    method, so the text is NFC-normalized before case folding and whitespace collapsing.
+
+    Parameters
+    ----------
+    instruction : str
+        The question from the user.
+
+    Returns
+    -------
+    str
+        The normalized question.
+    """
+    text = unicodedata.normalize("NFC", instruction).casefold()
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def settings_key(params):
+    """
+    Returns a stable string describing the generation settings that affect an answer.
+
+    Parameters
+    ----------
+    params : SamplingParams
+        The generation settings of a request.
+
+    Returns
+    -------
+    str
+        JSON encoding of the settings, without the ``cacheable`` flag.
+    """
+    settings = asdict(params)
+    settings.pop("cacheable", None)
+    return json.dumps(settings, sort_keys=True)
+
+
+class ResponseCache:
+    """
+    A two-tier cache of complete answers keyed on the model, the question and the generation settings.
+
+    The first tier is an in-memory LRU dictionary, the second an SQLite table that survives
+    restarts. Entries expire after ``ttl`` seconds and both tiers are trimmed to their size
+    limits in least-recently-used order. Only deterministic requests (greedy decoding) or
+    requests explicitly marked ``cacheable`` are served from the cache, since caching a sampled
+    answer would silently turn sampling into replay.
+
+    Attributes
+    ----------
+    path : str or None
+        Location of the SQLite file, None for a memory-only cache.
+    ttl : float or None
+        Seconds an entry stays valid (None never expires).
+    max_memory_entries : int
+        Size of the in-memory tier.
+    max_disk_entries : int
+        Size of the on-disk tier.
+    enabled : bool
+        Global bypass switch; a disabled cache neither returns nor stores answers.
+    namespace : str
+        Identifies the model whose answers are cached; answers of other models sharing the
+        SQLite file are never returned.
+
+    Methods
+    -------
+    cacheable(params):
+        Returns True if answers generated with these settings may be cached.
+
+    key(instruction, params, context=""):
+        Returns the cache key of a question and its generation settings.
+
+    get(instruction, params, context=""):
+        Returns the cached answer, or None.
+
+    put(instruction, params, response, generation_seconds, context=""):
+        Stores an answer in both tiers.
+
+    clear():
+        Removes every entry.
+
+    stats():
+        Returns hit counts, hit rate and the generation time saved.
+    """
+
+    def __init__(self, path=None, ttl=7 * 24 * 3600, max_memory_entries=1024, max_disk_entries=100000, enabled=True, namespace=""):
+        """
+        Initializes the ResponseCache.
+
+        Parameters
+        ----------
+        path : str, optional
+            Location of the SQLite file (default is None, memory only).
+        ttl : float or None, optional
+            Seconds an entry stays valid (default is one week).
+        max_memory_entries : int, optional
+            Size of the in-memory tier (default is 1024).
+        max_disk_entries : int, optional
+            Size of the on-disk tier (default is 100000).
+        enabled : bool, optional
+            Whether the cache is used at all (default is True).
+        namespace : str, optional
+            Identifies the model whose answers are cached, e.g. its path, data type and
+            quantization (default is "").
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.enabled = enabled
+        self.namespace = namespace
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, "
+                "last_access REAL NOT NULL, generation_seconds REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+            self._db.commit()
+
+    def cacheable(self, params):
+        """
+        Returns True if answers generated with these settings may be cached.
+
+        Parameters
+        ----------
+        params : SamplingParams
+            The generation settings of a request.
+
+        Returns
+        -------
+        bool
+            Whether the cache applies to the request.
+        """
+        return self.enabled and (not params.do_sample or params.cacheable)
+
+    def key(self, instruction, params, context=""):
+        """
+        Returns the cache key of a question and its generation settings.
+
+        The key includes ``namespace``, so the answers of every model live side by side in one file.
+
+        Parameters
+        ----------
+        instruction : str
+            The question from the user.
+        params : SamplingParams
+            The generation settings of the request.
+        context : str, optional
+            Anything else the answer depends on, such as the version of the documents it was
+            grounded in (default is "").
+
+        Returns
+        -------
+        str
+            Hex digest identifying the entry.
+        """
+        payload = json.dumps([self.namespace, normalize_instruction(instruction), settings_key(params), context], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, instruction, params, context=""):
+        """
+        Returns the cached answer for a question, or None.
+
+        Parameters
+        ----------
+        instruction : str
+            The question from the user.
+        params : SamplingParams
+            The generation settings of the request.
+        context : str, optional
+            Anything else the answer depends on (default is "").
+
+        Returns
+        -------
+        str or None
+            The cached answer.
+        """
+        if not self.cacheable(params):
+            return None
+        key = self.key(instruction, params, context)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry[1], now):
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                self.seconds_saved += entry[2]
+                return entry[0]
+            self._memory.pop(key, None)
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT response, created, generation_seconds FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and not self._expired(row[1], now):
+                    self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    self._remember(key, row)
+                    self.disk_hits += 1
+                    self.seconds_saved += row[2]
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, instruction, params, response, generation_seconds, context=""):
+        """
+        Stores an answer in both tiers.
+
+        Parameters
+        ----------
+        instruction : str
+            The question from the user.
+        params : SamplingParams
+            The generation settings of the request.
+        response : str
+            The generated answer.
+        generation_seconds : float
+            How long the answer took to generate; counted as saved time on later hits.
+        context : str, optional
+            Anything else the answer depends on (default is "").
+        """
+        if not self.cacheable(params):
+            return
+        key = self.key(instruction, params, context)
+        now = time.time()
+        with self._lock:
+            self._remember(key, (response, now, generation_seconds))
+            if self._db is None:
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, response, now, now, generation_seconds),
+            )
+            if self.ttl is not None:
+                self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_disk_entries,),
+            )
+            self._db.commit()
+
+    def clear(self):
+        """
+        Removes every entry from both tiers.
+        """
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self):
+        """
+        Returns hit counts, hit rate and the generation time saved by the cache.
+
+        Returns
+        -------
+        dict
+            Counters of both tiers.
+        """
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            disk_entries = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] if self._db is not None else 0
+            return {
+                "enabled": self.enabled,
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "seconds_saved": self.seconds_saved,
+            }
+
+    def _remember(self, key, entry):
+        self._memory[key] = tuple(entry)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
@@ -0,0 +1,195 @@
+import threading
+
+import numpy as np
+
+from response_cache import normalize_instruction, settings_key
+from vector_index import VectorIndex
+
+
+class SemanticCache:
+    """
+    A near-duplicate answer cache that matches paraphrased questions.
+
+    Each answered question is embedded and stored in a VectorIndex together with its answer.
+    A new question is answered from the cache when its embedding has a cosine similarity of at
+    least ``threshold`` with a stored question that was asked with the same generation
+    settings. Like the exact ResponseCache it only serves deterministic or explicitly
+    cacheable requests.
+
+    The threshold depends on the embedding. Mean-pooled hidden states of a causal language model
+    are strongly anisotropic: even unrelated short questions often have a cosine similarity above
+    0.95. Measure it with ``calibrate_threshold`` on paraphrase and non-paraphrase pairs of the
+    model before enabling the cache; ChatBot leaves it off by default.
+
+    Attributes
+    ----------
+    embed : callable
+        Function mapping a question to a 1-D NumPy embedding.
+    index : VectorIndex
+        The memory-mapped index of past questions.
+    threshold : float
+        Minimum cosine similarity for a match.
+    enabled : bool
+        Global bypass switch.
+
+    Methods
+    -------
+    get(instruction, params, context=""):
+        Returns the answer of the closest stored question, or None.
+
+    put(instruction, params, response, context=""):
+        Embeds a question and stores its answer.
+
+    stats():
+        Returns hit counts and the similarity of the last hit.
+    """
+
+    def __init__(self, embed, directory, threshold=0.95, capacity=10000, enabled=True, namespace=""):
+        """
+        Initializes the SemanticCache.
+
+        Parameters
+        ----------
+        embed : callable
+            Function mapping a question to a 1-D NumPy embedding.
+        directory : str
+            Folder of the memory-mapped index.
+        threshold : float, optional
+            Minimum cosine similarity for a match (default is 0.95).
+        capacity : int, optional
+            Maximum number of stored questions (default is 10000).
+        enabled : bool, optional
+            Whether the cache is used at all (default is True).
+        namespace : str, optional
+            Identifies the model producing the embeddings and answers; an index written by another
+            model is cleared (default is "").
+        """
+        self.embed = embed
+        self.index = VectorIndex(directory, capacity, namespace)
+        self.threshold = threshold
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.last_similarity = None
+        self._lock = threading.Lock()
+
+    def get(self, instruction, params, context=""):
+        """
+        Returns the answer of the closest stored question, or None.
+
+        Parameters
+        ----------
+        instruction : str
+            The question from the user.
+        params : SamplingParams
+            The generation settings of the request.
+        context : str, optional
+            Anything else the answer depends on; only answers stored with the same context match
+            (default is "").
+
+        Returns
+        -------
+        str or None
+            The stored answer of a sufficiently similar question.
+        """
+        if not self._cacheable(params):
+            return None
+        settings = settings_key(params)
+        for similarity, slot, payload in self.index.search(self.embed(normalize_instruction(instruction)), k=8):
+            if similarity < self.threshold:
+                break
+            if payload["settings"] == settings and payload.get("context", "") == context:
+                self.index.touch(slot)
+                with self._lock:
+                    self.hits += 1
+                    self.last_similarity = similarity
+                return payload["response"]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, instruction, params, response, context=""):
+        """
+        Embeds a question and stores its answer.
+
+        Parameters
+        ----------
+        instruction : str
+            The question from the user.
+        params : SamplingParams
+            The generation settings of the request.
+        response : str
+            The generated answer.
+        context : str, optional
+            Anything else the answer depends on (default is "").
+        """
+        if not self._cacheable(params):
+            return
+        payload = {"instruction": instruction, "settings": settings_key(params), "context": context, "response": response}
+        self.index.add(self.embed(normalize_instruction(instruction)), payload)
+
+    def stats(self):
+        """
+        Returns hit counts and the similarity of the last hit.
+
+        Returns
+        -------
+        dict
+            Entries, hits, misses, hit rate and last hit similarity.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": self.index.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "last_similarity": self.last_similarity,
+            }
+
+    def _cacheable(self, params):
+        return self.enabled and (not params.do_sample or params.cacheable)
+
+
+def calibrate_threshold(embed, paraphrases, unrelated, precision=1.0):
+    """
+    Picks the similarity threshold of a SemanticCache from labelled question pairs.
+
+    Parameters
+    ----------
+    embed : callable
+        Function mapping a question to a 1-D NumPy embedding, such as ``ChatBot.embed_instruction``.
+    paraphrases : list of tuple
+        ``(question, question)`` pairs that must share an answer.
+    unrelated : list of tuple
+        ``(question, question)`` pairs that must not.
+    precision : float, optional
+        Fraction of the matches at the threshold that must be paraphrases (default is 1.0, no
+        unrelated pair matches).
+
+    Returns
+    -------
+    dict
+        The threshold, the fraction of paraphrase pairs it matches, and the similarities of both
+        kinds of pairs.
+    """
+    def similarities(pairs):
+        values = []
+        for first, second in pairs:
+            a = np.asarray(embed(normalize_instruction(first)), dtype=np.float32)
+            b = np.asarray(embed(normalize_instruction(second)), dtype=np.float32)
+            values.append(float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b) or 1.0)))
+        return values
+
+    positive, negative = similarities(paraphrases), similarities(unrelated)
+    threshold = 1.0
+    # Lower the threshold while the matches above it stay precise enough.
+    for candidate in sorted(set(positive + negative), reverse=True):
+        matched = sum(value >= candidate for value in positive)
+        wrong = sum(value >= candidate for value in negative)
+        if matched < precision * (matched + wrong):
+            break
+        threshold = candidate
+    recall = sum(value >= threshold for value in positive) / len(positive) if positive else 0.0
+    return {"threshold": threshold, "recall": recall, "paraphrases": positive, "unrelated": negative}
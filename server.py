@@ -0,0 +1,546 @@
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import threading
+import uuid
+from dataclasses import dataclass, fields
+from typing import Literal
+from urllib.parse import urlsplit
+
+from admission import AdmissionError
+from chatbot import ChatBot
+from engine import SamplingParams
+from metrics import collector
+from model_registry import resident_set_bytes
+from request_lifecycle import GenerationCancelled
+
+STATUS_TEXT = {
+    200: "OK",
+    204: "No Content",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+    501: "Not Implemented",
+    503: "Service Unavailable",
+    504: "Gateway Timeout",
+}
+SAMPLING_FIELDS = {field.name for field in fields(SamplingParams)} - {"cacheable", "ignore_eos"}
+
+
+@dataclass
+class Message:
+    """Class for keeping track of a chat message sent by a client."""
+    origin: Literal["human", "ai"]
+    message: str
+
+
+class HTTPError(Exception):
+    """Raised by request handlers to answer with an error status."""
+
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class ChatServer:
+    """
+    An asyncio HTTP server exposing a ChatBot as a JSON and a Server-Sent-Events API.
+
+    The event loop only parses requests and writes responses; every generation runs on one of
+    ``max_concurrency`` worker threads, so idle and slow connections cost a coroutine each and
+    never block the model. Requests beyond the free workers wait in a queue of at most
+    ``max_queue`` entries and are rejected with 429 once it is full. Every request has a deadline
+    of ``request_timeout`` seconds, including the time spent queued. When the client disconnects
+    or the deadline passes, the generation is cancelled and leaves the engine's batch. A request
+    replaced by a newer one of the same session is answered with 409.
+
+    Endpoints
+    ---------
+    POST /chat
+        JSON body ``{"message", "history", "session_id", <SamplingParams fields>}``; answers
+        ``{"response", "session_id"}``.
+    POST /chat/stream
+        Same body; answers with an event stream of ``{"text": chunk}`` messages followed by a
+        ``done`` event.
+    GET /health
+        Queue and worker occupancy.
+    GET /metrics
+        The Prometheus metrics of the process.
+    GET /profile, POST /profile
+        Profiling state; a POST body ``{"session_id", "enabled"}`` switches profiling of a session
+        on or off and ``{"sample_rate"}`` sets the profiled fraction of requests.
+
+    Attributes
+    ----------
+    bot : ChatBot or WorkerPool
+        The chatbot answering the requests.
+    active : int
+        Requests currently held by a worker thread.
+    queued : int
+        Requests waiting for a worker thread.
+    rejected : int
+        Requests answered with 429.
+    timeouts : int
+        Requests that exceeded their deadline.
+
+    Methods
+    -------
+    start():
+        Binds the listening socket.
+
+    serve_forever():
+        Starts the server and handles connections until cancelled.
+    """
+
+    def __init__(self, bot, host="127.0.0.1", port=8000, max_concurrency=None, max_queue=64, request_timeout=120.0,
+                 keep_alive_timeout=75.0, max_body_bytes=1024 ** 2, stream_buffer=64, allow_origin="*"):
+        """
+        Initializes the ChatServer.
+
+        Parameters
+        ----------
+        bot : ChatBot or WorkerPool
+            The chatbot answering the requests.
+        host : str, optional
+            Interface to bind (default is "127.0.0.1").
+        port : int, optional
+            TCP port (default is 8000).
+        max_concurrency : int, optional
+            Number of worker threads, i.e. requests handed to the engine at once
+            (default is the engine's maximum batch size, or the capacity of a worker pool).
+        max_queue : int, optional
+            Requests allowed to wait for a worker before 429 is returned (default is 64).
+        request_timeout : float, optional
+            Deadline of a request in seconds, queueing included (default is 120).
+        keep_alive_timeout : float, optional
+            Seconds an idle keep-alive connection stays open (default is 75).
+        max_body_bytes : int, optional
+            Largest accepted request body (default is 1 MiB).
+        stream_buffer : int, optional
+            Text chunks buffered per stream before the worker waits for a slow client (default is 64).
+        allow_origin : str, optional
+            Value of the CORS ``Access-Control-Allow-Origin`` header (default is "*").
+        """
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self.max_concurrency = max_concurrency or getattr(bot, "capacity", None) or bot.engine.max_batch_size
+        self.max_queue = max_queue
+        self.request_timeout = request_timeout
+        self.keep_alive_timeout = keep_alive_timeout
+        self.max_body_bytes = max_body_bytes
+        self.stream_buffer = stream_buffer
+        self.allow_origin = allow_origin
+        self.active = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self._executor = concurrent.futures.ThreadPoolExecutor(self.max_concurrency, thread_name_prefix="chat-worker")
+        self._workers = None
+        self._server = None
+        self._routes = {
+            ("POST", "/chat"): self._chat,
+            ("POST", "/chat/stream"): self._chat_stream,
+            ("GET", "/health"): self._health,
+            ("GET", "/metrics"): self._metrics,
+            ("GET", "/profile"): self._profile,
+            ("POST", "/profile"): self._profile,
+        }
+
+    async def start(self):
+        """
+        Binds the listening socket.
+
+        Returns
+        -------
+        asyncio.Server
+            The running server.
+        """
+        self._workers = asyncio.Semaphore(self.max_concurrency)
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self._server
+
+    async def serve_forever(self):
+        """
+        Starts the server and handles connections until cancelled.
+        """
+        server = await self.start()
+        async with server:
+            await server.serve_forever()
+
+    def stats(self):
+        """
+        Returns the occupancy of the server.
+
+        Returns
+        -------
+        dict
+            Active, queued, rejected and timed out request counts, the resident memory of the server
+            process, the memory budget and reservations of the engine, and the model workers when
+            a worker pool serves the requests.
+        """
+        stats = {
+            "status": "ok",
+            "active": self.active,
+            "queued": self.queued,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "rss_bytes": resident_set_bytes(),
+        }
+        if hasattr(self.bot, "admission"):
+            stats["memory"] = self.bot.admission.stats()
+        elif hasattr(self.bot, "memory_stats"):
+            stats["memory"] = self.bot.memory_stats()
+        if hasattr(self.bot, "stats"):
+            stats["workers"] = self.bot.stats()
+        return stats
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.keep_alive_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    return
+                try:
+                    method, path, headers = _parse_head(head)
+                    body = await self._read_body(reader, headers)
+                except HTTPError as error:
+                    await self._send_json(writer, error.status, {"error": str(error)}, close=True)
+                    return
+                keep_alive = headers.get("connection", "").lower() != "close"
+                if not await self._dispatch(method, path, body, writer, keep_alive):
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_body(self, reader, headers):
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise HTTPError(400, "invalid Content-Length")
+        if length > self.max_body_bytes:
+            raise HTTPError(413, "request body too large")
+        return await reader.readexactly(length) if length else b""
+
+    async def _dispatch(self, method, path, body, writer, keep_alive):
+        if method == "OPTIONS":
+            await self._send(writer, 204, b"", {
+                "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+                "Access-Control-Allow-Headers": "Content-Type",
+            })
+            return keep_alive
+        handler = self._routes.get((method, path))
+        try:
+            if handler is None:
+                known = any(route_path == path for _, route_path in self._routes)
+                raise HTTPError(405 if known else 404, f"{method} {path} is not supported")
+            return await handler(body, writer, keep_alive)
+        except HTTPError as error:
+            await self._send_json(writer, error.status, {"error": str(error)}, error.headers, close=not keep_alive)
+            return keep_alive
+
+    async def _chat(self, body, writer, keep_alive):
+        chat = _parse_chat(body)
+        chunks = []
+        async for chunk in self._generate(chat):
+            if chunk is not None:
+                chunks.append(chunk)
+        payload = {"response": "".join(chunks).strip(), "session_id": chat["session_id"]}
+        await self._send_json(writer, 200, payload, close=not keep_alive)
+        return keep_alive
+
+    async def _chat_stream(self, body, writer, keep_alive):
+        chat = _parse_chat(body)
+        stream = self._generate(chat)
+        # Wait for a worker first, so admission errors (429, queue timeout) are plain JSON responses.
+        await stream.__anext__()
+        await self._send_head(writer, 200, {
+            "Content-Type": "text/event-stream; charset=utf-8",
+            "Cache-Control": "no-cache",
+            "X-Session-Id": chat["session_id"],
+            "Connection": "close",
+        })
+        try:
+            async for chunk in stream:
+                await _send_event(writer, {"text": chunk})
+            await _send_event(writer, {"session_id": chat["session_id"]}, "done")
+        except HTTPError as error:
+            await _send_event(writer, {"error": str(error), "status": error.status}, "error")
+        finally:
+            await stream.aclose()
+        return False
+
+    async def _health(self, body, writer, keep_alive):
+        await self._send_json(writer, 200, self.stats(), close=not keep_alive)
+        return keep_alive
+
+    async def _metrics(self, body, writer, keep_alive):
+        await self._send(writer, 200, collector.render().encode("utf-8"),
+                         {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}, close=not keep_alive)
+        return keep_alive
+
+    async def _profile(self, body, writer, keep_alive):
+        profiler = getattr(self.bot, "profiler", None)
+        if profiler is None:
+            raise HTTPError(501, "profiling is not available with model workers")
+        if body:
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                raise HTTPError(400, "body must be JSON")
+            if not isinstance(payload, dict) or not set(payload) <= {"session_id", "enabled", "sample_rate"}:
+                raise HTTPError(400, 'body must be {"session_id", "enabled"} or {"sample_rate"}')
+            if "sample_rate" in payload:
+                rate = payload["sample_rate"]
+                if not isinstance(rate, (int, float)) or not 0 <= rate <= 1:
+                    raise HTTPError(400, '"sample_rate" must be a number between 0 and 1')
+                profiler.sample_rate = float(rate)
+            if "session_id" in payload:
+                profiler.profile_session(str(payload["session_id"]), bool(payload.get("enabled", True)))
+        await self._send_json(writer, 200, profiler.stats(), close=not keep_alive)
+        return keep_alive
+
+    async def _generate(self, chat):
+        """
+        Yields the answer chunks of one request; the first item is None once a worker is assigned.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.request_timeout
+        if self.active + self.queued >= self.max_concurrency + self.max_queue:
+            self.rejected += 1
+            raise HTTPError(429, "server is overloaded, retry later", {"Retry-After": "1"})
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._workers.acquire(), self.request_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise HTTPError(504, "timed out waiting for a free worker")
+        finally:
+            self.queued -= 1
+        self.active += 1
+
+        chunks = asyncio.Queue(self.stream_buffer)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            if stop.is_set():
+                raise _Cancelled()
+            future = asyncio.run_coroutine_threadsafe(chunks.put(item), loop)
+            while True:
+                try:
+                    return future.result(timeout=0.5)
+                except concurrent.futures.TimeoutError:
+                    if stop.is_set():
+                        future.cancel()
+                        raise _Cancelled()
+
+        def produce():
+            stream = self.bot.stream_response(
+                chat["message"], chat["params"], history=chat["history"], session_id=chat["session_id"]
+            )
+            try:
+                try:
+                    for chunk in stream:
+                        put(chunk)
+                except _Cancelled:
+                    raise
+                except Exception as error:
+                    put(error)
+                    return
+                put(done)
+            except _Cancelled:
+                pass
+            finally:
+                # A client that disconnected or timed out cancels the generation in the engine.
+                stream.close()
+
+        def release(future):
+            self.active -= 1
+            self._workers.release()
+
+        loop.run_in_executor(self._executor, produce).add_done_callback(release)
+        try:
+            yield None
+            while True:
+                try:
+                    item = await asyncio.wait_for(chunks.get(), max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    raise HTTPError(504, f"generation exceeded {self.request_timeout:g} seconds")
+                if item is done:
+                    return
+                if isinstance(item, AdmissionError) or getattr(item, "kind", None) == "AdmissionError":
+                    # Model workers report the class of the exception raised in the worker.
+                    raise HTTPError(503, f"not enough memory: {item}", {"Retry-After": "1"})
+                if isinstance(item, GenerationCancelled) or getattr(item, "kind", None) == "GenerationCancelled":
+                    # A newer request of the same session replaced this one.
+                    raise HTTPError(409, f"generation cancelled: {item}")
+                if isinstance(item, Exception):
+                    raise HTTPError(500, f"generation failed: {item}")
+                yield item
+        finally:
+            stop.set()
+
+    async def _send_head(self, writer, status, headers):
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT[status]}"]
+        headers = {"Access-Control-Allow-Origin": self.allow_origin, **headers}
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+    async def _send(self, writer, status, body, headers=None, close=False):
+        headers = {**(headers or {}), "Content-Length": str(len(body))}
+        if close:
+            headers["Connection"] = "close"
+        await self._send_head(writer, status, headers)
+        writer.write(body)
+        await writer.drain()
+
+    async def _send_json(self, writer, status, payload, headers=None, close=False):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        await self._send(writer, status, body, {"Content-Type": "application/json; charset=utf-8", **(headers or {})}, close)
+
+
+def _parse_head(head):
+    try:
+        request_line, *header_lines = head.decode("latin-1").rstrip("\r\n").split("\r\n")
+        method, target, _ = request_line.split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "malformed request line")
+    headers = {}
+    for line in header_lines:
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return method.upper(), urlsplit(target).path, headers
+
+
+def _parse_chat(body):
+    try:
+        payload = json.loads(body or b"{}")
+    except ValueError:
+        raise HTTPError(400, "body must be JSON")
+    if not isinstance(payload, dict):
+        raise HTTPError(400, "body must be a JSON object")
+    message = payload.pop("message", None)
+    if not isinstance(message, str) or not message.strip():
+        raise HTTPError(400, '"message" must be a non-empty string')
+    try:
+        history = [Message(chat["origin"], chat["message"]) for chat in payload.pop("history", None) or []]
+    except (KeyError, TypeError):
+        raise HTTPError(400, '"history" must be a list of {"origin", "message"} objects')
+    session_id = payload.pop("session_id", None) or uuid.uuid4().hex
+    unknown = set(payload) - SAMPLING_FIELDS
+    if unknown:
+        raise HTTPError(400, f"unknown fields: {', '.join(sorted(unknown))}")
+    try:
+        params = SamplingParams(**payload)
+    except TypeError as error:
+        raise HTTPError(400, str(error))
+    return {"message": message, "history": history, "session_id": str(session_id), "params": params}
+
+
+async def _send_event(writer, payload, event=None):
+    data = json.dumps(payload, ensure_ascii=False)
+    writer.write(((f"event: {event}\n" if event else "") + f"data: {data}\n\n").encode("utf-8"))
+    await writer.drain()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the chatbot over HTTP with JSON and Server-Sent-Events endpoints.")
+    parser.add_argument("--model", default="vinai/PhoGPT-4B-Chat", help='model path, or "tiny" for a random offline model')
+    parser.add_argument("--device", default="auto")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-concurrency", type=int, default=None, help="worker threads (default: max batch size)")
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--timeout", type=float, default=120.0, help="request deadline in seconds")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="serve from this many model worker processes instead of an in-process model")
+    parser.add_argument("--worker-devices", default=None,
+                        help="comma-separated device of each worker, repeated as needed (default: --device)")
+    parser.add_argument("--compile", action="store_true", help="decode with a torch.compile-d model on bucketed shapes")
+    parser.add_argument("--profile-rate", type=float, default=0.0, help="fraction of requests captured with the torch profiler")
+    return parser.parse_args(argv)
+
+
+def load_bot(model_path, device, max_batch_size=8, compile=False, profile_rate=0.0, colocated_workers=1):
+    """
+    Loads the chatbot of the server or of a model worker.
+
+    Parameters
+    ----------
+    model_path : str
+        Model path, or "tiny" for a small random model that needs no download.
+    device : str
+        Device to run the model on.
+    max_batch_size : int, optional
+        Maximum number of sequences decoded together (default is 8).
+    compile : bool, optional
+        Decode with a ``torch.compile``-d model (default is False).
+    profile_rate : float, optional
+        Fraction of requests captured with the torch profiler (default is 0.0).
+    colocated_workers : int, optional
+        Model workers sharing the device, between which the memory budget is split (default is 1).
+
+    Returns
+    -------
+    ChatBot
+        The loaded chatbot.
+    """
+    if model_path == "tiny":
+        from benchmark.tiny_model import build_tiny_model, build_tiny_tokenizer
+
+        tokenizer = build_tiny_tokenizer()
+        bot = ChatBot.from_model(build_tiny_model(tokenizer), tokenizer, max_batch_size=max_batch_size, compile=compile,
+                                 colocated_workers=colocated_workers)
+    else:
+        bot = ChatBot(model_path, device=device, max_batch_size=max_batch_size, compile=compile,
+                      colocated_workers=colocated_workers)
+    bot.profiler.sample_rate = profile_rate
+    return bot
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.workers:
+        from worker_pool import WorkerPool
+
+        devices = (args.worker_devices or args.device).split(",")
+        bot = WorkerPool(args.model, devices, num_workers=args.workers, slots_per_worker=args.max_batch_size,
+                         loader=load_bot, max_batch_size=args.max_batch_size, compile=args.compile,
+                         profile_rate=args.profile_rate)
+    else:
+        bot = load_bot(args.model, args.device, args.max_batch_size, args.compile, args.profile_rate)
+    server = ChatServer(bot, args.host, args.port, args.max_concurrency, args.max_queue, args.timeout)
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.workers:
+            bot.close()
+        else:
+            bot.engine.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import threading
+from collections import OrderedDict
+
+from kv_cache import cache_nbytes
+
+
+class SessionCacheEntry:
+    """
+    A class to represent the cached key/value state of one chat session.
+
+    Attributes
+    ----------
+    token_ids : list of int
+        Token ids of the whole conversation so far (prompt and generated answer).
+    cache : tuple
+        ``past_key_values`` for the first ``cached_length`` tokens of ``token_ids``.
+    cached_length : int
+        Number of leading tokens covered by ``cache``.
+    turns : int
+        Number of question/answer turns encoded in ``token_ids``.
+    nbytes : int
+        Size of ``cache`` in bytes.
+    """
+    __slots__ = ("token_ids", "cache", "cached_length", "turns", "nbytes")
+
+    def __init__(self, token_ids, cache, cached_length, turns):
+        self.token_ids = token_ids
+        self.cache = cache
+        self.cached_length = cached_length
+        self.turns = turns
+        self.nbytes = cache_nbytes(cache)
+
+
+class SessionCacheStore:
+    """
+    A class to keep the KV cache of recent chat sessions within a memory budget.
+
+    When a session asks its next question, the prompt starts with the tokens of the previous
+    turns, so their key/value state can be reused and only the new tokens need a prefill.
+    Entries are evicted in least-recently-used order once the total size exceeds the budget.
+
+    Attributes
+    ----------
+    max_bytes : int
+        Memory budget shared by all sessions.
+    nbytes : int
+        Bytes currently held by the store.
+    hits : int
+        Lookups that reused at least one cached token.
+    misses : int
+        Lookups that found nothing reusable.
+    evictions : int
+        Entries dropped to respect the budget.
+
+    Methods
+    -------
+    get(session_id):
+        Returns the entry of a session, or None.
+
+    match(session_id, token_ids):
+        Returns the reusable cache and prefix length for a new prompt of the session.
+
+    put(session_id, token_ids, cache, cached_length, turns):
+        Stores the state of a session after a turn, evicting old sessions if needed.
+
+    discard(session_id):
+        Drops the entry of a session.
+
+    stats():
+        Returns the counters of the store.
+    """
+
+    def __init__(self, max_bytes=2 * 1024 ** 3):
+        """
+        Initializes the SessionCacheStore.
+
+        Parameters
+        ----------
+        max_bytes : int, optional
+            Memory budget shared by all sessions (default is 2 GiB).
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        """
+        Returns the entry of a session without touching the counters.
+
+        Parameters
+        ----------
+        session_id : str
+            Identifier of the chat session.
+
+        Returns
+        -------
+        SessionCacheEntry or None
+            The stored entry, if any.
+        """
+        with self._lock:
+            return self._entries.get(session_id)
+
+    def match(self, session_id, token_ids):
+        """
+        Returns the part of a session's cache that can be reused for a new prompt.
+
+        Parameters
+        ----------
+        session_id : str
+            Identifier of the chat session.
+        token_ids : list of int
+            Token ids of the new prompt.
+
+        Returns
+        -------
+        tuple
+            ``(cache, length)`` where ``cache`` covers at least the first ``length`` prompt
+            tokens, or ``(None, 0)`` when nothing can be reused. At least one prompt token is
+            always left for the prefill.
+        """
+        with self._lock:
+            entry = self._entries.get(session_id)
+            length = 0
+            if entry is not None:
+                self._entries.move_to_end(session_id)
+                limit = min(entry.cached_length, len(token_ids) - 1)
+                while length < limit and entry.token_ids[length] == token_ids[length]:
+                    length += 1
+            if length == 0:
+                self.misses += 1
+                return None, 0
+            self.hits += 1
+            return entry.cache, length
+
+    def put(self, session_id, token_ids, cache, cached_length, turns):
+        """
+        Stores the state of a session after a turn.
+
+        Parameters
+        ----------
+        session_id : str
+            Identifier of the chat session.
+        token_ids : list of int
+            Token ids of the whole conversation so far.
+        cache : tuple
+            ``past_key_values`` for the first ``cached_length`` tokens.
+        cached_length : int
+            Number of leading tokens covered by ``cache``.
+        turns : int
+            Number of question/answer turns encoded in ``token_ids``.
+        """
+        entry = SessionCacheEntry(list(token_ids), cache, cached_length, turns)
+        with self._lock:
+            self._remove(session_id)
+            if entry.nbytes > self.max_bytes:
+                return
+            self._entries[session_id] = entry
+            self.nbytes += entry.nbytes
+            while self.nbytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def discard(self, session_id):
+        """
+        Drops the entry of a session.
+
+        Parameters
+        ----------
+        session_id : str
+            Identifier of the chat session.
+        """
+        with self._lock:
+            self._remove(session_id)
+
+    def stats(self):
+        """
+        Returns the counters of the store.
+
+        Returns
+        -------
+        dict
+            Number of sessions, bytes used, budget, hits, misses, hit rate and evictions.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "sessions": len(self._entries),
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, session_id):
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self.nbytes -= entry.nbytes
@@ -0,0 +1,309 @@
+import threading
+import time
+
+import torch
+
+from admission import AdmissionError, is_out_of_memory
+from engine import InferenceEngine, sample_next_token, token_probabilities
+from kv_cache import CacheLayout
+
+
+class SpeculativeEngine(InferenceEngine):
+    """
+    An inference engine that speeds up decoding with a small draft model.
+
+    For every round the draft model proposes ``num_draft_tokens`` tokens one by one, and the
+    main model scores all of them in a single forward pass. Draft tokens are accepted with
+    probability ``min(1, p / q)``, where ``p`` and ``q`` are the sampling distributions of the
+    main and the draft model; the first rejected token is replaced by a sample from the
+    normalized residual ``max(0, p - q)``, and a bonus token is sampled from the main model when
+    every draft is accepted. The generated text therefore follows exactly the distribution of
+    the main model (greedy requests give the main model's greedy output), while one memory-bound
+    pass over the large model yields several tokens.
+
+    The number of draft tokens adapts to the observed acceptance rate and to the measured cost of
+    draft and verification passes, picking the value with the highest expected tokens per second.
+    Requests are served one at a time, which is where decoding is bandwidth bound; the interface
+    is the same as InferenceEngine, so ChatBot uses it as a drop-in replacement. Requests pass
+    the same memory admission, whose per-token estimate includes the draft model's cache.
+
+    Attributes
+    ----------
+    draft_model : PreTrainedModel
+        The small model proposing tokens; it must share the main model's tokenizer.
+    num_draft_tokens : int
+        Number of tokens drafted in the next round.
+    min_draft_tokens, max_draft_tokens : int
+        Bounds of the adaptive number of draft tokens.
+
+    Methods
+    -------
+    step():
+        Generates the complete answer of the oldest waiting request.
+
+    stats():
+        Returns acceptance rate, tokens per verification pass and effective tokens per second.
+    """
+
+    def __init__(self, model, draft_model, device, eos_token_id, pad_token_id=None, num_draft_tokens=4,
+                 min_draft_tokens=1, max_draft_tokens=8):
+        """
+        Initializes the SpeculativeEngine.
+
+        Parameters
+        ----------
+        model : PreTrainedModel
+            The main causal language model.
+        draft_model : PreTrainedModel
+            The small draft model, on the same device and with the same tokenizer.
+        device : str
+            The device both models live on.
+        eos_token_id : int
+            Token id that ends a generation.
+        pad_token_id : int, optional
+            Token id used for padding (defaults to ``eos_token_id``).
+        num_draft_tokens : int, optional
+            Initial number of tokens drafted per round (default is 4).
+        min_draft_tokens : int, optional
+            Lower bound of the adaptive draft length (default is 1).
+        max_draft_tokens : int, optional
+            Upper bound of the adaptive draft length (default is 8).
+        """
+        super().__init__(model, device, eos_token_id, pad_token_id, max_batch_size=1)
+        self.draft_model = draft_model
+        self.draft_layout = None
+        self.num_draft_tokens = num_draft_tokens
+        self.min_draft_tokens = min_draft_tokens
+        self.max_draft_tokens = max_draft_tokens
+        self.rounds = 0
+        self.drafted = 0
+        self.accepted = 0
+        self.generated = 0
+        self.decode_seconds = 0.0
+        # Exponential moving averages feeding the choice of the draft length.
+        self._accepted_average = 0.6
+        self._trials_average = 1.0
+        self._draft_seconds = None
+        self._verify_seconds = None
+        self._stats_lock = threading.Lock()
+
+    @torch.no_grad()
+    def step(self):
+        """
+        Generates the complete answer of the oldest waiting request.
+
+        Returns
+        -------
+        bool
+            False if there was nothing to do.
+        """
+        ran = self._run_calls()
+        if not self.waiting:
+            return ran
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.before_step(self)
+        self._drop_cancelled()
+        with self._condition:
+            if not self.waiting:
+                admitted, rejected = [], []
+            elif self.admission is None:
+                admitted, rejected = [self.waiting.popleft()], []
+            else:
+                # Nothing else runs, so the head of the queue is either admitted or rejected.
+                admitted, rejected = self.admission.admit([], self.waiting, 1)
+        for request in rejected:
+            request._finish("error", AdmissionError(
+                f"request {request.request_id} does not fit into the memory budget after an out-of-memory error"
+            ))
+        if not admitted:
+            if profiler is not None:
+                profiler.after_step(self)
+            return True
+        request = admitted[0]
+        request.admitted_time = time.perf_counter()
+        self.running = [request]
+        if self.admission is not None:
+            self.admission.after_step(self)
+        try:
+            if self.layout is None:
+                self.layout = CacheLayout.detect(self.model, self.device)
+                self.draft_layout = CacheLayout.detect(self.draft_model, self.device)
+            self._generate(request)
+        except Exception as error:
+            if self.admission is not None and is_out_of_memory(error):
+                self.admission.on_out_of_memory(self)
+                error = AdmissionError(f"out of memory while generating: {error}")
+            if not request.done():
+                request._finish("error", error)
+        finally:
+            if profiler is not None:
+                profiler.after_step(self)
+            self.running = []
+            if self.admission is not None:
+                self.admission.after_step(self)
+        return True
+
+    def stats(self):
+        """
+        Returns acceptance rate, tokens per verification pass and effective tokens per second.
+
+        Returns
+        -------
+        dict
+            Counters of the speculative rounds since the engine was created.
+        """
+        with self._stats_lock:
+            return {
+                "rounds": self.rounds,
+                "drafted_tokens": self.drafted,
+                "accepted_tokens": self.accepted,
+                "acceptance_rate": self.accepted / self.drafted if self.drafted else 0.0,
+                "tokens_per_round": self.generated / self.rounds if self.rounds else 0.0,
+                "effective_tokens_per_second": self.generated / self.decode_seconds if self.decode_seconds else 0.0,
+                "num_draft_tokens": self.num_draft_tokens,
+            }
+
+    def _generate(self, request):
+        params = request.params
+        greedy = not params.do_sample or params.temperature <= 0
+        prompt = request.prompt_ids
+
+        start = time.perf_counter()
+        if request.prefix_cache is not None:
+            cache = request.prefix_cache
+            request.prefix_cache = None
+            if self.layout.length(cache) > request.prefix_length:
+                cache = self.layout.truncate(cache, request.prefix_length)
+            logits, cache = self._run(self.model, prompt[request.prefix_length:], cache, request.prefix_length)
+        else:
+            logits, cache = self._run(self.model, prompt, None, 0)
+        _, draft_cache = self._run(self.draft_model, prompt, None, 0)
+        first = sample_next_token(logits[-1], params, request.generator)
+        now = time.perf_counter()
+        request.prefill_seconds = now - start
+        request.first_token_time = now
+
+        # Both caches cover ``sequence[:length]``; the tokens after that are fed in the next pass.
+        sequence = prompt + [first]
+        length = draft_length = len(prompt)
+        reason = self._emit(request, [first])
+        while reason is None:
+            remaining = params.max_new_tokens - len(request.output_ids)
+            k = min(self.num_draft_tokens, remaining - 1)
+
+            round_start = time.perf_counter()
+            drafts, draft_probs = [], []
+            pending = sequence[draft_length:]
+            for _ in range(k):
+                draft_logits, draft_cache = self._run(self.draft_model, pending, draft_cache, draft_length)
+                draft_length += len(pending)
+                if greedy:
+                    token, probs = int(torch.argmax(draft_logits[-1])), None
+                else:
+                    probs = token_probabilities(draft_logits[-1], params)
+                    token = int(torch.multinomial(probs, 1, generator=request.generator))
+                drafts.append(token)
+                draft_probs.append(probs)
+                pending = [token]
+            verify_start = time.perf_counter()
+
+            pending = sequence[length:] + drafts
+            logits, cache = self._run(self.model, pending, cache, length)
+            logits = logits[-(k + 1):]
+            new_tokens = self._verify(drafts, draft_probs, logits, params, request.generator, greedy)
+            accepted = len(new_tokens) - 1
+            end = time.perf_counter()
+
+            # Drop the cache entries of rejected drafts before the next round.
+            valid = len(sequence) + accepted
+            cache = self.layout.truncate(cache, valid)
+            length = valid
+            if draft_length > valid:
+                draft_cache = self.draft_layout.truncate(draft_cache, valid)
+                draft_length = valid
+            sequence += new_tokens
+            reason = self._emit(request, new_tokens)
+            if reason is None and request.cancelled:
+                reason = "cancelled"
+            self._observe(k, accepted, len(new_tokens), verify_start - round_start, end - verify_start)
+
+        if request.keep_cache and reason != "cancelled":
+            covered = min(length, len(prompt) + len(request.output_ids))
+            request.cache = self.layout.truncate(cache, covered)
+            request.cache_length = covered
+        with self._stats_lock:
+            self.decode_seconds += time.perf_counter() - request.first_token_time
+        request._finish(reason)
+
+    def _run(self, model, token_ids, cache, past_length):
+        input_ids = torch.tensor([token_ids], device=self.device)
+        attention_mask = torch.ones((1, past_length + len(token_ids)), dtype=torch.long, device=self.device)
+        outputs = model(input_ids=input_ids, attention_mask=attention_mask, past_key_values=cache, use_cache=True)
+        return outputs.logits[0], outputs.past_key_values
+
+    def _verify(self, drafts, draft_probs, logits, params, generator, greedy):
+        tokens = []
+        for position, token in enumerate(drafts):
+            if greedy:
+                best = int(torch.argmax(logits[position]))
+                tokens.append(best)
+                if best != token:
+                    return tokens
+                continue
+            probs = token_probabilities(logits[position], params)
+            draft = _align(draft_probs[position], probs.shape[-1])
+            if torch.rand((), generator=generator, device=probs.device) * draft[token] <= probs[token]:
+                tokens.append(token)
+                continue
+            residual = (probs - draft).clamp(min=0)
+            if residual.sum() <= 0:
+                residual = probs
+            tokens.append(int(torch.multinomial(residual / residual.sum(), 1, generator=generator)))
+            return tokens
+        tokens.append(sample_next_token(logits[len(drafts)], params, generator))
+        return tokens
+
+    def _emit(self, request, tokens):
+        for token in tokens:
+            reason = self._accept(request, token)
+            if reason is not None:
+                return reason
+        return None
+
+    def _observe(self, k, accepted, generated, draft_seconds, verify_seconds):
+        with self._stats_lock:
+            self.rounds += 1
+            self.drafted += k
+            self.accepted += accepted
+            self.generated += generated
+        if k == 0:
+            return
+        rejected = 1 if accepted < k else 0
+        self._accepted_average = 0.9 * self._accepted_average + accepted
+        self._trials_average = 0.9 * self._trials_average + accepted + rejected
+        per_draft = draft_seconds / k
+        self._draft_seconds = per_draft if self._draft_seconds is None else 0.9 * self._draft_seconds + 0.1 * per_draft
+        self._verify_seconds = verify_seconds if self._verify_seconds is None else 0.9 * self._verify_seconds + 0.1 * verify_seconds
+        self.num_draft_tokens = self._choose_draft_tokens()
+
+    def _choose_draft_tokens(self):
+        # With per-token acceptance probability a, a round of k drafts yields (1 - a^(k+1)) / (1 - a)
+        # tokens on average and costs k draft passes plus one verification pass.
+        acceptance = min(self._accepted_average / self._trials_average, 0.99)
+
+        def tokens_per_second(k):
+            expected = (1 - acceptance ** (k + 1)) / (1 - acceptance)
+            return expected / (k * self._draft_seconds + self._verify_seconds)
+
+        return max(range(self.min_draft_tokens, self.max_draft_tokens + 1), key=tokens_per_second)
+
+
+def _align(probs, size):
+    # Draft and main model may pad their vocabularies to different sizes.
+    if probs.shape[-1] == size:
+        return probs
+    if probs.shape[-1] > size:
+        probs = probs[:size]
+        return probs / probs.sum()
+    return torch.nn.functional.pad(probs, (0, size - probs.shape[-1]))
@@ -0,0 +1,247 @@
+import argparse
+import contextlib
+import glob
+import importlib.util
+import inspect
+import json
+import os
+import shutil
+import threading
+import time
+import warnings
+
+
+DEFAULT_SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "snapshots")
+SNAPSHOT_MARKER = "snapshot.json"
+
+
+class StartupReport:
+    """
+    A class to record how long each phase of a model start took.
+
+    Attributes
+    ----------
+    phases : dict
+        Seconds per phase, in the order the phases ran.
+    source : str or None
+        "snapshot" when the weights came from the local snapshot cache, "original" otherwise.
+
+    Methods
+    -------
+    phase(name):
+        Context manager timing one phase.
+
+    total():
+        Returns the sum of all phases.
+
+    as_dict():
+        Returns the report as a JSON-serializable dictionary.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.source = None
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Times the enclosed block as phase ``name``; repeated phases add up.
+
+        Parameters
+        ----------
+        name : str
+            Name of the phase.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def total(self):
+        """
+        Returns the sum of all phases.
+
+        Returns
+        -------
+        float
+            Seconds.
+        """
+        return sum(self.phases.values())
+
+    def as_dict(self):
+        """
+        Returns the report as a JSON-serializable dictionary.
+
+        Returns
+        -------
+        dict
+            Source, per-phase and total seconds.
+        """
+        return {"source": self.source, "phases": dict(self.phases), "total": self.total()}
+
+
+def snapshot_path(model_path, torch_dtype, snapshot_dir=DEFAULT_SNAPSHOT_DIR):
+    """
+    Returns the folder of the local snapshot of a model in a given dtype.
+
+    Parameters
+    ----------
+    model_path : str
+        Hub id or path of the original model.
+    torch_dtype : torch.dtype
+        Data type the snapshot stores the weights in.
+    snapshot_dir : str, optional
+        Root folder of the snapshot cache.
+
+    Returns
+    -------
+    str
+        The snapshot folder (which may not exist yet).
+    """
+    name = model_path.strip("/").replace("/", "--")
+    return os.path.join(snapshot_dir, f"{name}--{str(torch_dtype).replace('torch.', '')}")
+
+
+def load_pretrained(model_path, torch_dtype, device="cpu", snapshot_dir=None, report=None):
+    """
+    Loads config, tokenizer and model with as little startup work as possible.
+
+    The model is read from the local snapshot when one exists. A snapshot stores the weights
+    in safetensors format and in the target dtype, so no pickle has to be unpacked, nothing is
+    cast, and resolving the files needs no network call. Without accelerate the weights are
+    materialized twice (random init, then the checkpoint); with it they are memory-mapped and
+    copied into the parameters once. The tokenizer loads in a background thread while the
+    weights are read. A missing snapshot is written after the first load from the original
+    model.
+
+    Parameters
+    ----------
+    model_path : str
+        Hub id or path of the model.
+    torch_dtype : torch.dtype
+        Data type of the weights.
+    device : str, optional
+        Device the model will run on; passed to configs that support ``init_device`` (default is "cpu").
+    snapshot_dir : str, optional
+        Root folder of the snapshot cache (default is None, no snapshot).
+    report : StartupReport, optional
+        Report receiving the phase timings.
+
+    Returns
+    -------
+    tuple
+        ``(config, model, tokenizer)``, with the model in evaluation mode on the CPU.
+    """
+    report = report or StartupReport()
+    with report.phase("import"):
+        from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+
+    source = model_path
+    snapshot = snapshot_path(model_path, torch_dtype, snapshot_dir) if snapshot_dir is not None else None
+    if snapshot is not None and os.path.exists(os.path.join(snapshot, SNAPSHOT_MARKER)):
+        source = snapshot
+    report.source = "snapshot" if source == snapshot else "original"
+
+    tokenizer = {}
+
+    def load_tokenizer():
+        try:
+            with report.phase("tokenizer"):
+                tokenizer["value"] = AutoTokenizer.from_pretrained(source, trust_remote_code=True)
+        except Exception as error:
+            tokenizer["error"] = error
+
+    thread = threading.Thread(target=load_tokenizer, name="tokenizer-loader", daemon=True)
+    thread.start()
+    with report.phase("config"):
+        config = AutoConfig.from_pretrained(source, trust_remote_code=True)
+        config.init_device = device
+    with report.phase("weights"):
+        model = AutoModelForCausalLM.from_pretrained(
+            source,
+            config=config,
+            torch_dtype=torch_dtype,
+            trust_remote_code=True,
+            low_cpu_mem_usage=_installed("accelerate"),
+        )
+        model.eval()
+    thread.join()
+    if "error" in tokenizer:
+        raise tokenizer["error"]
+
+    if snapshot is not None and source != snapshot:
+        with report.phase("snapshot"):
+            try:
+                write_snapshot(model, tokenizer["value"], snapshot, model_path)
+            except Exception as error:
+                warnings.warn(f"Could not write the model snapshot to {snapshot}: {error}")
+    return config, model, tokenizer["value"]
+
+
+def write_snapshot(model, tokenizer, snapshot, model_path):
+    """
+    Saves a model and its tokenizer as a local snapshot.
+
+    The snapshot is written to a temporary folder and renamed into place, with a marker file
+    written last, so a crash never leaves a half-written snapshot that would be loaded.
+
+    Parameters
+    ----------
+    model : PreTrainedModel
+        The loaded model, before quantization.
+    tokenizer : PreTrainedTokenizer
+        Its tokenizer.
+    snapshot : str
+        The snapshot folder.
+    model_path : str
+        Hub id or path of the original model, recorded in the marker.
+    """
+    partial = f"{snapshot}.partial-{os.getpid()}"
+    shutil.rmtree(partial, ignore_errors=True)
+    model.save_pretrained(partial, safe_serialization=_installed("safetensors"))
+    tokenizer.save_pretrained(partial)
+    # Models with remote code need their Python files next to config.json.
+    remote_classes = (type(model), type(model.config)) if getattr(model.config, "auto_map", None) else ()
+    for cls in remote_classes:
+        for source in glob.glob(os.path.join(os.path.dirname(inspect.getfile(cls)), "*.py")):
+            target = os.path.join(partial, os.path.basename(source))
+            if not os.path.exists(target) and not source.endswith("__init__.py"):
+                shutil.copyfile(source, target)
+    with open(os.path.join(partial, SNAPSHOT_MARKER), "w") as f:
+        json.dump({"source": model_path, "dtype": str(model.dtype), "created": time.time()}, f)
+    shutil.rmtree(snapshot, ignore_errors=True)
+    os.replace(partial, snapshot)
+
+
+def _installed(module):
+    return importlib.util.find_spec(module) is not None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the cold start of the chatbot, phase by phase.")
+    parser.add_argument("--model", default="vinai/PhoGPT-4B-Chat")
+    parser.add_argument("--device", default="auto")
+    parser.add_argument("--snapshot-dir", default=DEFAULT_SNAPSHOT_DIR, help='snapshot cache folder, "none" to disable')
+    parser.add_argument("--no-warmup", action="store_true")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    from chatbot import ChatBot
+
+    import_seconds = time.perf_counter() - start
+    bot = ChatBot(
+        args.model,
+        device=args.device,
+        response_cache_path=None,
+        semantic_cache_dir=None,
+        snapshot_dir=None if args.snapshot_dir == "none" else args.snapshot_dir,
+        warmup=not args.no_warmup,
+    )
+    report = bot.startup_report.as_dict()
+    report["import_chatbot"] = import_seconds
+    report["wall"] = time.perf_counter() - start
+    bot.engine.stop()
+    print(json.dumps(report, indent=2))
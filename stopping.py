@@ -0,0 +1,186 @@
+import bisect
+
+from streaming import IncrementalDecoder
+
+
+class StopSequenceCriteria:
+    """
+    A class to detect stop strings in a generation as the tokens arrive.
+
+    The engine calls the criteria once per generated token. Only the new text is decoded
+    (through an IncrementalDecoder) and only the tail that can contain a stop string is searched,
+    so the cost per token does not grow with the length of the answer.
+
+    Attributes
+    ----------
+    stop_strings : tuple of str
+        Strings that end the generation.
+    text : str
+        Text generated so far.
+    stop_index : int or None
+        Position in ``text`` where the first stop string starts, once one was found.
+
+    Methods
+    -------
+    __call__(token_id):
+        Adds one generated token and returns True when a stop string is complete.
+
+    kept_tokens():
+        Returns how many generated tokens precede the stop string.
+    """
+
+    def __init__(self, tokenizer, stop_strings):
+        """
+        Initializes the StopSequenceCriteria.
+
+        Parameters
+        ----------
+        tokenizer : PreTrainedTokenizer
+            The tokenizer used to decode token ids.
+        stop_strings : iterable of str
+            Strings that end the generation; empty strings are ignored.
+        """
+        self.stop_strings = tuple(stop for stop in stop_strings if stop)
+        self.text = ""
+        self.stop_index = None
+        self._decoder = IncrementalDecoder(tokenizer)
+        self._token_ends = []
+        self._longest = max((len(stop) for stop in self.stop_strings), default=0)
+
+    def __call__(self, token_id):
+        """
+        Adds one generated token.
+
+        Parameters
+        ----------
+        token_id : int
+            The token the engine just generated.
+
+        Returns
+        -------
+        bool
+            True when the text now contains a stop string.
+        """
+        chunk = self._decoder.push(token_id)
+        self.text += chunk
+        self._token_ends.append(len(self.text))
+        if not chunk or not self.stop_strings:
+            return False
+        self.stop_index = find_stop(self.text, self.stop_strings, len(self.text) - len(chunk) - self._longest + 1)
+        return self.stop_index is not None
+
+    def kept_tokens(self):
+        """
+        Returns how many generated tokens precede the stop string.
+
+        Returns
+        -------
+        int
+            Number of leading tokens whose text ends before the stop string, or all tokens when
+            no stop string was found.
+        """
+        if self.stop_index is None:
+            return len(self._token_ends)
+        return bisect.bisect_right(self._token_ends, self.stop_index)
+
+
+def find_stop(text, stop_strings, start=0):
+    """
+    Returns the position of the earliest stop string in a text.
+
+    Parameters
+    ----------
+    text : str
+        The text to search.
+    stop_strings : iterable of str
+        The stop strings.
+    start : int, optional
+        Position to start searching from (default is 0).
+
+    Returns
+    -------
+    int or None
+        Index of the first character of the earliest stop string, or None.
+    """
+    start = max(start, 0)
+    positions = [text.find(stop, start) for stop in stop_strings]
+    positions = [position for position in positions if position >= 0]
+    return min(positions) if positions else None
+
+
+def partial_stop_length(text, stop_strings):
+    """
+    Returns the length of the longest end of ``text`` that could grow into a stop string.
+
+    Streaming callers hold this many characters back, so a stop string is never shown to the
+    user before it is complete.
+
+    Parameters
+    ----------
+    text : str
+        Text generated so far.
+    stop_strings : iterable of str
+        The stop strings.
+
+    Returns
+    -------
+    int
+        Number of trailing characters that are a prefix of some stop string.
+    """
+    longest = 0
+    for stop in stop_strings:
+        for length in range(min(len(stop) - 1, len(text)), longest, -1):
+            if text.endswith(stop[:length]):
+                longest = length
+                break
+    return longest
+
+
+def context_length(config, default=2048):
+    """
+    Returns the maximum number of tokens a model attends to.
+
+    Parameters
+    ----------
+    config : PretrainedConfig
+        The model configuration.
+    default : int, optional
+        Value used when the configuration does not say (default is 2048).
+
+    Returns
+    -------
+    int
+        The context window in tokens.
+    """
+    for name in ("max_seq_len", "max_position_embeddings", "n_positions", "seq_length"):
+        value = getattr(config, name, None)
+        if isinstance(value, int) and value > 0:
+            return value
+    return default
+
+
+def token_budget(prompt_length, max_new_tokens, context_window):
+    """
+    Returns the number of new tokens a request may generate.
+
+    The budget is the requested ``max_new_tokens``, reduced so that prompt and answer fit in the
+    model's context window; decode steps beyond it would only produce degenerate text.
+
+    Parameters
+    ----------
+    prompt_length : int
+        Number of prompt tokens.
+    max_new_tokens : int
+        Upper bound requested by the caller.
+    context_window : int
+        Maximum number of tokens the model attends to.
+
+    Returns
+    -------
+    int
+        The token budget of the request.
+    """
+    remaining = context_window - prompt_length
+    if remaining < 1:
+        raise ValueError(f"The prompt has {prompt_length} tokens, the model's context window is {context_window}")
+    return min(max_new_tokens, remaining)
@@ -0,0 +1,82 @@
+class IncrementalDecoder:
+    """
+    A class to turn a growing list of token ids into text chunks.
+
+    Vietnamese text is split by the tokenizer into byte-level or sub-word pieces, so a single
+    token often decodes to half of a multi-byte character ("\\ufffd") or to a word piece whose
+    spacing depends on the next token. The decoder therefore re-decodes a small window of
+    recent tokens and only releases text once it is stable, which keeps the cost per token
+    constant instead of re-decoding the whole answer every time.
+
+    Attributes
+    ----------
+    tokenizer : PreTrainedTokenizer
+        The tokenizer used to decode token ids.
+    token_ids : list of int
+        All token ids received so far.
+
+    Methods
+    -------
+    push(token_id):
+        Adds one token id and returns the newly completed text (possibly empty).
+
+    flush():
+        Returns whatever text is still held back at the end of the generation.
+    """
+
+    def __init__(self, tokenizer, skip_special_tokens=True):
+        """
+        Initializes the IncrementalDecoder.
+
+        Parameters
+        ----------
+        tokenizer : PreTrainedTokenizer
+            The tokenizer used to decode token ids.
+        skip_special_tokens : bool, optional
+            Whether special tokens are dropped from the text (default is True).
+        """
+        self.tokenizer = tokenizer
+        self.skip_special_tokens = skip_special_tokens
+        self.token_ids = []
+        self._prefix_offset = 0
+        self._read_offset = 0
+
+    def push(self, token_id):
+        """
+        Adds one token id and returns the text it completes.
+
+        Parameters
+        ----------
+        token_id : int
+            The next generated token id.
+
+        Returns
+        -------
+        str
+            Newly completed text, or an empty string while a character is still incomplete.
+        """
+        self.token_ids.append(token_id)
+        prefix_text = self._decode(self.token_ids[self._prefix_offset:self._read_offset])
+        text = self._decode(self.token_ids[self._prefix_offset:])
+        if len(text) <= len(prefix_text) or text.endswith("�"):
+            return ""
+        self._prefix_offset = self._read_offset
+        self._read_offset = len(self.token_ids)
+        return text[len(prefix_text):]
+
+    def flush(self):
+        """
+        Returns the text that is still held back.
+
+        Returns
+        -------
+        str
+            The remaining text, with incomplete characters left as replacement characters.
+        """
+        prefix_text = self._decode(self.token_ids[self._prefix_offset:self._read_offset])
+        text = self._decode(self.token_ids[self._prefix_offset:])
+        self._prefix_offset = self._read_offset = len(self.token_ids)
+        return text[len(prefix_text):]
+
+    def _decode(self, token_ids):
+        return self.tokenizer.decode(token_ids, skip_special_tokens=self.skip_special_tokens)
@@ -2,7 +2,8 @@ import streamlit as st
 from dataclasses import dataclass
 from typing import Literal
 import streamlit.components.v1 as components
-from chatbot import *
+from assets import static_url, stylesheet
+from model_registry import registry
 
 @dataclass
 class Message:
@@ -11,9 +12,7 @@ class Message:
     message: str
 
 def load_css():
-    with open("/mlcv2/WorkingSpace/Personal/longlb/chatbot/Chatbot_AI_model/static/styles.css", "r") as f:
-        css = f"<style>{f.read()}</style>"
-        st.markdown(css, unsafe_allow_html=True)
+    st.markdown(stylesheet(), unsafe_allow_html=True)
 
 
 def initialize_session_state():
@@ -21,7 +20,7 @@ def initialize_session_state():
         st.session_state.history = []
     if "bot" not in st.session_state:
         model_path = "vinai/PhoGPT-4B-Chat"
-        st.session_state.bot = ChatBot(model_path)
+        st.session_state.bot = registry.acquire(model_path)
     
 
 def on_click_callback():
@@ -71,19 +70,10 @@ with st.container(height = 400, border = True):
         # Safeguard in case history was not initialized
         if "history" in st.session_state:
             for chat in st.session_state.history:
-                div = f"""
-    <div class="chat-row 
-        {'' if chat.origin == 'ai' else 'row-reverse'}">
-        <img class="chat-icon" src="app/static/{
-            '/mlcv2/WorkingSpace/Personal/longlb/chatbot/Chatbot_AI_model/static/chatbot.png' if chat.origin == 'ai' 
-                        else '/mlcv2/WorkingSpace/Personal/longlb/chatbot/Chatbot_AI_model/static/profile.png'}"
-            width=32 height=32>
-        <div class="chat-bubble
-        {'ai-bubble' if chat.origin == 'ai' else 'human-bubble'}">
-            &#8203;{chat.message}
-        </div>
-    </div>
-                """
+                kind = "ai" if chat.origin == "ai" else "human"
+                div = (f'<div class="chat-row{"" if chat.origin == "ai" else " row-reverse"}">'
+                       f'<img class="chat-icon" src="{static_url("chatbot.png" if chat.origin == "ai" else "profile.png")}">'
+                       f'<div class="chat-bubble {kind}-bubble">&#8203;{chat.message}</div></div>')
                 st.markdown(div, unsafe_allow_html=True)
 
 st.markdown("")
@@ -1,8 +1,22 @@
+import uuid
 import streamlit as st
 from dataclasses import dataclass
 from typing import Literal
 import streamlit.components.v1 as components
-from chatbot import ChatBot
+from assets import stylesheet
+from conversation_store import ConversationStore
+from metrics import collector
+from model_registry import registry
+from request_lifecycle import GenerationCancelled
+
+# Messages shown per page of history, and the most HTML sent to the browser for the history per rerun.
+HISTORY_WINDOW = 20
+MAX_HISTORY_CHARS = 200_000
+PAGE_HEADER = ('<div style="display:flex;justify-content:center;align-items:center">'
+               '<h1 style="margin-left:10px;font-family:\'Libre Baskerville\',serif;font-weight:400">Leomine</h1>'
+               '<div style="border:2px solid black;border-radius:10px;padding:5px">'
+               '<img src="https://i.pinimg.com/474x/03/cd/45/03cd45a61a83b2aa86e7231cc01b44eb.jpg" width="75" height="75">'
+               '</div></div>')
 
 @dataclass
 class Message:
@@ -17,6 +31,43 @@ class Message:
     origin: Literal["human", "ai"]
     message: str
 
+def bubble_html(origin, message):
+    """
+    Builds the HTML of a single chat bubble.
+
+    Parameters
+    ----------
+    origin : Literal["human", "ai"]
+        The origin of the message.
+    message : str
+        The content of the message.
+
+    Returns
+    -------
+    str
+        The HTML fragment for the message.
+    """
+    side = "" if origin == "ai" else " row-reverse"
+    kind = "ai" if origin == "ai" else "human"
+    # The icons are background images of the stylesheet, so a bubble carries no image URL.
+    return (f'<div class="chat-row{side}"><div class="chat-icon {kind}-icon"></div>'
+            f'<div class="chat-bubble {kind}-bubble">&#8203;{message}</div></div>')
+
+@st.cache_resource
+def conversation_store():
+    """
+    Returns the conversation store shared by all sessions of the process.
+    """
+    return ConversationStore()
+
+# Streamlit re-executes this script on every rerun, so the cache has to live in Streamlit, not in a module global.
+@st.cache_data(max_entries=4096, show_spinner=False)
+def message_fragment(origin, message):
+    """
+    Returns the cached HTML of a chat bubble, built once per distinct message.
+    """
+    return bubble_html(origin, message)
+
 class ChatApp:
     """
     A class to represent a chat application with a conversational AI assistant.
@@ -25,6 +76,8 @@ class ChatApp:
     ----------
     user_chat : bool
         A flag to indicate if there is an ongoing user chat session.
+    store : ConversationStore
+        The durable store holding the conversations of all sessions.
 
     Methods
     -------
@@ -32,19 +85,37 @@ class ChatApp:
         Initializes the chat application, setting up session state and loading CSS styles.
     
     initialize_session_state():
-        Initializes the session state, including chat history and the chatbot instance.
+        Initializes the session state, restoring the session identifier from the URL and greeting new sessions.
+    
+    load_bot():
+        Acquires a handle to the shared chatbot, showing a spinner while the model loads.
     
     load_css():
-        Loads and applies CSS styles for the chat application from an external stylesheet.
+        Applies the cached, minified stylesheet of the chat application.
     
     on_click_callback():
-        Handles the event when the user submits a chat prompt, generating and displaying the bot's response.
+        Handles the event when the user submits a chat prompt, queueing it for a streamed response.
     
     render_sidebar():
         Renders the sidebar with buttons for account status and support service options.
     
+    render_metrics_panel():
+        Shows the per-stage latency breakdown of the most recent requests.
+    
+    message_html(chat, cache=True):
+        Builds the HTML fragment of a single chat bubble, reusing the cached fragment of an identical message.
+    
+    history_window():
+        Selects the recent messages rendered on this rerun and joins their HTML.
+    
+    load_older_messages():
+        Shows one more page of older messages.
+    
     render_chat_history():
-        Renders the chat history container, displaying the conversation between the user and the bot.
+        Renders a window of the conversation between the user and the bot.
+    
+    render_pending_response():
+        Streams the bot's answer to the pending prompt into the chat history.
     
     render_chat_input():
         Renders the chat input form where the user can enter their messages.
@@ -61,6 +132,7 @@ class ChatApp:
         
         This method sets up the initial session state and loads the CSS for the chat application.
         """
+        self.store = conversation_store()
         self.initialize_session_state()
         self.load_css()
         self.user_chat = False
@@ -69,44 +141,63 @@ class ChatApp:
         """
         Initializes the session state for the chat application.
         
-        This method sets up the chat history and creates an instance of the chatbot if they do not already exist
-        in the session state.
+        This method sets up the session identifier, which names the conversation in the conversation store and is
+        used to reuse the conversation's KV cache. It is kept in the page URL, so a reload or a redeploy of the server
+        brings the conversation back. New conversations start with a greeting. It also starts the Prometheus endpoint
+        of the process (once, on port 9464). The chatbot itself is acquired by load_bot, after the page has been drawn.
+        """
+        if "session_id" not in st.session_state:
+            st.session_state.session_id = st.query_params.get("session") or uuid.uuid4().hex
+            st.query_params["session"] = st.session_state.session_id
+        if self.store.count(st.session_state.session_id) == 0:
+            self.store.append(st.session_state.session_id, "ai", "Xin chào, tôi là trợ lí ảo Leomine. Bạn có thể hỏi tôi bất cứ điều gì!")
+        try:
+            collector.serve()
+        except OSError:
+            pass
+
+    def load_bot(self):
+        """
+        Acquires a handle to the process-wide shared chatbot.
+
+        The first session of a process loads the model, which takes a while; the page is already drawn and a
+        spinner is shown meanwhile. Later sessions and reruns get the loaded model immediately.
         """
-        if "history" not in st.session_state:
-            st.session_state.history = []
-            st.session_state.history.append(Message("ai", "Xin chào, tôi là trợ lí ảo Leomine. Bạn có thể hỏi tôi bất cứ điều gì!"))
         if "bot" not in st.session_state:
             model_path = "vinai/PhoGPT-4B-Chat"
-            st.session_state.bot = ChatBot(model_path)
+            with st.spinner("Đang tải mô hình..."):
+                st.session_state.bot = registry.acquire(model_path)
 
     def load_css(self):
         """
         Loads and applies CSS styles for the chat application.
         
-        This method reads an external CSS file and applies the styles to the Streamlit application.
+        The stylesheet in static/ is read and minified once per process by the asset layer; reruns only send the
+        cached ``<style>`` element.
         """
-        with open("/mlcv2/WorkingSpace/Personal/longlb/chatbot/Chatbot_AI_model/static/styles.css", "r") as f:
-            css = f"<style>{f.read()}</style>"
-            st.markdown(css, unsafe_allow_html=True)
-        # with open('/mlcv2/WorkingSpace/Personal/longlb/chatbot/Chatbot_AI_model/static/styles.css') as f:
-        #     st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+        st.markdown(stylesheet(), unsafe_allow_html=True)
+
     def on_click_callback(self):
         """
         Callback function for handling user input in the chat.
         
-        This method retrieves the user's input, generates a response using the chatbot, and updates the chat history.
+        This method stores the user's input as the pending prompt. The response is streamed into the chat history
+        during the next rerun by render_pending_response. An answer to an earlier message that is still being
+        generated is cancelled, so the model stops decoding it.
         """
         instruction = st.session_state.human_prompt
-        response = st.session_state.bot.generate_response(instruction)
-        st.session_state.history.append(Message("human", instruction))
-        st.session_state.history.append(Message("ai", response))
+        if instruction:
+            if "bot" in st.session_state:
+                st.session_state.bot.cancel(st.session_state.session_id)
+            st.session_state.pending_prompt = instruction
         st.session_state.human_prompt = ""
 
     def render_sidebar(self):
         """
         Renders the sidebar of the chat application.
         
-        This method adds buttons for "Account Status" and "Support Service" to the sidebar.
+        This method adds buttons for "Account Status" and "Support Service" to the sidebar, and a toggle for the
+        request metrics debug panel.
         """
         with st.sidebar:
             st.markdown("<div style='margin-bottom: 20px;'></div>", unsafe_allow_html=True)
@@ -121,31 +212,134 @@ class ChatApp:
                         Email: 23520877@gmail.com
             Phone: 0354403877 """)
 
+            st.markdown("<div style='margin-bottom: 20px;'></div>", unsafe_allow_html=True)
+            if st.checkbox("Show request metrics", key="show_metrics"):
+                self.render_metrics_panel()
+
+    def render_metrics_panel(self, last=10):
+        """
+        Shows the per-stage latency breakdown of the most recent requests.
+
+        Parameters
+        ----------
+        last : int, optional
+            Number of requests to show (default is 10).
+        """
+        requests = collector.recent_requests()[:last]
+        if not requests:
+            st.caption("No requests yet.")
+            return
+        columns = ["source", "retrieve", "tokenize", "queue_wait", "prefill", "decode", "detokenize", "total",
+                   "prompt_tokens", "cached_tokens", "retrieved_passages", "output_tokens"]
+        st.dataframe([{column: request[column] for column in columns} for request in requests], hide_index=True)
+
+    def message_html(self, chat, cache=True):
+        """
+        Builds the HTML of a single chat bubble.
+
+        Parameters
+        ----------
+        chat : Message
+            The message to render.
+        cache : bool, optional
+            Reuse the fragment built for an identical message (default is True). Partial messages that are
+            still being streamed are built without the cache, so they do not evict finished ones.
+
+        Returns
+        -------
+        str
+            The HTML fragment for the message.
+        """
+        if cache:
+            return message_fragment(chat.origin, chat.message)
+        return bubble_html(chat.origin, chat.message)
+
+    def history_window(self):
+        """
+        Selects the messages rendered on this rerun.
+
+        The newest ``visible_messages`` messages are shown, but never more than ``MAX_HISTORY_CHARS`` of HTML,
+        so neither the rerun time nor the payload sent to the browser grows with the length of the conversation.
+        Messages older than the in-memory tail of the session are paged in from the conversation store.
+
+        Returns
+        -------
+        tuple
+            ``(start, html)`` with the number of older messages that are not rendered and the HTML of the window.
+        """
+        visible = st.session_state.get("visible_messages", HISTORY_WINDOW)
+        session_id = st.session_state.session_id
+        start = self.store.count(session_id)
+        window = self.store.recent(session_id, visible)
+        fragments = []
+        size = 0
+        for chat in reversed(window):
+            fragment = self.message_html(chat)
+            if fragments and size + len(fragment) > MAX_HISTORY_CHARS:
+                break
+            fragments.append(fragment)
+            size += len(fragment)
+            start -= 1
+        return start, "".join(reversed(fragments))
+
+    def load_older_messages(self):
+        """
+        Callback of the "load older messages" button; shows one more page of history.
+        """
+        st.session_state.visible_messages = st.session_state.get("visible_messages", HISTORY_WINDOW) + HISTORY_WINDOW
+
     def render_chat_history(self):
         """
         Renders the chat history container.
         
-        This method displays the conversation between the user and the bot, using HTML for formatting.
+        Only a window of recent messages is rendered, as a single HTML element built from cached per-message
+        fragments; older messages are loaded on demand with a button at the top of the container.
         """
         with st.container(height=400, border=True):
             chat_placeholder = st.container()
             with chat_placeholder:
-                if "history" in st.session_state:
-                    for chat in st.session_state.history:
-                        div = f"""
-        <div class="chat-row 
-            {'' if chat.origin == 'ai' else 'row-reverse'}">
-            <img class="chat-icon" src="app/static/{
-                '/mlcv2/WorkingSpace/Personal/longlb/chatbot/Chatbot_AI_model/static/chatbot.png' if chat.origin == 'ai' 
-                            else '/mlcv2/WorkingSpace/Personal/longlb/chatbot/Chatbot_AI_model/static/user_icon.png'}"
-                width=32 height=32>
-            <div class="chat-bubble
-            {'ai-bubble' if chat.origin == 'ai' else 'human-bubble'}">
-                &#8203;{chat.message}
-            </div>
-        </div>
-                        """
-                        st.markdown(div, unsafe_allow_html=True)
+                start, html = self.history_window()
+                if start > 0:
+                    st.button(f"Xem {start} tin nhắn cũ hơn", key="load_older", on_click=self.load_older_messages)
+                st.markdown(html, unsafe_allow_html=True)
+                self.render_pending_response()
+
+    def render_pending_response(self):
+        """
+        Streams the answer to the pending prompt into the chat history.
+
+        The AI bubble is rendered into a placeholder and refreshed with every chunk yielded by
+        ChatBot.stream_response, so the user sees the answer as soon as the first token is decoded. The prompt
+        is built from the session's in-memory tail of the conversation store; both messages are appended to
+        the store.
+        """
+        instruction = st.session_state.get("pending_prompt")
+        if not instruction:
+            return
+        st.session_state.pending_prompt = None
+        session_id = st.session_state.session_id
+        history = self.store.recent(session_id, self.store.tail_size)
+        human = Message("human", instruction)
+        self.store.append(session_id, human.origin, human.message)
+        st.markdown(self.message_html(human), unsafe_allow_html=True)
+
+        bubble = st.empty()
+        response = ""
+        stream = st.session_state.bot.stream_response(instruction, history=history, session_id=session_id)
+        try:
+            for chunk in stream:
+                response += chunk
+                bubble.markdown(self.message_html(Message("ai", response + "▌"), cache=False), unsafe_allow_html=True)
+        except GenerationCancelled:
+            # A newer message replaced this one; its partial answer is not kept.
+            bubble.empty()
+            return
+        finally:
+            # Streamlit stops this run when the user sends another message or leaves; the generation stops with it.
+            stream.close()
+        ai = Message("ai", response.strip())
+        bubble.markdown(self.message_html(ai), unsafe_allow_html=True)
+        self.store.append(session_id, ai.origin, ai.message)
 
     def render_chat_input(self):
         """
@@ -166,10 +360,6 @@ class ChatApp:
                 "", on_click=self.on_click_callback
             )
 
-            if human_prompt:
-                self.on_click_callback()
-                
-
     def render_credit(self):
         """
         Displays the author's credit.
@@ -184,15 +374,12 @@ class ChatApp:
         Runs the chat application.
         
         This method orchestrates the rendering of the sidebar, chat history, chat input form, and the author's credit.
+        The sidebar and title are drawn before the chatbot is loaded.
         """
         self.render_sidebar()
-        st.markdown("""<div style="display: flex; justify-content: center; align-items: center;">
-                        <h1 style="margin-left: 10px;font-family: "Libre Baskerville", serif;font-weight: 400">Leomine</h1>
-                        <div style="border: 2px solid black; border-radius: 10px; padding: 5px;">
-                            <img src="https://i.pinimg.com/474x/03/cd/45/03cd45a61a83b2aa86e7231cc01b44eb.jpg" width="75" height="75">
-                    </div>
-                    </div>""", unsafe_allow_html=True)
+        st.markdown(PAGE_HEADER, unsafe_allow_html=True)
         st.markdown("")
+        self.load_bot()
         self.render_chat_history()
         st.markdown("")
         self.render_chat_input()
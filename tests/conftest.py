@@ -0,0 +1,15 @@
+import pytest
+import torch
+
+from benchmark.tiny_model import build_tiny_model, build_tiny_tokenizer
+
+
+@pytest.fixture(scope="session")
+def tokenizer():
+    return build_tiny_tokenizer()
+
+
+@pytest.fixture(scope="session")
+def model(tokenizer):
+    torch.manual_seed(0)
+    return build_tiny_model(tokenizer)
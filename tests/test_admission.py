@@ -0,0 +1,107 @@
+from collections import deque
+from types import SimpleNamespace
+
+import pytest
+
+from admission import AdmissionController, AdmissionError, is_out_of_memory, kv_bytes_per_token
+from engine import SamplingParams
+
+
+def make_controller(model, tokens=None, **kwargs):
+    # ``tokens`` is the budget in key/value cache positions, on top of the prefill of a short prompt.
+    controller = AdmissionController(model.config, model.dtype, "cpu", **kwargs)
+    if tokens is not None:
+        controller.budget = controller.configured_budget = controller.prefill_bytes(1, 10) + tokens * controller.per_token
+    return controller
+
+
+def request(prompt_tokens, max_new_tokens):
+    return SimpleNamespace(prompt_ids=[0] * prompt_tokens, params=SamplingParams(max_new_tokens=max_new_tokens))
+
+
+def test_kv_bytes_per_token(model):
+    config = model.config
+    head_dim = config.hidden_size // config.num_attention_heads
+    assert kv_bytes_per_token(config, model.dtype) == 2 * config.num_hidden_layers * config.num_attention_heads * head_dim * 4
+
+
+def test_check_keeps_fitting_requests(model):
+    controller = make_controller(model, tokens=200)
+    params = SamplingParams(max_new_tokens=100)
+    assert controller.check(10, params) is params
+    assert make_controller(model).check(10_000, params) is params
+
+
+def test_check_shortens_or_rejects_large_requests(model):
+    controller = make_controller(model, tokens=200)
+    shortened = controller.check(10, SamplingParams(max_new_tokens=1000))
+    assert shortened.max_new_tokens == 190
+    with pytest.raises(AdmissionError):
+        controller.check(180, SamplingParams(max_new_tokens=1000))
+    assert (controller.degraded, controller.rejected) == (1, 1)
+
+
+def test_check_rejects_when_too_many_requests_wait(model):
+    controller = make_controller(model, max_waiting=2)
+    with pytest.raises(AdmissionError):
+        controller.check(10, SamplingParams(), waiting=2)
+
+
+def test_admit_everything_without_a_budget(model):
+    controller = make_controller(model)
+    waiting = deque(request(10, 100) for _ in range(5))
+    admitted, rejected = controller.admit([], waiting, 3)
+    assert len(admitted) == 3 and not rejected and len(waiting) == 2
+
+
+def test_admit_pads_rows_to_the_longest_request(model):
+    # Three requests of 60 positions fit; with a longer one every row takes its length.
+    controller = make_controller(model, degrade=False)
+    controller.budget = controller.prefill_bytes(3, 10) + 3 * 60 * controller.per_token
+    waiting = deque([request(10, 50), request(10, 50), request(10, 50), request(10, 50)])
+    admitted, _ = controller.admit([], waiting, 8)
+    assert len(admitted) == 3 and len(waiting) == 1
+    running = admitted
+    waiting = deque([request(10, 190)])
+    admitted, rejected = controller.admit(running[:1], waiting, 8)
+    assert admitted == [] and rejected == [] and controller.blocked == 2
+
+
+def test_admit_degrades_the_head_of_the_queue(model):
+    controller = make_controller(model, tokens=200, min_new_tokens=20)
+    running = [request(10, 50)]
+    head = request(10, 500)
+    admitted, _ = controller.admit(running, deque([head]), 8)
+    assert admitted == [head]
+    assert head.params.max_new_tokens == 90 and controller.degraded == 1
+
+
+def test_admit_rejects_what_never_fits(model):
+    controller = make_controller(model, tokens=200, degrade=False)
+    waiting = deque([request(150, 100), request(10, 10)])
+    admitted, rejected = controller.admit([], waiting, 8)
+    assert len(rejected) == 1 and len(admitted) == 1 and not waiting
+
+
+def test_padded_shapes(model):
+    controller = make_controller(model, batch_buckets=(1, 2, 4), length_buckets=(64, 128))
+    assert controller.cache_bytes(3, 70) == 4 * 128 * controller.per_token
+    assert controller.cache_bytes(1, 300) == 300 * controller.per_token
+
+
+def test_out_of_memory_lowers_batch_size_and_budget(model):
+    controller = make_controller(model, tokens=1000, recovery_steps=2)
+    engine = SimpleNamespace(max_batch_size=8, running=[request(10, 90) for _ in range(4)])
+    controller.after_step(engine)
+    controller.on_out_of_memory(engine)
+    assert engine.max_batch_size == 2
+    assert controller.budget == int(0.9 * 4 * 100 * controller.per_token)
+    for _ in range(20):
+        controller.after_step(engine)
+    assert engine.max_batch_size == 8 and controller.budget == controller.configured_budget
+
+
+def test_is_out_of_memory():
+    assert is_out_of_memory(MemoryError())
+    assert is_out_of_memory(RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB"))
+    assert not is_out_of_memory(ValueError("bad input"))
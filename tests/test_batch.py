@@ -0,0 +1,39 @@
+import json
+
+from batch import read_done
+
+
+def write_lines(path, lines, tail=b""):
+    with open(path, "wb") as f:
+        for line in lines:
+            f.write(json.dumps(line).encode("utf-8") + b"\n")
+        f.write(tail)
+
+
+def test_missing_output_file(tmp_path):
+    assert read_done(str(tmp_path / "answers.jsonl")) == set()
+
+
+def test_complete_lines_are_kept(tmp_path):
+    path = tmp_path / "answers.jsonl"
+    write_lines(path, [{"id": 1, "answer": "a"}, {"id": "q2", "answer": "b"}])
+    size = path.stat().st_size
+    assert read_done(str(path)) == {1, "q2"}
+    assert path.stat().st_size == size
+
+
+def test_cut_last_line_is_removed(tmp_path):
+    path = tmp_path / "answers.jsonl"
+    write_lines(path, [{"id": 1, "answer": "a"}], tail=b'{"id": 2, "ans')
+    assert read_done(str(path)) == {1}
+    assert path.read_bytes() == json.dumps({"id": 1, "answer": "a"}).encode("utf-8") + b"\n"
+
+
+def test_unterminated_last_line_is_removed(tmp_path):
+    # A whole JSON object without its newline was still cut short; the next run appends after it.
+    path = tmp_path / "answers.jsonl"
+    write_lines(path, [{"id": 1, "answer": "a"}], tail=json.dumps({"id": 2, "answer": "b"}).encode("utf-8"))
+    assert read_done(str(path)) == {1}
+    with open(path, "ab") as f:
+        f.write(json.dumps({"id": 2, "answer": "b"}).encode("utf-8") + b"\n")
+    assert read_done(str(path)) == {1, 2}
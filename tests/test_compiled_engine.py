@@ -0,0 +1,53 @@
+import warnings
+
+import pytest
+
+from compiled_engine import CompiledEngine, _bucket, _buckets
+from engine import InferenceEngine, SamplingParams
+
+QUESTIONS = [
+    "### Câu hỏi: xin chào\n### Trả lời:",
+    "### Câu hỏi: Thủ đô của Việt Nam là gì?\n### Trả lời:",
+    "### Câu hỏi: Hãy giới thiệu về lịch sử của thành phố Hồ Chí Minh.\n### Trả lời:",
+]
+GREEDY = SamplingParams(do_sample=False, max_new_tokens=40, ignore_eos=True)
+
+
+def generate(engine, tokenizer):
+    requests = [engine.submit(tokenizer.encode(question), GREEDY) for question in QUESTIONS]
+    engine.run_until_complete()
+    return [request.wait() for request in requests]
+
+
+@pytest.fixture
+def bucketed(model, tokenizer):
+    # The decode step runs the eager model on the bucketed shapes, as it would once compiled.
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        engine = CompiledEngine(model, "cpu", tokenizer.eos_token_id, tokenizer.pad_token_id, max_batch_size=4,
+                                max_length=128, min_bucket=16)
+    engine.compiled = True
+    engine._decode_model = model
+    return engine
+
+
+def test_buckets():
+    assert _buckets(16, 128) == (16, 32, 64, 128)
+    assert _buckets(1, 6) == (1, 2, 4, 6)
+    assert _bucket((16, 32), 17) == 32
+    assert _bucket((16, 32), 33) is None
+
+
+def test_bucketed_decode_equals_eager_decode(model, tokenizer, bucketed):
+    eager = InferenceEngine(model, "cpu", tokenizer.eos_token_id, tokenizer.pad_token_id, max_batch_size=4)
+    assert generate(bucketed, tokenizer) == generate(eager, tokenizer)
+    stats = bucketed.stats()
+    # Three requests run in the batch bucket of four; the caches pass through several length buckets.
+    assert any(key.startswith("4x") for key in stats["buckets"])
+    assert len({key.split("x")[1] for key in stats["buckets"]}) > 1
+
+
+def test_requests_joining_a_bucketed_batch(model, tokenizer, bucketed):
+    eager = InferenceEngine(model, "cpu", tokenizer.eos_token_id, tokenizer.pad_token_id, max_batch_size=2)
+    bucketed.max_batch_size = 2
+    assert generate(bucketed, tokenizer) == generate(eager, tokenizer)
@@ -0,0 +1,82 @@
+import threading
+
+from conversation_context import ConversationContext
+
+HISTORY = "### Câu hỏi: {instruction}\n### Trả lời: {response}\n"
+PROMPT = "### Câu hỏi: {instruction}\n### Trả lời:"
+
+
+class Summarizer:
+    # Records the turns it is given and returns their questions as the summary.
+
+    def __init__(self):
+        self.calls = []
+        self.done = threading.Event()
+
+    def __call__(self, summary, turns, max_tokens):
+        self.calls.append((summary, list(turns)))
+        self.done.set()
+        return " ".join(([summary] if summary else []) + [question for question, _ in turns])
+
+
+def make_turns(count, words=12):
+    return [(f"câu {number}", " ".join(["xin chào"] * words)) for number in range(count)]
+
+
+def make_context(tokenizer, max_tokens, summarizer=None):
+    return ConversationContext(tokenizer, HISTORY, PROMPT, max_tokens, summarizer=summarizer)
+
+
+def wait_for_summaries(context):
+    # The summaries run on the context's single background thread.
+    context._executor.submit(lambda: None).result(10)
+
+
+def test_prompt_fits_the_budget(tokenizer):
+    context = make_context(tokenizer, 256)
+    turns = make_turns(2)
+    input_ids, dropped = context.build("mới", turns)
+    assert dropped == 0
+    text = "".join(HISTORY.format(instruction=q, response=a) for q, a in turns) + PROMPT.format(instruction="mới")
+    assert tokenizer.decode(input_ids) == tokenizer.decode(tokenizer(text)["input_ids"])
+
+
+def test_oldest_turns_are_dropped_down_to_the_low_water_mark(tokenizer):
+    context = make_context(tokenizer, 256)
+    turns = make_turns(20)
+    input_ids, dropped = context.build("mới", turns)
+    assert len(input_ids) <= 256
+    assert 0 < dropped < 20
+    assert len(input_ids) <= 256 * 0.5 + context.count(PROMPT.format(instruction="mới")) + 1
+
+
+def test_start_of_the_prompt_is_stable_between_trims(tokenizer):
+    context = make_context(tokenizer, 256)
+    turns = make_turns(20)
+    first, dropped = context.build("mới", turns, session_id="s")
+    second, dropped_again = context.build("tiếp", turns + make_turns(1), session_id="s")
+    assert dropped_again == dropped
+    kept = len(first) - context.count(PROMPT.format(instruction="mới"))
+    assert second[:kept] == first[:kept]
+
+
+def test_every_dropped_turn_reaches_the_summary(tokenizer):
+    summarizer = Summarizer()
+    context = make_context(tokenizer, 128, summarizer)
+    turns = make_turns(30)
+    _, dropped = context.build("mới", turns, session_id="s")
+    wait_for_summaries(context)
+    summarized = [question for _, chunk in summarizer.calls for question, _ in chunk]
+    assert summarized == [question for question, _ in turns[:dropped]]
+    assert len(summarizer.calls) > 1
+    assert context.summary("s") == " ".join(summarized)
+
+
+def test_summary_is_put_in_front_of_the_kept_turns(tokenizer):
+    context = make_context(tokenizer, 256, lambda summary, turns, max_tokens: "chào hỏi")
+    turns = make_turns(20)
+    context.build("mới", turns, session_id="s")
+    wait_for_summaries(context)
+    input_ids, _ = context.build("mới", turns, session_id="s")
+    assert len(input_ids) <= 256
+    assert tokenizer.decode(input_ids).startswith("### Tóm tắt: chào hỏi\n### Câu hỏi:")
@@ -0,0 +1,63 @@
+import pytest
+
+from conversation_store import ConversationStore
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "conversations.sqlite")
+
+
+def fill(store, session_id, count):
+    for seq in range(count):
+        store.append(session_id, "human" if seq % 2 == 0 else "ai", f"{session_id}-{seq}")
+
+
+def messages(turns):
+    return [turn.message for turn in turns]
+
+
+def test_recent_reads_older_messages_from_disk(path):
+    store = ConversationStore(path, tail_size=4)
+    fill(store, "s", 10)
+    assert store.count("s") == 10
+    assert messages(store.recent("s", 3)) == ["s-7", "s-8", "s-9"]
+    # More than the in-memory tail: the older messages come from disk.
+    assert messages(store.recent("s", 6)) == [f"s-{seq}" for seq in range(4, 10)]
+    assert messages(store.recent("s", 50)) == [f"s-{seq}" for seq in range(10)]
+    assert store.stats()["messages_in_memory"] == 4
+    store.close()
+
+
+def test_pages_walk_back_across_the_tail_and_disk(path):
+    store = ConversationStore(path, tail_size=4)
+    fill(store, "s", 10)
+    assert messages(store.page("s", 10, 2)) == ["s-8", "s-9"]
+    assert messages(store.page("s", 8, 4)) == [f"s-{seq}" for seq in range(4, 8)]
+    assert messages(store.page("s", 4, 4)) == [f"s-{seq}" for seq in range(4)]
+    assert store.page("s", 0, 4) == []
+    assert [turn.seq for turn in store.page("s", 7, 3)] == [4, 5, 6]
+    store.close()
+
+
+def test_evicted_sessions_are_paged_back_in(path):
+    store = ConversationStore(path, tail_size=4, max_sessions=1)
+    fill(store, "a", 6)
+    fill(store, "b", 2)
+    assert store.stats()["sessions_in_memory"] == 1
+    assert store.count("a") == 6 and messages(store.recent("a", 2)) == ["a-4", "a-5"]
+    store.append("a", "human", "a-6")
+    assert [turn.seq for turn in store.recent("a", 2)] == [5, 6]
+    store.close()
+
+
+def test_conversations_survive_a_restart(path):
+    store = ConversationStore(path, flush_interval=60)
+    fill(store, "s", 5)
+    store.close()
+    store = ConversationStore(path)
+    assert store.count("s") == 5
+    assert [(turn.origin, turn.message) for turn in store.recent("s", 2)] == [("ai", "s-3"), ("human", "s-4")]
+    store.delete("s")
+    assert store.count("s") == 0 and store.recent("s", 5) == []
+    store.close()
@@ -0,0 +1,50 @@
+import time
+
+import pytest
+
+from document_index import DocumentIndex
+
+
+@pytest.fixture
+def documents(tmp_path):
+    folder = tmp_path / "docs"
+    folder.mkdir()
+    (folder / "hanoi.txt").write_text("Hà Nội là thủ đô của Việt Nam, nổi tiếng với Hồ Gươm.", encoding="utf-8")
+    (folder / "hue.md").write_text("Huế là cố đô của triều Nguyễn, bên dòng sông Hương.", encoding="utf-8")
+    return folder
+
+
+def test_build_and_search(tmp_path, documents):
+    index = DocumentIndex(str(tmp_path / "index"))
+    assert index.version is None and index.search("Hà Nội") == []
+    counts = index.build([str(documents)])
+    assert counts["added"] == 2 and counts["passages"] == 2
+    best = index.search("thủ đô Hà Nội", k=1)
+    assert best[0].source.endswith("hanoi.txt")
+
+
+def test_rebuild_only_reads_changed_documents(tmp_path, documents):
+    index = DocumentIndex(str(tmp_path / "index"))
+    index.build([str(documents)])
+    first = index.version
+
+    counts = index.build([str(documents)])
+    assert counts["unchanged"] == 2 and counts["added"] == counts["updated"] == counts["removed"] == 0
+
+    (documents / "hue.md").write_text("Đà Lạt là thành phố ngàn hoa trên cao nguyên Lâm Viên.", encoding="utf-8")
+    (documents / "hanoi.txt").unlink()
+    (documents / "saigon.txt").write_text("Sài Gòn là thành phố lớn nhất miền Nam.", encoding="utf-8")
+    counts = index.build([str(documents)])
+    assert (counts["added"], counts["updated"], counts["removed"], counts["unchanged"]) == (1, 1, 1, 0)
+    assert index.version != first
+    assert index.size == 2
+    assert index.search("Hồ Gươm") == []
+    assert index.search("Đà Lạt", k=1)[0].source.endswith("hue.md")
+
+
+def test_open_index_picks_up_a_rebuild(tmp_path, documents):
+    reader = DocumentIndex(str(tmp_path / "index"))
+    DocumentIndex(str(tmp_path / "index")).build([str(documents)])
+    # An open index rereads the CURRENT pointer at most every 100 ms.
+    time.sleep(0.15)
+    assert reader.search("sông Hương", k=1)[0].source.endswith("hue.md")
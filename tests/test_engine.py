@@ -0,0 +1,63 @@
+import pytest
+import torch
+
+from engine import InferenceEngine, SamplingParams
+
+QUESTIONS = [
+    "### Câu hỏi: Thủ đô của Việt Nam là gì?\n### Trả lời:",
+    "### Câu hỏi: xin chào\n### Trả lời:",
+    "### Câu hỏi: Hãy giới thiệu về lịch sử của thành phố Hồ Chí Minh.\n### Trả lời:",
+    "### Câu hỏi: 2 + 2 bằng mấy?\n### Trả lời:",
+    "### Câu hỏi: Kể một câu chuyện ngắn.\n### Trả lời:",
+]
+GREEDY = SamplingParams(do_sample=False, max_new_tokens=16, ignore_eos=True)
+
+
+def make_engine(model, tokenizer, max_batch_size):
+    return InferenceEngine(model, "cpu", tokenizer.eos_token_id, tokenizer.pad_token_id, max_batch_size=max_batch_size)
+
+
+def generate_sequentially(model, tokenizer):
+    engine = make_engine(model, tokenizer, 1)
+    outputs = []
+    for question in QUESTIONS:
+        request = engine.submit(tokenizer.encode(question), GREEDY)
+        engine.run_until_complete()
+        outputs.append(request.wait())
+    return outputs
+
+
+@pytest.mark.parametrize("max_batch_size", [2, 8])
+def test_batched_output_equals_sequential_output(model, tokenizer, max_batch_size):
+    # With two slots, requests join the batch while others are still decoding.
+    engine = make_engine(model, tokenizer, max_batch_size)
+    requests = [engine.submit(tokenizer.encode(question), GREEDY) for question in QUESTIONS]
+    engine.run_until_complete()
+    assert [request.wait() for request in requests] == generate_sequentially(model, tokenizer)
+
+
+def test_engine_output_equals_generate(model, tokenizer):
+    engine = make_engine(model, tokenizer, 4)
+    params = SamplingParams(do_sample=False, max_new_tokens=16)
+    requests = [engine.submit(tokenizer.encode(question), params) for question in QUESTIONS]
+    engine.run_until_complete()
+    for question, request in zip(QUESTIONS, requests):
+        input_ids = torch.tensor([tokenizer.encode(question)])
+        expected = model.generate(
+            input_ids, attention_mask=torch.ones_like(input_ids), do_sample=False, max_new_tokens=params.max_new_tokens,
+            eos_token_id=tokenizer.eos_token_id, pad_token_id=tokenizer.pad_token_id,
+        )[0, input_ids.shape[1]:].tolist()
+        # The engine does not return the end-of-sequence token.
+        if tokenizer.eos_token_id in expected:
+            expected = expected[:expected.index(tokenizer.eos_token_id)]
+        assert request.wait() == expected
+
+
+def test_finished_requests_leave_the_batch(model, tokenizer):
+    engine = make_engine(model, tokenizer, 4)
+    short = engine.submit(tokenizer.encode(QUESTIONS[0]), SamplingParams(do_sample=False, max_new_tokens=3, ignore_eos=True))
+    long = engine.submit(tokenizer.encode(QUESTIONS[1]), GREEDY)
+    engine.run_until_complete()
+    assert len(short.wait()) == 3 and short.finish_reason == "length"
+    assert len(long.wait()) == GREEDY.max_new_tokens
+    assert not engine.running and not engine.waiting
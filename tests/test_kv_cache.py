@@ -0,0 +1,53 @@
+import pytest
+import torch
+
+from kv_cache import CacheLayout
+
+
+@pytest.fixture(scope="module")
+def layout(model):
+    return CacheLayout.detect(model, "cpu")
+
+
+def prefill(model, token_ids):
+    input_ids = torch.tensor([token_ids])
+    return model(input_ids=input_ids, use_cache=True).past_key_values
+
+
+def assert_same_cache(first, second):
+    for (first_key, first_value), (second_key, second_value) in zip(first, second):
+        torch.testing.assert_close(first_key, second_key)
+        torch.testing.assert_close(first_value, second_value)
+
+
+def test_pad_left_then_trim_left_restores_the_cache(model, layout):
+    cache = prefill(model, [5, 6, 7, 8])
+    padded = layout.pad_left(cache, 3)
+    assert layout.length(padded) == 7
+    assert_same_cache(layout.trim_left(padded, 3), cache)
+    assert_same_cache(layout.trim_left(padded, 3, copy=False), cache)
+
+
+def test_pad_left_adds_zero_positions(model, layout):
+    padded = layout.pad_left(prefill(model, [5, 6]), 2)
+    for layer, dims in zip(padded, layout.seq_dims):
+        for tensor, dim in zip(layer, dims):
+            assert not tensor.narrow(dim, 0, 2).any()
+
+
+def test_truncate_matches_the_cache_of_the_prefix(model, layout):
+    cache = prefill(model, [5, 6, 7, 8, 9])
+    truncated = layout.truncate(cache, 3)
+    assert layout.length(truncated) == 3
+    assert_same_cache(truncated, prefill(model, [5, 6, 7]))
+
+
+def test_padded_cache_gives_the_same_next_token(model, layout):
+    cache = prefill(model, [5, 6, 7])
+    token = torch.tensor([[8]])
+    expected = model(input_ids=token, past_key_values=cache, use_cache=True).logits
+    attention_mask = torch.tensor([[0, 0, 1, 1, 1, 1]])
+    position_ids = torch.tensor([[3]])
+    logits = model(input_ids=token, attention_mask=attention_mask, position_ids=position_ids,
+                   past_key_values=layout.pad_left(cache, 2), use_cache=True).logits
+    torch.testing.assert_close(logits, expected)
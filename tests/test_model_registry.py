@@ -0,0 +1,102 @@
+import gc
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+from model_registry import ModelRegistry
+
+
+class Loader:
+    # Builds stand-in chatbots and counts how often a model is loaded and stopped.
+
+    def __init__(self, seconds=0.0):
+        self.seconds = seconds
+        self.loads = 0
+        self.stops = 0
+
+    def __call__(self, model_path, *args):
+        self.loads += 1
+        time.sleep(self.seconds)
+        return SimpleNamespace(
+            model_path=model_path, device="cpu", engine=SimpleNamespace(stop=self.stop),
+            generate_response=lambda instruction: f"{model_path}: {instruction}",
+        )
+
+    def stop(self):
+        self.stops += 1
+
+
+def acquire(registry, model_path="tiny"):
+    return registry.acquire(model_path, device="cpu", torch_dtype=torch.float32)
+
+
+def entry(registry):
+    (entry,) = registry._entries.values()
+    return entry
+
+
+def test_handles_share_one_load_and_count_references():
+    loader = Loader()
+    registry = ModelRegistry(idle_timeout=None, loader=loader)
+    first, second = acquire(registry), acquire(registry)
+    assert first.bot is second.bot and loader.loads == 1 and entry(registry).refcount == 2
+    # Attribute access is forwarded to the shared chatbot.
+    assert first.generate_response("xin chào") == "tiny: xin chào"
+    first.release()
+    first.release()
+    assert entry(registry).refcount == 1
+    with pytest.raises(RuntimeError):
+        first.bot
+
+
+def test_model_is_only_unloaded_without_handles():
+    loader = Loader()
+    registry = ModelRegistry(idle_timeout=None, loader=loader)
+    handle = acquire(registry)
+    assert not registry.unload("tiny", device="cpu", torch_dtype=torch.float32)
+    handle.release()
+    assert registry.unload("tiny", device="cpu", torch_dtype=torch.float32)
+    assert entry(registry).bot is None and loader.stops == 1
+    with acquire(registry) as handle:
+        assert handle.model_path == "tiny"
+    assert loader.loads == 2 and entry(registry).loads == 2 and entry(registry).refcount == 0
+
+
+def test_collected_handle_releases_its_reference():
+    registry = ModelRegistry(idle_timeout=None, loader=Loader())
+    handle = acquire(registry)
+    assert entry(registry).refcount == 1
+    del handle
+    gc.collect()
+    assert entry(registry).refcount == 0
+
+
+def test_idle_model_is_unloaded_after_the_timeout():
+    loader = Loader()
+    registry = ModelRegistry(idle_timeout=0.05, loader=loader)
+    acquire(registry).release()
+    # Acquiring again before the timeout cancels the unload.
+    handle = acquire(registry)
+    time.sleep(0.1)
+    assert entry(registry).bot is not None and loader.loads == 1
+    handle.release()
+    deadline = time.monotonic() + 5
+    while entry(registry).bot is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert entry(registry).bot is None and loader.stops == 1
+
+
+def test_concurrent_acquires_wait_for_a_single_load():
+    loader = Loader(seconds=0.1)
+    registry = ModelRegistry(idle_timeout=None, loader=loader)
+    handles = []
+    threads = [threading.Thread(target=lambda: handles.append(acquire(registry))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert loader.loads == 1 and len({id(handle.bot) for handle in handles}) == 1
+    assert entry(registry).refcount == 8
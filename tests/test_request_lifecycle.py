@@ -0,0 +1,137 @@
+import threading
+import time
+
+import pytest
+
+from engine import SamplingParams
+from request_lifecycle import GenerationCancelled, RequestLifecycle
+
+
+class Source:
+    # A chunk iterator that yields when released and records whether it was closed.
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.ready = threading.Semaphore(0)
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.chunks:
+            raise StopIteration
+        self.ready.acquire()
+        return self.chunks.pop(0)
+
+    def close(self):
+        self.closed = True
+
+    def release(self, count=1):
+        for _ in range(count):
+            self.ready.release()
+
+
+def test_identical_shared_requests_run_once():
+    lifecycle = RequestLifecycle()
+    source = Source(["a", "b"])
+    first = lifecycle.stream("key", lambda: source, "s1", shared=True)
+    second = lifecycle.stream("key", lambda: pytest.fail("a second flight was started"), "s2", shared=True)
+    source.release(2)
+    assert list(first) == ["a", "b"]
+    assert list(second) == ["a", "b"]
+    assert (lifecycle.started, lifecycle.shared) == (1, 1)
+
+
+def test_unshared_requests_run_separately():
+    lifecycle = RequestLifecycle()
+    sources = [Source(["a"]), Source(["b"])]
+    first = lifecycle.stream("key", lambda: sources[0], "s1")
+    second = lifecycle.stream("key", lambda: sources[1], "s2")
+    for source in sources:
+        source.release()
+    assert (list(first), list(second)) == (["a"], ["b"])
+    assert lifecycle.started == 2
+
+
+def test_double_submit_joins_the_running_flight():
+    lifecycle = RequestLifecycle()
+    source = Source(["a", "b"])
+    first = lifecycle.stream("key", lambda: source, "s1")
+    source.release()
+    assert next(first) == "a"
+    again = lifecycle.stream("key", lambda: pytest.fail("a second flight was started"), "s1")
+    source.release()
+    assert list(again) == ["a", "b"]
+    assert lifecycle.deduplicated == 1
+
+
+def test_cancel_raises_and_closes_the_source():
+    lifecycle = RequestLifecycle()
+    source = Source(["a", "b", "c"])
+    stream = lifecycle.stream("key", lambda: source, "s1")
+    source.release()
+    assert next(stream) == "a"
+    assert lifecycle.cancel("s1")
+    with pytest.raises(GenerationCancelled):
+        next(stream)
+    assert source.closed
+    assert not lifecycle.cancel("s1")
+
+
+def test_new_question_cancels_the_previous_one():
+    lifecycle = RequestLifecycle()
+    old, new = Source(["a", "b"]), Source(["x"])
+    previous = lifecycle.stream("old", lambda: old, "s1")
+    old.release()
+    assert next(previous) == "a"
+    current = lifecycle.stream("new", lambda: new, "s1")
+    with pytest.raises(GenerationCancelled):
+        next(previous)
+    new.release()
+    assert list(current) == ["x"]
+    assert old.closed and lifecycle.cancelled == 1
+
+
+def test_shared_flight_survives_one_subscriber_leaving():
+    lifecycle = RequestLifecycle()
+    source = Source(["a", "b"])
+    first = lifecycle.stream("key", lambda: source, "s1", shared=True)
+    second = lifecycle.stream("key", lambda: source, "s2", shared=True)
+    source.release()
+    assert next(first) == "a"
+    first.close()
+    source.release()
+    assert list(second) == ["a", "b"]
+    assert not source.closed
+
+
+def test_chatbot_cancel_raises_instead_of_returning_a_partial_answer(model, tokenizer):
+    from chatbot import ChatBot
+
+    bot = ChatBot.from_model(model, tokenizer, max_batch_size=2)
+    try:
+        result = {}
+
+        def ask():
+            try:
+                result["answer"] = bot.generate_response(
+                    "xin chào", SamplingParams(do_sample=True, max_new_tokens=5000, ignore_eos=True), session_id="s1"
+                )
+            except GenerationCancelled as error:
+                result["error"] = error
+
+        thread = threading.Thread(target=ask)
+        thread.start()
+        while not bot.engine.running:
+            time.sleep(0.01)
+        assert bot.cancel("s1")
+        thread.join(30)
+        assert "answer" not in result and isinstance(result["error"], GenerationCancelled)
+        # The engine drops the cancelled request at its next step.
+        deadline = time.monotonic() + 10
+        while (bot.engine.running or bot.engine.waiting) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert not bot.engine.running and not bot.engine.waiting
+    finally:
+        bot.engine.stop()
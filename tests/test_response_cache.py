@@ -0,0 +1,82 @@
+import time
+import unicodedata
+
+import pytest
+
+from engine import SamplingParams
+from response_cache import ResponseCache
+
+GREEDY = SamplingParams(do_sample=False)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
+
+
+def test_spelling_variants_share_an_entry():
+    cache = ResponseCache()
+    cache.put("Thủ đô  của Việt Nam? ", GREEDY, "Hà Nội", 2.0)
+    # Decomposed Unicode, other case and extra spaces normalize to the same question.
+    assert cache.get("THỦ đô của Việt Nam?", GREEDY) == "Hà Nội"
+    assert cache.get("Thủ đô của Lào?", GREEDY) is None
+    assert cache.stats()["memory_hits"] == 1 and cache.stats()["misses"] == 1 and cache.seconds_saved == 2.0
+
+
+def test_sampled_answers_are_only_cached_when_marked_cacheable():
+    cache = ResponseCache()
+    sampled = SamplingParams(do_sample=True)
+    cache.put("a", sampled, "x", 1.0)
+    assert cache.get("a", sampled) is None
+    marked = SamplingParams(do_sample=True, cacheable=True)
+    cache.put("a", marked, "x", 1.0)
+    assert cache.get("a", marked) == "x"
+
+
+def test_memory_tier_evicts_the_least_recently_used_entry():
+    cache = ResponseCache(max_memory_entries=2)
+    cache.put("a", GREEDY, "1", 1.0)
+    cache.put("b", GREEDY, "2", 1.0)
+    cache.get("a", GREEDY)
+    cache.put("c", GREEDY, "3", 1.0)
+    assert cache.get("b", GREEDY) is None
+    assert cache.get("a", GREEDY) == "1" and cache.get("c", GREEDY) == "3"
+
+
+def test_entries_expire_after_the_ttl(clock, tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"), ttl=60)
+    cache.put("a", GREEDY, "1", 1.0)
+    clock[0] += 59
+    assert cache.get("a", GREEDY) == "1"
+    clock[0] += 2
+    assert cache.get("a", GREEDY) is None
+    assert cache.stats()["memory_entries"] == 0
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    path = str(tmp_path / "responses.sqlite3")
+    ResponseCache(path, namespace="model-a").put("a", GREEDY, "1", 3.0)
+    cache = ResponseCache(path, namespace="model-a")
+    assert cache.get("a", GREEDY) == "1"
+    assert cache.stats()["disk_hits"] == 1
+    # The second lookup is served from memory.
+    assert cache.get("a", GREEDY) == "1" and cache.stats()["memory_hits"] == 1
+    # Answers of another model in the same file are never returned.
+    assert ResponseCache(path, namespace="model-b").get("a", GREEDY) is None
+
+
+def test_disk_tier_keeps_the_most_recently_used_entries(clock, tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"), max_memory_entries=1, max_disk_entries=2)
+    for question in "abc":
+        clock[0] += 1
+        cache.put(question, GREEDY, question.upper(), 1.0)
+    assert cache.stats()["disk_entries"] == 2
+    assert cache.get("a", GREEDY) is None and cache.get("b", GREEDY) == "B"
+
+
+def test_disabled_cache_neither_stores_nor_returns():
+    cache = ResponseCache(enabled=False)
+    cache.put("a", GREEDY, "1", 1.0)
+    assert cache.get("a", GREEDY) is None and cache.stats()["memory_entries"] == 0
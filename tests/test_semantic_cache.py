@@ -0,0 +1,55 @@
+import numpy as np
+
+from engine import SamplingParams
+from semantic_cache import SemanticCache, calibrate_threshold
+
+GREEDY = SamplingParams(do_sample=False)
+
+# Hand-made embeddings: the two capital questions are paraphrases (cosine 0.98), the weather one is not.
+VECTORS = {
+    "thủ đô của việt nam là gì?": [1.0, 0.0, 0.0],
+    "thủ đô việt nam là thành phố nào?": [0.98, 0.199, 0.0],
+    "hôm nay trời có mưa không?": [0.6, 0.0, 0.8],
+}
+
+
+def embed(question):
+    return np.asarray(VECTORS[question], dtype=np.float32)
+
+
+def test_paraphrase_above_the_threshold_is_a_hit(tmp_path):
+    cache = SemanticCache(embed, str(tmp_path), threshold=0.95)
+    cache.put("Thủ đô của Việt Nam là gì?", GREEDY, "Hà Nội")
+    assert cache.get("Thủ đô Việt Nam là thành phố nào?", GREEDY) == "Hà Nội"
+    assert cache.hits == 1 and cache.last_similarity > 0.95
+
+
+def test_question_below_the_threshold_is_a_miss(tmp_path):
+    cache = SemanticCache(embed, str(tmp_path), threshold=0.95)
+    cache.put("Thủ đô của Việt Nam là gì?", GREEDY, "Hà Nội")
+    assert cache.get("Hôm nay trời có mưa không?", GREEDY) is None
+    strict = SemanticCache(embed, str(tmp_path / "strict"), threshold=0.99)
+    strict.put("Thủ đô của Việt Nam là gì?", GREEDY, "Hà Nội")
+    assert strict.get("Thủ đô Việt Nam là thành phố nào?", GREEDY) is None
+    assert cache.stats()["misses"] == 1 and strict.stats()["misses"] == 1
+
+
+def test_other_generation_settings_do_not_match(tmp_path):
+    cache = SemanticCache(embed, str(tmp_path), threshold=0.95)
+    cache.put("Thủ đô của Việt Nam là gì?", GREEDY, "Hà Nội")
+    assert cache.get("Thủ đô của Việt Nam là gì?", SamplingParams(do_sample=False, max_new_tokens=7)) is None
+
+
+def test_index_is_reopened_for_the_same_model_only(tmp_path):
+    SemanticCache(embed, str(tmp_path), namespace="model-a").put("Thủ đô của Việt Nam là gì?", GREEDY, "Hà Nội")
+    assert SemanticCache(embed, str(tmp_path), namespace="model-a").get("Thủ đô của Việt Nam là gì?", GREEDY) == "Hà Nội"
+    assert SemanticCache(embed, str(tmp_path), namespace="model-b").get("Thủ đô của Việt Nam là gì?", GREEDY) is None
+
+
+def test_calibrated_threshold_separates_the_pairs():
+    result = calibrate_threshold(
+        embed,
+        paraphrases=[("Thủ đô của Việt Nam là gì?", "Thủ đô Việt Nam là thành phố nào?")],
+        unrelated=[("Thủ đô của Việt Nam là gì?", "Hôm nay trời có mưa không?")],
+    )
+    assert 0.6 < result["threshold"] <= result["paraphrases"][0] and result["recall"] == 1.0
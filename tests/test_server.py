@@ -0,0 +1,103 @@
+import asyncio
+import json
+import threading
+
+from server import ChatServer
+
+
+class BlockingBot:
+    # Streams two chunks once ``release`` is set.
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    def stream_response(self, instruction, params, history=None, session_id=None):
+        self.started.set()
+        self.release.wait(10)
+        yield "Xin "
+        yield "chào"
+
+
+async def post(port, path, payload):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(payload).encode("utf-8")
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: test\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    headers = dict(line.split(": ", 1) for line in lines[1:])
+    return int(lines[0].split(" ")[1]), headers, body
+
+
+def serve(bot, scenario, **options):
+    async def main():
+        server = ChatServer(bot, port=0, **{"max_concurrency": 2, **options})
+        await server.start()
+        try:
+            return await scenario(server)
+        finally:
+            bot.release.set()
+            server._server.close()
+            await server._server.wait_closed()
+            server._executor.shutdown(wait=True)
+
+    return asyncio.run(main())
+
+
+def test_chat_returns_the_whole_answer():
+    bot = BlockingBot()
+    bot.release.set()
+
+    async def scenario(server):
+        return await post(server.port, "/chat", {"message": "xin chào", "session_id": "s"})
+
+    status, _, body = serve(bot, scenario)
+    assert status == 200 and json.loads(body) == {"response": "Xin chào", "session_id": "s"}
+
+
+def test_full_queue_is_rejected_with_429():
+    bot = BlockingBot()
+
+    async def scenario(server):
+        first = asyncio.ensure_future(post(server.port, "/chat", {"message": "một"}))
+        while not bot.started.is_set():
+            await asyncio.sleep(0.01)
+        status, headers, body = await post(server.port, "/chat", {"message": "hai"})
+        bot.release.set()
+        return status, headers, server.rejected, await first
+
+    status, headers, rejected, first = serve(bot, scenario, max_concurrency=1, max_queue=0)
+    assert status == 429 and headers["Retry-After"] == "1" and rejected == 1
+    assert first[0] == 200
+
+
+def test_slow_generation_times_out_with_504():
+    bot = BlockingBot()
+
+    async def scenario(server):
+        status, _, body = await post(server.port, "/chat", {"message": "xin chào"})
+        return status, json.loads(body), server.timeouts
+
+    status, payload, timeouts = serve(bot, scenario, request_timeout=0.2)
+    assert status == 504 and "exceeded" in payload["error"] and timeouts == 1
+
+
+def test_request_waiting_for_a_worker_times_out_with_504():
+    bot = BlockingBot()
+
+    async def scenario(server):
+        first = asyncio.ensure_future(post(server.port, "/chat", {"message": "một"}))
+        while not bot.started.is_set():
+            await asyncio.sleep(0.01)
+        status, _, body = await post(server.port, "/chat", {"message": "hai"})
+        await first
+        return status, json.loads(body)
+
+    status, payload = serve(bot, scenario, max_concurrency=1, max_queue=1, request_timeout=0.3)
+    assert status == 504 and "waiting for a free worker" in payload["error"]
@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+from engine import SamplingParams
+from session_cache import SessionCacheStore
+
+GREEDY = SamplingParams(do_sample=False, max_new_tokens=12)
+
+
+def fake_cache(tokens, width=8):
+    # One layer of keys and values taking ``tokens * width * 4 * 2`` bytes.
+    tensor = torch.zeros((1, 1, tokens, width))
+    return ((tensor, tensor.clone()),)
+
+
+def test_match_reuses_the_common_prefix():
+    store = SessionCacheStore()
+    store.put("s", [1, 2, 3, 4], fake_cache(4), 4, 1)
+    cache, length = store.match("s", [1, 2, 3, 9, 9])
+    assert length == 3 and cache is not None
+    # At least one prompt token is left for the prefill.
+    assert store.match("s", [1, 2, 3, 4])[1] == 3
+    assert store.match("s", [7, 8]) == (None, 0)
+    assert store.match("other", [1, 2]) == (None, 0)
+    assert (store.hits, store.misses) == (2, 2)
+
+
+def test_match_stops_at_the_cached_length():
+    store = SessionCacheStore()
+    store.put("s", [1, 2, 3, 4, 5], fake_cache(3), 3, 1)
+    assert store.match("s", [1, 2, 3, 4, 5, 6])[1] == 3
+
+
+def test_least_recently_used_sessions_are_evicted():
+    size = 4 * 8 * 4 * 2
+    store = SessionCacheStore(max_bytes=2 * size)
+    store.put("a", [1, 2, 3, 4], fake_cache(4), 4, 1)
+    store.put("b", [1, 2, 3, 4], fake_cache(4), 4, 1)
+    store.match("a", [1, 2, 3, 4])
+    store.put("c", [1, 2, 3, 4], fake_cache(4), 4, 1)
+    assert store.get("b") is None and store.get("a") is not None and store.get("c") is not None
+    assert store.nbytes == 2 * size and store.evictions == 1
+
+
+def test_entry_over_the_budget_is_not_stored():
+    store = SessionCacheStore(max_bytes=100)
+    store.put("s", [1, 2, 3, 4], fake_cache(4), 4, 1)
+    assert store.get("s") is None and store.nbytes == 0
+
+
+def test_replacing_and_discarding_keep_the_size_right():
+    store = SessionCacheStore()
+    store.put("s", [1, 2], fake_cache(2), 2, 1)
+    store.put("s", [1, 2, 3, 4], fake_cache(4), 4, 2)
+    assert store.nbytes == store.get("s").nbytes and store.get("s").turns == 2
+    store.discard("s")
+    assert store.nbytes == 0 and store.stats()["sessions"] == 0
+
+
+@pytest.fixture
+def bot(model, tokenizer):
+    from chatbot import ChatBot
+
+    bot = ChatBot.from_model(model, tokenizer)
+    yield bot
+    bot.engine.stop()
+
+
+def test_next_turn_reuses_the_session_cache(bot):
+    question = "Thủ đô của Việt Nam là gì?"
+    first = bot.generate_response("xin chào", GREEDY, session_id="s", use_cache=False)
+    history = [SimpleNamespace(origin="human", message="xin chào"), SimpleNamespace(origin="ai", message=first)]
+    # The prompt extends the tokens of the previous turn, which are all cached but the last one.
+    input_ids, turns = bot.encode_conversation(question, history, "s")
+    entry = bot.session_cache.get("s")
+    assert turns == 1 and input_ids[:len(entry.token_ids)] == entry.token_ids
+
+    second = bot.generate_response(question, GREEDY, history=history, session_id="s", use_cache=False)
+    assert bot.session_cache.hits == 1
+    assert bot.metrics.recent_requests()[0]["cached_tokens"] == entry.cached_length
+    # The reused prefix gives the same answer as a full prefill of the same prompt.
+    request = bot.engine.submit(input_ids, GREEDY)
+    request.wait(30)
+    assert second == bot.tokenizer.decode(request.output_ids, skip_special_tokens=True).strip()
@@ -0,0 +1,109 @@
+import pytest
+import torch
+
+from benchmark.tiny_model import build_tiny_model
+from engine import InferenceEngine, SamplingParams
+from kv_cache import CacheLayout
+from speculative import SpeculativeEngine
+
+QUESTIONS = [
+    "### Câu hỏi: Thủ đô của Việt Nam là gì?\n### Trả lời:",
+    "### Câu hỏi: Hãy giới thiệu về lịch sử của thành phố Hồ Chí Minh.\n### Trả lời:",
+]
+GREEDY = SamplingParams(do_sample=False, max_new_tokens=24, ignore_eos=True)
+SAMPLED = SamplingParams(do_sample=True, top_k=0, top_p=1.0)
+
+
+@pytest.fixture(scope="module")
+def draft_model(tokenizer):
+    # A smaller model with other weights, so some of its drafts are rejected.
+    return build_tiny_model(tokenizer, hidden_size=32, num_layers=1, num_heads=2, seed=1)
+
+
+def make_engine(model, draft_model, tokenizer, **kwargs):
+    return SpeculativeEngine(model, draft_model, "cpu", tokenizer.eos_token_id, tokenizer.pad_token_id, **kwargs)
+
+
+def generate(engine, tokenizer, params=GREEDY, **kwargs):
+    requests = [engine.submit(tokenizer.encode(question), params, **kwargs) for question in QUESTIONS]
+    engine.run_until_complete()
+    return requests
+
+
+def test_greedy_output_equals_the_main_model(model, draft_model, tokenizer):
+    speculative = make_engine(model, draft_model, tokenizer)
+    plain = InferenceEngine(model, "cpu", tokenizer.eos_token_id, tokenizer.pad_token_id)
+    expected = [request.wait() for request in generate(plain, tokenizer)]
+    assert [request.wait() for request in generate(speculative, tokenizer)] == expected
+    stats = speculative.stats()
+    assert stats["accepted_tokens"] < stats["drafted_tokens"]
+
+
+def test_stats_are_consistent(model, draft_model, tokenizer):
+    engine = make_engine(model, draft_model, tokenizer)
+    requests = generate(engine, tokenizer)
+    stats = engine.stats()
+    assert stats["acceptance_rate"] == pytest.approx(stats["accepted_tokens"] / stats["drafted_tokens"])
+    # Every round yields its accepted drafts plus one token; the first token of a request comes from the prefill.
+    generated = sum(len(request.output_ids) for request in requests) - len(requests)
+    assert stats["tokens_per_round"] == pytest.approx(generated / stats["rounds"])
+    assert generated == stats["accepted_tokens"] + stats["rounds"]
+    assert engine.min_draft_tokens <= stats["num_draft_tokens"] <= engine.max_draft_tokens
+
+
+def test_identical_draft_model_is_always_accepted(model, tokenizer):
+    engine = make_engine(model, model, tokenizer)
+    generate(engine, tokenizer)
+    assert engine.stats()["acceptance_rate"] == 1.0
+
+
+def logits_of(probs):
+    return torch.tensor(probs).log()
+
+
+def test_verify_replaces_a_rejected_draft_from_the_residual(model, draft_model, tokenizer):
+    engine = make_engine(model, draft_model, tokenizer)
+    target = [0.5, 0.5, 0.0, 0.0]
+    draft = torch.tensor([0.0, 0.5, 0.5, 0.0])
+    logits = torch.stack([logits_of(target)] * 3)
+    for seed in range(20):
+        generator = torch.Generator().manual_seed(seed)
+        # Token 1 has p >= q and is always kept; token 2 has p = 0 and is always rejected, and the
+        # residual max(0, p - q) only leaves token 0.
+        tokens = engine._verify([1, 2], [draft, draft], logits, SAMPLED, generator, greedy=False)
+        assert tokens == [1, 0]
+
+
+def test_verify_accepts_with_probability_p_over_q(model, draft_model, tokenizer):
+    engine = make_engine(model, draft_model, tokenizer)
+    target, draft = [0.25, 0.75, 0.0, 0.0], torch.tensor([0.5, 0.5, 0.0, 0.0])
+    logits = torch.stack([logits_of(target)] * 2)
+    generator = torch.Generator().manual_seed(0)
+    runs = [engine._verify([0], [draft], logits, SAMPLED, generator, greedy=False) for _ in range(2000)]
+    accepted = sum(tokens[0] == 0 for tokens in runs) / len(runs)
+    # Token 0 is kept with probability p / q = 0.5; otherwise the residual only leaves token 1.
+    assert accepted == pytest.approx(0.5, abs=0.05)
+    assert all(tokens[0] == 1 for tokens in runs if len(tokens) == 1)
+    assert all(len(tokens) == 2 for tokens in runs if tokens[0] == 0)
+
+
+def test_verify_greedy_keeps_the_matching_prefix(model, draft_model, tokenizer):
+    engine = make_engine(model, draft_model, tokenizer)
+    logits = torch.stack([logits_of([0.1, 0.9, 0.0, 0.0]), logits_of([0.8, 0.2, 0.0, 0.0]), logits_of([0.0, 0.0, 1.0, 0.0])])
+    assert engine._verify([1, 3], [None, None], logits, GREEDY, None, greedy=True) == [1, 0]
+    assert engine._verify([1, 0], [None, None], logits, GREEDY, None, greedy=True) == [1, 0, 2]
+
+
+def test_rejected_drafts_are_truncated_from_the_cache(model, draft_model, tokenizer):
+    engine = make_engine(model, draft_model, tokenizer)
+    requests = generate(engine, tokenizer, keep_cache=True)
+    assert engine.stats()["accepted_tokens"] < engine.stats()["drafted_tokens"]
+    layout = CacheLayout.detect(model, "cpu")
+    for request in requests:
+        sequence = request.prompt_ids + request.output_ids
+        assert layout.length(request.cache) == request.cache_length
+        # The kept cache holds exactly the accepted tokens, as a fresh prefill of them would.
+        expected = model(input_ids=torch.tensor([sequence[:request.cache_length]]), use_cache=True).past_key_values
+        for (key, value), (expected_key, expected_value) in zip(request.cache, expected):
+            torch.testing.assert_close(key, expected_key, atol=1e-4, rtol=1e-4)
+            torch.testing.assert_close(value, expected_value, atol=1e-4, rtol=1e-4)
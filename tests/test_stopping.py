@@ -0,0 +1,49 @@
+from stopping import StopSequenceCriteria, find_stop, partial_stop_length
+
+
+def feed(criteria, token_ids):
+    # Returns the number of tokens fed until the criteria fired, or None.
+    for count, token in enumerate(token_ids, 1):
+        if criteria(token):
+            return count
+    return None
+
+
+def test_stop_string_split_across_tokens(tokenizer):
+    answer = "Hà Nội là thủ đô.\n### Câu hỏi: tiếp theo"
+    token_ids = tokenizer.encode(answer)
+    criteria = StopSequenceCriteria(tokenizer, ["### Câu hỏi:"])
+    fired = feed(criteria, token_ids)
+    assert fired is not None and fired < len(token_ids)
+    assert criteria.text.startswith(answer[:criteria.stop_index])
+    assert criteria.text[criteria.stop_index:].startswith("### Câu hỏi:")
+    kept = tokenizer.decode(token_ids[:criteria.kept_tokens()])
+    assert "###" not in kept
+    assert kept.startswith("Hà Nội là thủ đô.")
+
+
+def test_multibyte_characters_are_decoded_before_matching(tokenizer):
+    # Byte-level tokens split "ờ" into several tokens; the stop string only matches the whole character.
+    token_ids = tokenizer.encode("xin chào, trời đẹp")
+    criteria = StopSequenceCriteria(tokenizer, ["trời"])
+    assert feed(criteria, token_ids) is not None
+    assert criteria.text[criteria.stop_index:].startswith("trời")
+
+
+def test_no_stop_string_keeps_every_token(tokenizer):
+    token_ids = tokenizer.encode("xin chào")
+    criteria = StopSequenceCriteria(tokenizer, ["###", ""])
+    assert feed(criteria, token_ids) is None
+    assert criteria.stop_index is None
+    assert criteria.kept_tokens() == len(token_ids)
+
+
+def test_find_stop_returns_the_earliest_match():
+    assert find_stop("abc ### def <|end|>", ["<|end|>", "###"]) == 4
+    assert find_stop("abc ### def", ["###"], start=5) is None
+    assert find_stop("abc", ["###"]) is None
+
+
+def test_partial_stop_length():
+    assert partial_stop_length("answer ##", ["### Câu hỏi:"]) == 2
+    assert partial_stop_length("answer", ["### Câu hỏi:"]) == 0
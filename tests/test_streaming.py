@@ -0,0 +1,35 @@
+import pytest
+
+from engine import SamplingParams
+from streaming import IncrementalDecoder
+
+GREEDY = SamplingParams(do_sample=False, max_new_tokens=24)
+TEXT = "Thủ đô của Việt Nam là Hà Nội, một thành phố nghìn năm tuổi."
+
+
+def test_chunks_join_to_the_decoded_text(tokenizer):
+    token_ids = tokenizer.encode(TEXT)
+    decoder = IncrementalDecoder(tokenizer)
+    chunks = [decoder.push(token_id) for token_id in token_ids]
+    chunks.append(decoder.flush())
+    assert "".join(chunks) == tokenizer.decode(token_ids) == TEXT
+    # Characters split over several byte-level tokens are held back until they are complete.
+    assert not any("�" in chunk for chunk in chunks)
+    assert len([chunk for chunk in chunks if chunk]) > 1
+
+
+@pytest.fixture
+def bots(model, tokenizer):
+    from chatbot import ChatBot
+
+    bots = [ChatBot.from_model(model, tokenizer) for _ in range(2)]
+    yield bots
+    for bot in bots:
+        bot.engine.stop()
+
+
+def test_streamed_answer_equals_the_generated_one(bots):
+    streaming, blocking = bots
+    chunks = list(streaming.stream_response("Thủ đô của Việt Nam là gì?", GREEDY))
+    assert len(chunks) > 1 and all(chunks)
+    assert "".join(chunks) == blocking.generate_response("Thủ đô của Việt Nam là gì?", GREEDY)
@@ -0,0 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from engine import SamplingParams
+from server import load_bot
+from worker_pool import WorkerPool
+
+GREEDY = SamplingParams(do_sample=False, max_new_tokens=8)
+QUESTIONS = [f"Câu hỏi số {number}: xin chào" for number in range(6)]
+
+
+@pytest.fixture(scope="module")
+def pool():
+    # One slot per worker, so every request reuses the slot the previous one was answered in.
+    pool = WorkerPool("tiny", ["cpu"], slots_per_worker=1, loader=load_bot, max_batch_size=1)
+    yield pool
+    pool.close()
+
+
+def ask(pool, question):
+    return pool.generate_response(question, GREEDY, use_cache=False)
+
+
+def test_concurrent_requests_get_their_own_answers(pool):
+    expected = {question: ask(pool, question) for question in QUESTIONS}
+    questions = QUESTIONS * 8
+    with ThreadPoolExecutor(4) as executor:
+        answers = list(executor.map(lambda question: ask(pool, question), questions))
+    assert answers == [expected[question] for question in questions]
+    assert pool.stats()[0]["in_flight"] == 0
+
+
+def test_abandoned_stream_frees_its_slot(pool):
+    stream = pool.stream_response(QUESTIONS[0], SamplingParams(do_sample=False, max_new_tokens=64, ignore_eos=True), use_cache=False)
+    next(stream)
+    stream.close()
+    unread = pool.stream_response(QUESTIONS[1], GREEDY, use_cache=False)
+    del unread
+    assert ask(pool, QUESTIONS[2]) == ask(pool, QUESTIONS[2])
@@ -0,0 +1,210 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class VectorIndex:
+    """
+    A small on-disk vector index backed by memory-mapped NumPy arrays.
+
+    Vectors are stored L2-normalized in ``vectors.npy`` so a dot product is the cosine
+    similarity, and the payload of every slot is appended to ``entries.jsonl``. Both files are
+    updated incrementally on insert. Once ``capacity`` slots are used, the least recently
+    matched slot is overwritten.
+
+    ``meta.json`` records the namespace (the model that produced the vectors) and the vector
+    dimension. An index written for another namespace is cleared when it is opened, and one of
+    another dimension when a vector is added, since vectors of different models cannot be compared.
+
+    Attributes
+    ----------
+    directory : str
+        Folder holding the index files.
+    capacity : int
+        Maximum number of vectors.
+    size : int
+        Number of stored vectors.
+    namespace : str
+        Identifies the embedding model the vectors come from.
+
+    Methods
+    -------
+    add(vector, payload):
+        Inserts a vector with its payload and returns the slot it was written to.
+
+    search(vector, k=1):
+        Returns the ``k`` most similar slots as ``(similarity, slot, payload)`` tuples.
+
+    touch(slot):
+        Marks a slot as recently used so it is evicted last.
+    """
+
+    def __init__(self, directory, capacity=10000, namespace=""):
+        """
+        Initializes the VectorIndex, reopening existing files in ``directory``.
+
+        Parameters
+        ----------
+        directory : str
+            Folder holding the index files.
+        capacity : int, optional
+            Maximum number of vectors (default is 10000). Ignored for an existing index.
+        namespace : str, optional
+            Identifies the embedding model; an index of another namespace is cleared (default is "").
+        """
+        self.directory = directory
+        self.capacity = capacity
+        self.namespace = namespace
+        self._vectors = None
+        self._last_used = None
+        self._payloads = {}
+        self._log_lines = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(self._path("meta.json"), encoding="utf-8") as f:
+                stored = json.load(f).get("namespace")
+        except (OSError, ValueError):
+            stored = None
+        if stored != namespace:
+            # Vectors of another model, or of an index written before meta.json existed.
+            self._remove_files()
+        if os.path.exists(self._path("vectors.npy")):
+            self._vectors = np.load(self._path("vectors.npy"), mmap_mode="r+")
+            self._last_used = np.load(self._path("last_used.npy"), mmap_mode="r+")
+            self.capacity = self._vectors.shape[0]
+        if os.path.exists(self._path("entries.jsonl")):
+            with open(self._path("entries.jsonl"), encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    self._payloads[record["slot"]] = record["payload"]
+                    self._log_lines += 1
+
+    @property
+    def size(self):
+        """
+        Returns the number of stored vectors.
+
+        Returns
+        -------
+        int
+            Number of used slots.
+        """
+        return len(self._payloads)
+
+    def add(self, vector, payload):
+        """
+        Inserts a vector with its payload.
+
+        Parameters
+        ----------
+        vector : numpy.ndarray
+            1-D embedding; it is normalized before it is stored.
+        payload : dict
+            JSON-serializable data returned together with the vector by ``search``.
+
+        Returns
+        -------
+        int
+            The slot the vector was written to.
+        """
+        vector = _normalize(vector)
+        with self._lock:
+            if self._vectors is not None and self._vectors.shape[1] != vector.shape[0]:
+                self._clear()
+            if self._vectors is None:
+                self._create(vector.shape[0])
+            if self.size < self.capacity:
+                slot = self.size
+            else:
+                slot = int(np.argmin(self._last_used))
+            self._vectors[slot] = vector
+            self._last_used[slot] = time.time()
+            self._vectors.flush()
+            self._last_used.flush()
+            self._payloads[slot] = payload
+            self._append_log(slot, payload)
+            return slot
+
+    def search(self, vector, k=1):
+        """
+        Returns the most similar stored vectors.
+
+        Parameters
+        ----------
+        vector : numpy.ndarray
+            1-D query embedding.
+        k : int, optional
+            Number of results (default is 1).
+
+        Returns
+        -------
+        list of tuple
+            ``(similarity, slot, payload)`` sorted by decreasing cosine similarity.
+        """
+        with self._lock:
+            vector = _normalize(vector)
+            if self._vectors is None or self.size == 0 or self._vectors.shape[1] != vector.shape[0]:
+                return []
+            similarities = self._vectors[:self.size] @ vector
+            k = min(k, self.size)
+            top = np.argpartition(-similarities, k - 1)[:k]
+            top = top[np.argsort(-similarities[top])]
+            return [(float(similarities[slot]), int(slot), self._payloads[int(slot)]) for slot in top]
+
+    def touch(self, slot):
+        """
+        Marks a slot as recently used so it is evicted last.
+
+        Parameters
+        ----------
+        slot : int
+            The slot returned by ``search``.
+        """
+        with self._lock:
+            self._last_used[slot] = time.time()
+
+    def _create(self, dim):
+        self._vectors = np.lib.format.open_memmap(self._path("vectors.npy"), mode="w+", dtype=np.float32, shape=(self.capacity, dim))
+        self._last_used = np.lib.format.open_memmap(self._path("last_used.npy"), mode="w+", dtype=np.float64, shape=(self.capacity,))
+        with open(self._path("meta.json.tmp"), "w", encoding="utf-8") as f:
+            json.dump({"namespace": self.namespace, "dim": dim}, f, ensure_ascii=False)
+        os.replace(self._path("meta.json.tmp"), self._path("meta.json"))
+
+    def _clear(self):
+        self._vectors = None
+        self._last_used = None
+        self._payloads = {}
+        self._log_lines = 0
+        self._remove_files()
+
+    def _remove_files(self):
+        for name in ("meta.json", "vectors.npy", "last_used.npy", "entries.jsonl"):
+            if os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+
+    def _append_log(self, slot, payload):
+        # Overwritten slots leave stale lines behind; rewrite the log once it is mostly stale.
+        if self._log_lines >= 2 * self.capacity:
+            with open(self._path("entries.jsonl.tmp"), "w", encoding="utf-8") as f:
+                for old_slot, old_payload in self._payloads.items():
+                    f.write(json.dumps({"slot": old_slot, "payload": old_payload}, ensure_ascii=False) + "\n")
+            os.replace(self._path("entries.jsonl.tmp"), self._path("entries.jsonl"))
+            self._log_lines = len(self._payloads)
+            return
+        with open(self._path("entries.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps({"slot": slot, "payload": payload}, ensure_ascii=False) + "\n")
+        self._log_lines += 1
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
@@ -0,0 +1,600 @@
+import dataclasses
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+from types import SimpleNamespace
+
+
+class WorkerError(RuntimeError):
+    """
+    Raised when a model worker fails a request or exits while serving it.
+
+    Attributes
+    ----------
+    kind : str or None
+        Class name of the exception raised in the worker, such as "AdmissionError"; None when
+        the worker itself failed.
+    """
+
+    def __init__(self, message, kind=None):
+        super().__init__(message)
+        self.kind = kind
+
+
+class _Worker:
+    """
+    Book-keeping of one worker process inside the pool.
+    """
+
+    def __init__(self, index, device, buffer, slots, slot_bytes):
+        self.index = index
+        self.device = device
+        self.buffer = buffer
+        self.slot_bytes = slot_bytes
+        self.free_slots = list(range(slots))
+        self.requests = {}
+        self.process = None
+        self.inbox = None
+        self.outbox = None
+        self.ready = threading.Event()
+        self.pid = None
+        self.last_pong = 0.0
+        self.restarts = 0
+        self.served = 0
+        self.start_failures = 0
+        self.error = None
+        self.memory = None
+
+    @property
+    def in_flight(self):
+        return len(self.requests)
+
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+
+class _Pending:
+    __slots__ = ("worker", "slot", "events", "read", "worker_done", "reader_done")
+
+    def __init__(self, worker, slot):
+        self.worker = worker
+        self.slot = slot
+        self.events = queue.Queue()
+        self.read = 0
+        # The slot is reused once the worker stopped writing into it and the caller stopped reading it.
+        self.worker_done = False
+        self.reader_done = False
+
+
+class WorkerPool:
+    """
+    A pool of model worker processes serving chat requests.
+
+    Each worker is a separate process owning one ChatBot on one device, so the process that
+    hosts the UI or the HTTP server never loads a model, and a crash on either side does not take
+    the other down. Requests are routed to the least-loaded worker, preferring the worker that
+    served the previous turn of the same session so its KV cache is reused.
+
+    Every worker has a shared-memory segment split into ``slots_per_worker`` slots of
+    ``slot_bytes``. A request is written into a free slot, and the worker writes the answer text
+    into the same slot as it is generated; the queues between the processes only carry small
+    descriptors (request id, slot and byte offsets), so nothing large is pickled. Text that does
+    not fit into the slot is sent inline instead. A slot is only reused once the worker finished
+    the request and the caller copied the answer out of it. A stream the caller stops reading is
+    cancelled in the worker, which stops decoding it.
+
+    A monitor thread pings the workers every ``health_interval`` seconds. A worker that exited or
+    stopped answering is restarted, and its in-flight requests fail with WorkerError. The answers
+    to the pings carry the memory admission state of every worker. An exception raised in a
+    worker is re-raised as a WorkerError whose ``kind`` names its class.
+
+    The pool has the same ``generate_response`` and ``stream_response`` methods as ChatBot, so it
+    can be passed to ChatServer in place of a chatbot. A ``semantic_cache_dir`` among the loader
+    arguments gets a ``worker-<index>`` subfolder per worker: the vector index keeps its size and
+    payloads in memory, so processes sharing its files would overwrite each other's slots.
+
+    Attributes
+    ----------
+    model_path : str
+        Path of the model every worker loads.
+    devices : list of str
+        Device of each worker.
+    capacity : int
+        Number of requests the pool serves at once.
+
+    Methods
+    -------
+    generate_response(instruction, sampling_params=None, history=None, session_id=None, use_cache=True):
+        Returns the complete answer to a question, computed by a worker.
+
+    stream_response(instruction, sampling_params=None, history=None, session_id=None, use_cache=True):
+        Yields the answer to a question chunk by chunk as a worker generates it.
+
+    wait_ready(timeout=None):
+        Blocks until every worker has loaded its model.
+
+    stats():
+        Returns the state of every worker.
+
+    memory_stats():
+        Returns the memory admission state summed over the workers.
+
+    close():
+        Stops the workers and frees the shared memory.
+    """
+
+    def __init__(self, model_path, devices=("cpu",), num_workers=None, slots_per_worker=8, slot_bytes=1024 ** 2,
+                 health_interval=5.0, health_timeout=30.0, loader=None, wait=True, start_timeout=600.0, **bot_kwargs):
+        """
+        Initializes the WorkerPool and starts the workers.
+
+        Parameters
+        ----------
+        model_path : str
+            Path of the model to load in every worker.
+        devices : sequence of str, optional
+            One device per worker (default is a single CPU worker).
+        num_workers : int, optional
+            Number of workers; ``devices`` is repeated to this length (default is one per device).
+        slots_per_worker : int, optional
+            Requests a worker serves at once; should match the engine's batch size (default is 8).
+        slot_bytes : int, optional
+            Size of one shared-memory slot (default is 1 MiB).
+        health_interval : float, optional
+            Seconds between health checks (default is 5).
+        health_timeout : float, optional
+            Seconds without an answer to a ping after which a worker is restarted (default is 30).
+        loader : callable, optional
+            Picklable ``loader(model_path, device, **bot_kwargs)`` returning the worker's chatbot
+            (default loads a ChatBot). ``bot_kwargs`` include ``colocated_workers``, the number of
+            workers on the same device, which splits the memory budget between them.
+        wait : bool, optional
+            Wait until every worker has loaded its model (default is True).
+        start_timeout : float, optional
+            Longest wait for the workers to load (default is 600 seconds).
+        **bot_kwargs
+            Further arguments of the loader, e.g. ``max_batch_size``.
+        """
+        devices = list(devices)
+        if num_workers is not None:
+            devices = list(itertools.islice(itertools.cycle(devices), num_workers))
+        self.model_path = model_path
+        self.devices = devices
+        self.slots_per_worker = slots_per_worker
+        self.slot_bytes = slot_bytes
+        self.capacity = slots_per_worker * len(devices)
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.loader = loader
+        self.bot_kwargs = bot_kwargs
+
+        self._context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._ids = itertools.count()
+        self._affinity = OrderedDict()
+        self._closed = False
+        self._workers = []
+        for index, device in enumerate(devices):
+            buffer = shared_memory.SharedMemory(create=True, size=slots_per_worker * slot_bytes)
+            worker = _Worker(index, device, buffer, slots_per_worker, slot_bytes)
+            self._workers.append(worker)
+            self._start(worker)
+        self._monitor = threading.Thread(target=self._monitor_loop, name="worker-monitor", daemon=True)
+        self._monitor.start()
+        if wait:
+            try:
+                self.wait_ready(start_timeout)
+            except WorkerError:
+                self.close()
+                raise
+
+    def wait_ready(self, timeout=None):
+        """
+        Blocks until every worker has loaded its model.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Longest wait in seconds (default is None, no limit).
+
+        Raises
+        ------
+        WorkerError
+            If a worker keeps failing to load the model, or is still not ready when the timeout expires.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for worker in self._workers:
+            while not worker.ready.wait(0.5):
+                if worker.error is not None:
+                    raise WorkerError(worker.error)
+                if deadline is not None and time.monotonic() > deadline:
+                    raise WorkerError(f"worker {worker.index} ({worker.device}) did not load the model in time")
+
+    def generate_response(self, instruction, sampling_params=None, history=None, session_id=None, use_cache=True):
+        """
+        Returns the complete answer to a question, computed by a worker.
+
+        Parameters are the same as for ChatBot.generate_response.
+
+        Returns
+        -------
+        str
+            The answer of the chatbot.
+        """
+        return "".join(self._request(instruction, sampling_params, history, session_id, use_cache, False))
+
+    def stream_response(self, instruction, sampling_params=None, history=None, session_id=None, use_cache=True):
+        """
+        Yields the answer to a question chunk by chunk as a worker generates it.
+
+        Parameters are the same as for ChatBot.stream_response.
+
+        Yields
+        ------
+        str
+            Consecutive pieces of the answer.
+        """
+        return self._request(instruction, sampling_params, history, session_id, use_cache, True)
+
+    def stats(self):
+        """
+        Returns the state of every worker.
+
+        Returns
+        -------
+        list of dict
+            Device, process id, readiness, in-flight requests, served requests, restarts, the
+            load error and the memory admission state of every worker.
+        """
+        with self._lock:
+            return [
+                {
+                    "worker": worker.index,
+                    "device": worker.device,
+                    "pid": worker.pid,
+                    "ready": worker.ready.is_set(),
+                    "alive": worker.alive(),
+                    "in_flight": worker.in_flight,
+                    "served": worker.served,
+                    "restarts": worker.restarts,
+                    "error": worker.error,
+                    "memory": worker.memory,
+                }
+                for worker in self._workers
+            ]
+
+    def memory_stats(self):
+        """
+        Returns the memory admission state summed over the workers.
+
+        The state is reported with the answers to the health checks, so it is up to
+        ``health_interval`` seconds old.
+
+        Returns
+        -------
+        dict or None
+            Budgets, reservations, memory in use and admission counters added up over the workers
+            that reported them (a budget is None when any worker has none), whether any worker
+            runs with a reduced batch size, and the number of reporting workers; None before the
+            first report.
+        """
+        with self._lock:
+            reports = [worker.memory for worker in self._workers if worker.memory is not None]
+        if not reports:
+            return None
+        total = {}
+        for key, first in reports[0].items():
+            values = [report.get(key) for report in reports]
+            if isinstance(first, bool):
+                total[key] = any(values)
+            elif key == "kv_bytes_per_token":
+                total[key] = first
+            elif any(value is None for value in values):
+                total[key] = None
+            else:
+                total[key] = sum(values)
+        total["workers"] = len(reports)
+        return total
+
+    def close(self):
+        """
+        Stops the workers and frees the shared memory.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._slot_freed.notify_all()
+        for worker in self._workers:
+            if worker.alive():
+                worker.inbox.put(("stop",))
+        for worker in self._workers:
+            worker.process.join(10)
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join()
+            self._fail(worker, "the worker pool was closed")
+            worker.buffer.close()
+            worker.buffer.unlink()
+
+    def _request(self, instruction, sampling_params, history, session_id, use_cache, stream):
+        payload = json.dumps({
+            "instruction": instruction,
+            "params": dataclasses.asdict(sampling_params) if sampling_params is not None else None,
+            "history": [(chat.origin, chat.message) for chat in history or []],
+            "session_id": session_id,
+            "use_cache": use_cache,
+        }).encode("utf-8")
+        if len(payload) > self.slot_bytes:
+            raise ValueError(f"The request has {len(payload)} bytes, a worker slot holds {self.slot_bytes}")
+
+        request_id, pending = self._reserve(session_id)
+        worker = pending.worker
+        start = pending.slot * self.slot_bytes
+        worker.buffer.buf[start:start + len(payload)] = payload
+        worker.inbox.put(("generate", request_id, pending.slot, len(payload), stream))
+        events = self._events(request_id, pending, start)
+        # A generator dropped before its first item never runs its finally block.
+        weakref.finalize(events, self._stop_reading, request_id, pending)
+        return events
+
+    def _events(self, request_id, pending, start):
+        buffer = pending.worker.buffer.buf
+        finished = False
+        try:
+            while True:
+                kind, end, text = pending.events.get()
+                if kind == "error":
+                    finished = True
+                    error_kind, message = text
+                    raise WorkerError(f"{error_kind}: {message}" if error_kind else message, error_kind)
+                if end is not None:
+                    text = bytes(buffer[start + pending.read:start + end]).decode("utf-8")
+                    pending.read = end
+                if kind == "done":
+                    finished = True
+                if text:
+                    yield text
+                if finished:
+                    return
+        finally:
+            self._stop_reading(request_id, pending)
+
+    def _stop_reading(self, request_id, pending):
+        with self._lock:
+            if pending.reader_done:
+                return
+            pending.reader_done = True
+            self._release(pending)
+            cancel = not pending.worker_done
+        if cancel:
+            # The caller stopped reading early: the worker stops generating, then the slot is freed.
+            pending.worker.inbox.put(("cancel", request_id))
+
+    def _release(self, pending):
+        # Must be called with the pool lock held.
+        if pending.worker_done and pending.reader_done:
+            pending.worker.free_slots.append(pending.slot)
+            self._slot_freed.notify()
+
+    def _reserve(self, session_id):
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise WorkerError("the worker pool is closed")
+                if all(worker.error is not None for worker in self._workers):
+                    raise WorkerError("; ".join(worker.error for worker in self._workers))
+                worker = self._route(session_id)
+                if worker is not None:
+                    break
+                self._slot_freed.wait()
+            request_id = next(self._ids)
+            pending = _Pending(worker, worker.free_slots.pop())
+            worker.requests[request_id] = pending
+            if session_id is not None:
+                self._affinity[session_id] = worker.index
+                self._affinity.move_to_end(session_id)
+                if len(self._affinity) > 100_000:
+                    self._affinity.popitem(last=False)
+            return request_id, pending
+
+    def _route(self, session_id):
+        candidates = [worker for worker in self._workers if worker.ready.is_set() and worker.free_slots]
+        if not candidates:
+            return None
+        least = min(candidates, key=lambda worker: worker.in_flight)
+        previous = self._affinity.get(session_id)
+        if previous is not None:
+            worker = self._workers[previous]
+            # Stay on the session's worker (its KV cache holds the conversation) unless it is clearly busier.
+            if worker in candidates and worker.in_flight <= least.in_flight + 1:
+                return worker
+        return least
+
+    def _start(self, worker):
+        worker.ready.clear()
+        worker.memory = None
+        worker.inbox = self._context.Queue()
+        worker.outbox = self._context.Queue()
+        cpu_workers = self.devices.count("cpu") or 1
+        # Workers on one device load at the same time; each takes its share of the memory budget.
+        bot_kwargs = dict(self.bot_kwargs, colocated_workers=self.devices.count(worker.device))
+        if bot_kwargs.get("semantic_cache_dir") is not None:
+            bot_kwargs = dict(bot_kwargs, semantic_cache_dir=os.path.join(bot_kwargs["semantic_cache_dir"], f"worker-{worker.index}"))
+        worker.process = self._context.Process(
+            target=_worker_main,
+            name=f"model-worker-{worker.index}",
+            args=(self.model_path, worker.device, self.loader, bot_kwargs, worker.buffer.name,
+                  self.slots_per_worker, self.slot_bytes, cpu_workers, worker.inbox, worker.outbox),
+            daemon=True,
+        )
+        worker.process.start()
+        worker.last_pong = time.monotonic()
+        threading.Thread(target=self._read_loop, args=(worker, worker.outbox), name=f"worker-reader-{worker.index}",
+                         daemon=True).start()
+
+    def _read_loop(self, worker, outbox):
+        while True:
+            message = outbox.get()
+            kind = message[0]
+            if kind == "exit":
+                return
+            if kind == "ready":
+                worker.pid = message[1]
+                worker.memory = message[2]
+                worker.last_pong = time.monotonic()
+                worker.start_failures = 0
+                worker.ready.set()
+                with self._lock:
+                    self._slot_freed.notify_all()
+            elif kind == "pong":
+                worker.last_pong = time.monotonic()
+                worker.memory = message[2]
+            else:
+                _, request_id, end, text = message
+                with self._lock:
+                    pending = worker.requests.get(request_id)
+                    if pending is None:
+                        continue
+                    if kind != "chunk":
+                        del worker.requests[request_id]
+                        worker.served += 1
+                        pending.worker_done = True
+                        self._release(pending)
+                pending.events.put((kind, end, text))
+
+    def _fail(self, worker, reason):
+        with self._lock:
+            failed = list(worker.requests.values())
+            worker.requests.clear()
+            for pending in failed:
+                pending.worker_done = True
+                self._release(pending)
+            self._slot_freed.notify_all()
+        for pending in failed:
+            pending.events.put(("error", None, (None, reason)))
+
+    def _monitor_loop(self):
+        while True:
+            time.sleep(self.health_interval)
+            if self._closed:
+                return
+            for worker in self._workers:
+                if self._closed:
+                    return
+                if worker.error is not None:
+                    continue
+                if not worker.alive():
+                    reason = f"worker {worker.index} exited with code {worker.process.exitcode}"
+                    if not worker.ready.is_set():
+                        # A worker that cannot even load the model is not restarted forever.
+                        worker.start_failures += 1
+                        if worker.start_failures >= 3:
+                            worker.error = f"{reason} while loading the model, {worker.start_failures} times in a row"
+                            continue
+                elif worker.ready.is_set() and time.monotonic() - worker.last_pong > self.health_timeout:
+                    reason = f"worker {worker.index} stopped responding"
+                    worker.process.terminate()
+                    worker.process.join()
+                else:
+                    if worker.ready.is_set():
+                        worker.inbox.put(("ping", time.monotonic()))
+                    continue
+                worker.ready.clear()
+                worker.outbox.put(("exit",))
+                self._fail(worker, reason)
+                worker.restarts += 1
+                self._start(worker)
+
+
+def _load_chatbot(model_path, device, **bot_kwargs):
+    from chatbot import ChatBot
+
+    return ChatBot(model_path, device=device, **bot_kwargs)
+
+
+def _worker_main(model_path, device, loader, bot_kwargs, buffer_name, slots, slot_bytes, cpu_workers, inbox, outbox):
+    if device == "cpu" and "OMP_NUM_THREADS" not in os.environ:
+        # Workers sharing the CPU split its cores instead of oversubscribing them.
+        from device_policy import available_cpus
+
+        os.environ["OMP_NUM_THREADS"] = str(max(1, available_cpus() // cpu_workers))
+    buffer = shared_memory.SharedMemory(name=buffer_name)
+    bot = (loader or _load_chatbot)(model_path, device, **bot_kwargs)
+    outbox.put(("ready", os.getpid(), _memory_stats(bot)))
+
+    executor = ThreadPoolExecutor(slots, thread_name_prefix="worker-request")
+    cancelled = {}
+    while True:
+        message = inbox.get()
+        if message[0] == "stop":
+            break
+        if message[0] == "ping":
+            outbox.put(("pong", message[1], _memory_stats(bot)))
+            continue
+        if message[0] == "cancel":
+            if message[1] in cancelled:
+                cancelled[message[1]].set()
+            continue
+        cancelled[message[1]] = threading.Event()
+        future = executor.submit(_serve, bot, buffer.buf, slot_bytes, message, outbox, cancelled[message[1]])
+        future.add_done_callback(lambda _, request_id=message[1]: cancelled.pop(request_id, None))
+    executor.shutdown()
+    bot.engine.stop()
+    buffer.close()
+
+
+def _memory_stats(bot):
+    admission = getattr(bot, "admission", None)
+    return admission.stats() if admission is not None else None
+
+
+def _serve(bot, buffer, slot_bytes, message, outbox, cancelled):
+    from engine import SamplingParams
+
+    _, request_id, slot, length, stream = message
+    start = slot * slot_bytes
+    try:
+        payload = json.loads(bytes(buffer[start:start + length]))
+        params = payload["params"]
+        if params is not None:
+            params = SamplingParams(**dict(params, stop=tuple(params.get("stop", ()))))
+        history = [SimpleNamespace(origin=origin, message=text) for origin, text in payload["history"]]
+        arguments = (payload["instruction"], params)
+        options = {"history": history, "session_id": payload["session_id"], "use_cache": payload["use_cache"]}
+        written = 0
+
+        def write(text):
+            # Appends text to the slot; returns (end offset, None), or (None, text) when it does not fit.
+            nonlocal written
+            data = text.encode("utf-8")
+            if written is None or written + len(data) > slot_bytes:
+                written = None
+                return None, text
+            buffer[start + written:start + written + len(data)] = data
+            written += len(data)
+            return written, None
+
+        if stream:
+            chunks = bot.stream_response(*arguments, **options)
+            try:
+                for chunk in chunks:
+                    if cancelled.is_set():
+                        break
+                    outbox.put(("chunk", request_id) + write(chunk))
+            finally:
+                chunks.close()
+            outbox.put(("done", request_id, None, None))
+        else:
+            outbox.put(("done", request_id) + write(bot.generate_response(*arguments, **options)))
+    except Exception as error:
+        outbox.put(("error", request_id, None, (type(error).__name__, str(error))))